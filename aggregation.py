@@ -0,0 +1,193 @@
+"""Module providing the single pass aggregations behind /aggregate"""
+
+import os
+import mmap
+import math
+from collections import Counter
+
+from utils import iter_line_batches
+from block_summary import block_summaries
+from sketches import HeavyHitters, HyperLogLog
+from timestamps import parse_timestamp
+from constants import (
+    AGGREGATE_TOP_K,
+    AGGREGATE_TOP_CAPACITY_FACTOR,
+    TIMESTAMP_MAX_PREFIX,
+)
+
+
+class Aggregate:
+    """Line counts per time bucket, the top values of a field and the distinct count of another.
+
+    An aggregate is filled from batches of lines in one pass over a file, or
+    merged from the partial aggregates (to_dict) of other servers. Only the
+    summaries are kept, never the lines.
+    """
+
+    def __init__(
+        self,
+        bucket=None,
+        top_field=None,
+        distinct_field=None,
+        k=AGGREGATE_TOP_K,
+        time_format=None,
+    ):
+        self.bucket = bucket
+        self.top_field = top_field
+        self.distinct_field = distinct_field
+        self.k = k
+        self.time_format = time_format
+        self.lines = 0
+        self.untimed = 0
+        self.buckets = Counter()
+        self.top = None
+        if top_field:
+            self.top = HeavyHitters(k * AGGREGATE_TOP_CAPACITY_FACTOR)
+        self.distinct = HyperLogLog() if distinct_field else None
+
+    @property
+    def fields(self):
+        """The fields the lines have to be parsed for"""
+        return tuple(
+            dict.fromkeys(
+                field for field in (self.top_field, self.distinct_field) if field
+            )
+        )
+
+    def add(self, lines, rows, fields, reference=None):
+        """Adds the selected rows of a batch of lines, with their parsed fields.
+
+        reference is the mtime of the file, for timestamps without a year.
+        """
+        self.lines += len(rows)
+        if self.bucket:
+            stamps = [
+                parse_timestamp(
+                    lines[row][:TIMESTAMP_MAX_PREFIX].decode(errors="ignore"),
+                    self.time_format,
+                    reference,
+                )
+                for row in rows
+            ]
+            self.buckets.update(
+                math.floor(stamp / self.bucket) * self.bucket
+                for stamp in stamps
+                if stamp is not None
+            )
+            self.untimed += stamps.count(None)
+        if self.top is not None:
+            self.top.update(
+                value for value in fields[self.top_field] if value is not None
+            )
+        if self.distinct is not None:
+            self.distinct.update(
+                value for value in fields[self.distinct_field] if value is not None
+            )
+
+    def merge(self, other):
+        """Adds a partial aggregate of the same request, e.g. from another server"""
+        self.lines += other.lines
+        self.untimed += other.untimed
+        self.buckets.update(other.buckets)
+        if self.top is not None and other.top is not None:
+            self.top.merge(other.top)
+        if self.distinct is not None and other.distinct is not None:
+            self.distinct.merge(other.distinct)
+
+    def to_dict(self):
+        """Serializes the mergeable state, the partial aggregate of a secondary"""
+        return {
+            "lines": self.lines,
+            "untimed": self.untimed,
+            "bucket": self.bucket,
+            "buckets": {str(start): count for start, count in self.buckets.items()},
+            "top_field": self.top_field,
+            "top": self.top.to_dict() if self.top is not None else None,
+            "distinct_field": self.distinct_field,
+            "distinct": self.distinct.to_dict() if self.distinct is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data, k=AGGREGATE_TOP_K):
+        """Restores a partial aggregate, raising ValueError if it is malformed"""
+        try:
+            aggregate = cls(
+                data["bucket"], data["top_field"], data["distinct_field"], k
+            )
+            aggregate.lines = data["lines"]
+            aggregate.untimed = data["untimed"]
+            aggregate.buckets = Counter(
+                {float(start): count for start, count in data["buckets"].items()}
+            )
+            if data["top"] is not None:
+                aggregate.top = HeavyHitters.from_dict(data["top"])
+            if data["distinct"] is not None:
+                aggregate.distinct = HyperLogLog.from_dict(data["distinct"])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError("Invalid partial aggregate") from e
+        return aggregate
+
+    def result(self):
+        """Returns the final, small result"""
+        result = {"lines": self.lines}
+        if self.bucket:
+            result["buckets"] = {
+                "width": self.bucket,
+                "counts": [
+                    [format_bucket(start), count]
+                    for start, count in sorted(self.buckets.items())
+                ],
+                "untimed": self.untimed,
+            }
+        if self.top is not None:
+            result["top"] = {
+                "field": self.top_field,
+                "values": [
+                    {"value": value, "count": count, "max_count": max_count}
+                    for value, count, max_count in self.top.top(self.k)
+                ],
+            }
+        if self.distinct is not None:
+            result["distinct"] = {
+                "field": self.distinct_field,
+                "estimate": self.distinct.estimate(),
+            }
+        return result
+
+
+def parse_bucket(value):
+    """Parses a bucket width in seconds, raising ValueError unless it is a positive number"""
+    if value is None:
+        return None
+    try:
+        bucket = float(value)
+    except ValueError as e:
+        raise ValueError("Invalid bucket") from e
+    if not 0 < bucket < math.inf:
+        raise ValueError("Invalid bucket")
+    return int(bucket) if bucket.is_integer() else bucket
+
+
+def format_bucket(start):
+    """Returns a bucket start as an int when it is a whole number of seconds"""
+    return int(start) if float(start).is_integer() else start
+
+
+def aggregate_file(file_path, aggregate, query, begin=0, end=None, log_filter=None):
+    """Adds the lines of [begin, end) of file_path selected by query to aggregate.
+
+    The memory map is read once, a batch of lines at a time, skipping the
+    blocks whose summary rules out the filter; the query parses only the
+    fields the aggregate needs.
+    """
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm) if end is None else min(end, len(mm))
+            if log_filter is None:
+                log_filter = query.literal_filter()
+            stat = os.fstat(f.fileno())
+            with block_summaries.summary_for(file_path, stat) as summary:
+                batches = iter_line_batches(mm, end, begin, log_filter, summary)
+                for _, lines in batches:
+                    rows, fields = query.select(lines)
+                    aggregate.add(lines, rows, fields, stat.st_mtime)
@@ -0,0 +1,62 @@
+"""Benchmark of the parallel filtered scan against the sequential reader
+
+Generates a log file (2 GB by default) where roughly one line in
+--selectivity matches the filter, then times read_logs_reverse with
+1..N scan workers. Run from the repository root:
+
+    python -m benchmarks.bench_parallel_scan --size-mb 2048 --max-workers 8
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from utils import read_logs_reverse
+from benchmarks.corpus import generate_corpus
+
+
+def time_scan(path, filter_text, limit, workers, repeat):
+    """Returns the best wall time of repeat filtered scans"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        read_logs_reverse(path, filter_text, None, limit, scan_workers=workers)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Runs the benchmark and prints the timings as JSON"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--selectivity", type=int, default=1000000)
+    parser.add_argument("--line-length", type=int, default=120)
+    parser.add_argument("--limit", type=int, default=100)
+    # a regex filter is CPU bound, a plain text one is close to memory bound
+    parser.add_argument("--filter", default=r"request-id=dead\w+")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--file", type=Path, default=None)
+    args = parser.parse_args()
+
+    path = args.file or Path(tempfile.gettempdir()) / f"bench_{args.size_mb}mb.log"
+    if not path.exists():
+        generate_corpus(path, args.size_mb, args.line_length, args.selectivity)
+
+    results = {"file": str(path), "size": path.stat().st_size, "runs": []}
+    sequential = time_scan(path, args.filter, args.limit, 0, args.repeat)
+    results["runs"].append({"workers": 0, "seconds": sequential})
+    for workers in range(1, args.max_workers + 1):
+        seconds = time_scan(path, args.filter, args.limit, workers, args.repeat)
+        results["runs"].append(
+            {"workers": workers, "seconds": seconds, "speedup": sequential / seconds}
+        )
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Benchmark suite for the hot paths of the log scanner
+
+Generates (or reuses) a synthetic corpus and measures:
+
+- reader: read_logs_reverse on the first and a deep page, unfiltered and
+  with a plain text and a regex filter
+- http: /logs latency percentiles under concurrent keep-alive clients
+- websocket: delivery latency of appended lines to many subscribers
+- fanout: /fetch_external_logs against local stand-in secondaries
+
+Results are printed and written as JSON (--output) so runs can be compared
+with benchmarks.compare. Run from the repository root:
+
+    python -m benchmarks.bench_suite --size-mb 1024 --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import platform
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import http.client
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+import utils
+import network_utils
+import stream_session
+from log_catalog import LogCatalog
+from page_cache import page_cache
+from server import LogRequestHandler, BoundedThreadPoolHTTPServer
+from benchmarks.corpus import generate_corpus, NEEDLE
+
+SCENARIOS = ("reader", "http", "websocket", "fanout")
+
+
+def percentiles(samples):
+    """Summarizes latency samples (seconds) in milliseconds"""
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+    }
+
+
+def free_port():
+    """Returns a TCP port that is free right now"""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def use_log_dir(log_dir):
+    """Points the request handlers at the corpus directory"""
+    utils.LOG_DIR = log_dir
+    utils.log_catalog = LogCatalog(log_dir, utils.is_valid_file)
+    stream_session.LOG_DIR = log_dir
+    stream_session.log_catalog = utils.log_catalog
+
+
+def start_http_server(workers, queue_limit=1024):
+    """Starts a pooled HTTP server on a free port, returns it"""
+    handler = type("Handler", (LogRequestHandler,), {})
+    handler.protocol_version = "HTTP/1.1"
+    handler.server_mode = "secondary"
+    handler.scan_workers = 0
+    httpd = BoundedThreadPoolHTTPServer(("localhost", 0), handler, workers, queue_limit)
+    handler.server_port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def bench_reader(path, repeat):
+    """Times first and deep pages of read_logs_reverse with and without filters"""
+    size = path.stat().st_size
+    deep_offset = size // 10
+    # a line start, so deep pages begin exactly at a line
+    with open(path, "rb") as f:
+        f.seek(deep_offset)
+        f.readline()
+        deep_offset = f.tell()
+
+    results = []
+    for filter_name, filter_text in (
+        ("none", None),
+        ("literal", NEEDLE),
+        ("regex", r"request-id=dead\w+"),
+    ):
+        for page, offset in (("first", None), ("deep", deep_offset)):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                logs, next_offset = utils.read_logs_reverse(
+                    path, filter_text, offset, 100
+                )
+                timings.append(time.perf_counter() - start)
+            end = size if offset is None else offset
+            scanned = end - (next_offset or 0)
+            best = min(timings)
+            results.append(
+                {
+                    "filter": filter_name,
+                    "page": page,
+                    "entries": len(logs),
+                    "best_s": best,
+                    "median_s": statistics.median(timings),
+                    "scanned_bytes": scanned,
+                    "throughput_mb_s": scanned / best / (1 << 20) if best else None,
+                }
+            )
+    return results
+
+
+def bench_http(path, clients, requests_per_client, workers):
+    """Measures /logs latency with concurrent keep-alive clients"""
+    httpd = start_http_server(workers)
+    port = httpd.server_address[1]
+    size = path.stat().st_size
+    queries = [
+        f"/logs?filename={path.name}&limit=100",
+        f"/logs?filename={path.name}&limit=100&filter={NEEDLE}",
+        f"/logs?filename={path.name}&limit=100&offset={size // 2}",
+    ]
+
+    def client(number):
+        conn = http.client.HTTPConnection("localhost", port)
+        latencies, errors = [], 0
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            conn.request("GET", queries[(number + i) % len(queries)])
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status != 200
+        conn.close()
+        return latencies, errors
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            outcomes = list(executor.map(client, range(clients)))
+        elapsed = time.perf_counter() - start
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+    latencies = [latency for samples, _ in outcomes for latency in samples]
+    return {
+        "clients": clients,
+        "workers": workers,
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in outcomes),
+        "requests_per_s": len(latencies) / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+def bench_websocket(log_dir, subscribers, lines, interval):
+    """Measures the delay between appending a line and each subscriber receiving it"""
+    path = log_dir / "ws_bench.log"
+    path.write_text("", encoding="utf-8")
+    ws_port = free_port()
+
+    async def scenario():
+        server = asyncio.ensure_future(network_utils.start_websocket_server(ws_port))
+        await asyncio.sleep(0.5)
+        latencies = []
+
+        async def subscriber():
+            async with websockets.connect(f"ws://localhost:{ws_port}") as ws:
+                await ws.send(json.dumps({"file": path.name}))
+                received = 0
+                while received < lines:
+                    message = json.loads(await ws.recv())
+                    now = time.perf_counter()
+                    for line in message.get("log", "").split("\n"):
+                        if "sent=" in line:
+                            latencies.append(now - float(line.split("sent=")[1]))
+                            received += 1
+
+        tasks = [asyncio.ensure_future(subscriber()) for _ in range(subscribers)]
+        await asyncio.sleep(1.0)
+        start = time.perf_counter()
+        with open(path, "a", encoding="utf-8") as f:
+            for i in range(lines):
+                f.write(f"line {i} sent={time.perf_counter()}\n")
+                f.flush()
+                await asyncio.sleep(interval)
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=60)
+        elapsed = time.perf_counter() - start
+        server.cancel()
+        return latencies, elapsed
+
+    latencies, elapsed = asyncio.run(scenario())
+    return {
+        "subscribers": subscribers,
+        "lines": lines,
+        "deliveries_per_s": len(latencies) / elapsed,
+        "latency": percentiles(latencies),
+    }
+
+
+def bench_fanout(path, secondaries, repeat):
+    """Measures /fetch_external_logs against local stand-in secondary servers"""
+    servers = [start_http_server(workers=4) for _ in range(secondaries)]
+    network_utils.SECONDARY_SERVERS[:] = [
+        f"http://localhost:{httpd.server_address[1]}" for httpd in servers
+    ]
+    try:
+        latencies = []
+        cursor = None
+        for _ in range(repeat):
+            query = f"filename={path.name}&limit=100"
+            if cursor:
+                query = f"{query}&cursor={cursor}"
+            start = time.perf_counter()
+            response = network_utils.handle_external_logs(query)
+            latencies.append(time.perf_counter() - start)
+            cursor = response["pagination"]["offset"]
+        statuses = response["servers"]
+    finally:
+        for httpd in servers:
+            httpd.shutdown()
+            httpd.server_close()
+        network_utils.fanout_client.close()
+    return {
+        "secondaries": secondaries,
+        "pages": repeat,
+        "statuses": sorted({status["status"] for status in statuses.values()}),
+        "latency": percentiles(latencies),
+    }
+
+
+def describe_run(args):
+    """Returns the context needed to compare runs"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: str(value) for key, value in vars(args).items()},
+    }
+
+
+def main():
+    """Runs the selected scenarios and writes their results as JSON"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--line-length", type=int, default=120)
+    parser.add_argument("--selectivity", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dir", type=Path, default=None)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--http-workers", type=int, default=8)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--ws-lines", type=int, default=200)
+    parser.add_argument("--ws-interval", type=float, default=0.005)
+    parser.add_argument("--secondaries", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    # measure the readers, not the page cache
+    page_cache.max_bytes = 0
+
+    log_dir = args.dir or Path(tempfile.gettempdir()) / "log_scanner_bench"
+    name = (
+        f"corpus_{args.size_mb}mb_{args.line_length}_{args.selectivity}"
+        f"_{args.seed}.log"
+    )
+    path = log_dir / name
+    if not path.exists():
+        generate_corpus(
+            path, args.size_mb, args.line_length, args.selectivity, args.seed
+        )
+    use_log_dir(log_dir)
+
+    scenarios = args.scenarios.split(",")
+    results = {
+        "run": describe_run(args),
+        "corpus": {"file": str(path), "size": path.stat().st_size},
+    }
+    if "reader" in scenarios:
+        results["reader"] = bench_reader(path, args.repeat)
+    if "http" in scenarios:
+        results["http"] = bench_http(
+            path, args.clients, args.requests, args.http_workers
+        )
+    if "websocket" in scenarios:
+        results["websocket"] = bench_websocket(
+            log_dir, args.subscribers, args.ws_lines, args.ws_interval
+        )
+    if "fanout" in scenarios:
+        results["fanout"] = bench_fanout(path, args.secondaries, args.repeat)
+
+    output = json.dumps(results, indent=4)
+    print(output)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Compares two result files written by benchmarks.bench_suite
+
+Prints every numeric metric found in both files with its ratio (new / old):
+
+    python -m benchmarks.compare baseline.json results.json
+"""
+
+import json
+import argparse
+from pathlib import Path
+
+
+def flatten(data, prefix=""):
+    """Yields (dotted path, value) of the numbers in nested results"""
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        # reader results are identified by their filter and page
+        items = (
+            (
+                (
+                    f"{item['filter']}.{item['page']}"
+                    if isinstance(item, dict) and "filter" in item
+                    else str(i)
+                ),
+                item,
+            )
+            for i, item in enumerate(data)
+        )
+    else:
+        if isinstance(data, (int, float)) and not isinstance(data, bool):
+            yield prefix, data
+        return
+    for key, value in items:
+        yield from flatten(value, f"{prefix}.{key}" if prefix else str(key))
+
+
+def main():
+    """Prints the metrics of both runs side by side"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args = parser.parse_args()
+    old = dict(flatten(json.loads(args.old.read_text(encoding="utf-8"))))
+    new = dict(flatten(json.loads(args.new.read_text(encoding="utf-8"))))
+    for key in old:
+        if key in new and not key.startswith(("run.", "corpus.")):
+            ratio = new[key] / old[key] if old[key] else float("nan")
+            print(f"{key:60} {old[key]:>14.4f} {new[key]:>14.4f} {ratio:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
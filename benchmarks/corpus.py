@@ -0,0 +1,84 @@
+"""Synthetic log corpus generator used by the benchmarks
+
+Writes ISO-8601 stamped lines of about --line-length bytes where roughly one
+line in --selectivity holds NEEDLE. The output only depends on the
+arguments and --seed, so corpora can be regenerated for comparable runs:
+
+    python -m benchmarks.corpus /tmp/corpus/app.log --size-mb 1024
+"""
+
+import random
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+
+NEEDLE = "request-id=deadbeef"
+FILLER = "request-id=cafe"
+WORDS = ["GET", "POST", "user", "cache", "db", "queue", "auth", "retry", "ok", "slow"]
+LEVELS = ["INFO", "INFO", "INFO", "DEBUG", "WARNING", "ERROR"]
+# 2025-01-01T00:00:00Z
+START_TIME = 1735689600
+
+
+def generate_corpus(
+    path, size_mb, line_length=120, selectivity=1000, seed=0, lines_per_second=1000
+):
+    """Writes size_mb of synthetic log lines to path and returns the number of lines.
+
+    Timestamps advance by 1 / lines_per_second per line, so time range
+    queries can be aimed at a known part of the file.
+    """
+    rng = random.Random(seed)
+    target = size_mb << 20
+    written = 0
+    line_no = 0
+    block = []
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target:
+            seconds, fraction = divmod(line_no, lines_per_second)
+            marker = NEEDLE if rng.randrange(selectivity) == 0 else FILLER
+            head = (
+                f"{format_time(START_TIME + seconds)}."
+                f"{fraction * 1000000 // lines_per_second:06d}Z "
+                f"{rng.choice(LEVELS)} worker-{line_no % 32} {marker}"
+            )
+            words = []
+            length = len(head)
+            budget = max(line_length + rng.randrange(-20, 21), len(head) + 1)
+            while length < budget:
+                words.append(rng.choice(WORDS))
+                length += len(words[-1]) + 1
+            line = f"{head} {' '.join(words)}\n"
+            block.append(line)
+            written += len(line)
+            line_no += 1
+            if len(block) >= 10000:
+                f.write("".join(block))
+                block = []
+        f.write("".join(block))
+    return line_no
+
+
+def format_time(epoch):
+    """Formats epoch seconds as an ISO-8601 date and time without zone"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def main():
+    """Generates a corpus from the command line"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--line-length", type=int, default=120)
+    parser.add_argument("--selectivity", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    lines = generate_corpus(
+        args.path, args.size_mb, args.line_length, args.selectivity, args.seed
+    )
+    print(f"{args.path}: {lines} lines")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Module providing per-block summaries of log files, used to skip blocks that cannot match"""
+
+import os
+import re
+import math
+import mmap
+import struct
+import zlib
+import logging
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from functools import lru_cache
+from itertools import repeat
+from contextlib import ExitStack, contextmanager
+
+from timestamps import parse_timestamp
+from constants import (
+    TIMESTAMP_MAX_PREFIX,
+    BLOCK_SUMMARY_SIZE,
+    BLOCK_SUMMARY_BLOOM_BYTES,
+    BLOCK_SUMMARY_GRAM,
+    BLOCK_SUMMARY_HASHES,
+    BLOCK_SUMMARY_INTERVAL,
+    BLOCK_SUMMARY_PASS_BYTES,
+)
+
+SIDECAR_MAGIC = b"LSBS1\n"
+# magic, inode, block size, bloom filter bytes, gram length, hashes, blocks
+HEADER = struct.Struct("<6sQQIBBQ")
+BLOCKS_FIELD = HEADER.size - 8
+# start, stop, lines, min timestamp, max timestamp (NaN without timestamps),
+# followed by the bloom filter of the block
+BLOCK = struct.Struct("<QQQdd")
+
+
+@lru_cache(maxsize=8)
+def gram_regex(gram):
+    """Returns the regex finding the words of at least gram bytes"""
+    return re.compile(rb"\w{%d,}" % gram)
+
+
+def word_grams(data, gram=BLOCK_SUMMARY_GRAM):
+    """Returns the set of lowercase gram byte substrings of the words of data.
+
+    A line holding a filter holds every gram of the filter's words, even
+    where the filter starts or ends inside a word of the line.
+    """
+    words = set(gram_regex(gram).findall(data.lower()))
+    return {
+        word[start : start + gram]
+        for word in words
+        for start in range(len(word) - gram + 1)
+    }
+
+
+def bloom_positions(grams, bits, hashes=BLOCK_SUMMARY_HASHES):
+    """Returns the bloom filter bits of grams, one per gram and hash"""
+    positions = set()
+    for seed in range(hashes):
+        positions.update(value % bits for value in map(zlib.crc32, grams, repeat(seed)))
+    return positions
+
+
+def line_timestamp(line, reference=None):
+    """Returns the epoch seconds of the timestamp starting line, or None"""
+    return parse_timestamp(
+        line[:TIMESTAMP_MAX_PREFIX].decode(errors="ignore"), reference=reference
+    )
+
+
+def first_timestamp(lines, reference=None):
+    """Returns the timestamp of the first timestamped line of lines, NaN if none"""
+    for line in lines:
+        timestamp = line_timestamp(line, reference)
+        if timestamp is not None:
+            return timestamp
+    return math.nan
+
+
+def summarize_block(data, bloom_bytes, gram, hashes, reference=None):
+    """Returns the record of a block of complete lines, without its offsets.
+
+    Lines are taken to be in chronological order, as by find_time_offset,
+    so the min/max timestamps are those of the first and last stamped lines.
+    reference is the mtime of the file, as for find_time_range.
+    """
+    bloom = bytearray(bloom_bytes)
+    for position in bloom_positions(word_grams(data, gram), bloom_bytes * 8, hashes):
+        bloom[position >> 3] |= 1 << (position & 7)
+    lines = data.split(b"\n")
+    earliest = first_timestamp(lines, reference)
+    latest = first_timestamp(reversed(lines), reference)
+    return data.count(b"\n"), earliest, latest, bytes(bloom)
+
+
+class BlockSummary:
+    """The summaries of the blocks of a file, read from its sidecar.
+
+    A block is a run of complete lines of about block_size bytes, so block
+    bounds are line starts. Every block has a bloom filter of the word grams
+    of its lines, its min/max timestamp and its line count. The bytes after
+    the last block are not summarized yet.
+    """
+
+    def __init__(self, data):
+        magic, inode, block_size, bloom_bytes, gram, hashes, blocks = (
+            HEADER.unpack_from(data)
+        )
+        if magic != SIDECAR_MAGIC:
+            raise ValueError("Not a block summary")
+        self.data = data
+        self.inode = inode
+        self.block_size = block_size
+        self.bloom_bytes = bloom_bytes
+        self.gram = gram
+        self.hashes = hashes
+        self.record_size = BLOCK.size + bloom_bytes
+        # records past the end of data are still being written
+        self.blocks = min(blocks, (len(data) - HEADER.size) // self.record_size)
+
+    @property
+    def size(self):
+        """Number of bytes of the file covered by the blocks"""
+        return self.block(self.blocks - 1)[1] if self.blocks else 0
+
+    def block(self, index):
+        """Returns (start, stop, lines, min timestamp, max timestamp) of a block"""
+        return BLOCK.unpack_from(self.data, HEADER.size + index * self.record_size)
+
+    def describes(self, stat):
+        """Checks that the blocks still belong to the file (no rotation or truncation)"""
+        return stat.st_ino == self.inode and stat.st_size >= self.size
+
+    def filter_positions(self, log_filter):
+        """Returns the bloom filter bits every line matching log_filter sets, or None.
+
+        Only literal filters with a word of at least gram bytes can be tested.
+        """
+        if log_filter.literal is None:
+            return None
+        grams = word_grams(log_filter.literal, self.gram)
+        if not grams:
+            return None
+        return sorted(bloom_positions(grams, self.bloom_bytes * 8, self.hashes))
+
+    def may_match(self, index, positions):
+        """Checks if the bloom filter of a block has every bit of positions"""
+        data = self.data
+        base = HEADER.size + index * self.record_size + BLOCK.size
+        return all(
+            data[base + (position >> 3)] >> (position & 7) & 1 for position in positions
+        )
+
+    def candidate_ranges(self, positions, begin, end):
+        """Yields the (start, stop) ranges of [begin, end) to search, newest first.
+
+        Blocks whose bloom filter lacks a bit of positions are left out; the
+        bytes after the last block are always searched. begin has to be a
+        line start, and the ranges start at line starts.
+        """
+        stop = end
+        after = bisect_left(
+            range(self.blocks), end, key=lambda index: self.block(index)[0]
+        )
+        for index in reversed(range(after)):
+            start, block_stop = self.block(index)[:2]
+            if block_stop <= begin:
+                break
+            if self.may_match(index, positions):
+                continue
+            if block_stop < stop:
+                yield block_stop, stop
+            stop = max(start, begin)
+        if stop > begin:
+            yield begin, stop
+
+    def time_bounds(self, moment, after=False):
+        """Returns the (low, high) byte range holding the first line stamped at or after moment.
+
+        With after=True it holds the first line stamped strictly after
+        moment. high is None for the end of the file. Like find_time_offset,
+        lines are assumed to be in chronological order.
+        """
+        for index in range(self.blocks):
+            start, stop, _, _, latest = self.block(index)
+            # NaN (no timestamp in the block) never compares true
+            if latest > moment if after else latest >= moment:
+                return start, stop
+        return self.size, None
+
+
+class BlockSummaries:
+    """Sidecars of per-block summaries of the log files, built in the background.
+
+    Every pass summarizes the complete blocks appended to each file since
+    the last pass and appends their records to the file's sidecar, then
+    updates the block count of its header, so readers only see whole
+    records. A rotated or truncated file is summarized again from the start.
+    """
+
+    def __init__(self):
+        self.summary_dir = None
+        self.block_size = BLOCK_SUMMARY_SIZE
+        self.bloom_bytes = BLOCK_SUMMARY_BLOOM_BYTES
+        self.gram = BLOCK_SUMMARY_GRAM
+        self.hashes = BLOCK_SUMMARY_HASHES
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        """Checks if a sidecar directory was set"""
+        return self.summary_dir is not None
+
+    def sidecar_path(self, file_path):
+        """Returns the sidecar location of a file"""
+        name = str(Path(file_path).resolve()).strip(os.sep).replace(os.sep, "_")
+        return Path(self.summary_dir) / f"{name}.bsum"
+
+    def start(self, summary_dir, list_files, interval=BLOCK_SUMMARY_INTERVAL):
+        """Summarizes the paths returned by list_files in the background"""
+        self.summary_dir = Path(summary_dir)
+        self.summary_dir.mkdir(parents=True, exist_ok=True)
+        self.thread = threading.Thread(
+            target=self.run, args=(list_files, interval), name="summaries", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background summaries"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self, list_files, interval):
+        """Summarizes new blocks every interval seconds"""
+        while not self.stopped.is_set():
+            try:
+                self.summarize_pass(list_files())
+            except OSError as e:
+                logging.error("Block summaries failed: %s", e)
+            self.stopped.wait(interval)
+
+    def summarize_pass(self, paths, budget=BLOCK_SUMMARY_PASS_BYTES):
+        """Summarizes what was appended to paths since the last pass.
+
+        At most about budget bytes are read; the rest waits for the next
+        pass. Returns the number of bytes summarized.
+        """
+        summarized = 0
+        for path in paths:
+            if summarized >= budget:
+                break
+            try:
+                summarized += self.summarize_file(path, budget - summarized)
+            except OSError as e:
+                logging.warning("Could not summarize %s: %s", path, e)
+        return summarized
+
+    def summarize_file(self, path, budget):
+        """Appends the summaries of the complete blocks after the last one, returns their bytes"""
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < self.block_size:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sidecar = self.sidecar_path(path)
+                blocks, start = self.load_state(sidecar, stat)
+                if blocks is None:
+                    blocks, start = 0, 0
+                    self.write_header(sidecar, stat.st_ino)
+                records = []
+                consumed = 0
+                while consumed < budget and start + self.block_size <= stat.st_size:
+                    newline = mm.find(b"\n", start + self.block_size - 1, stat.st_size)
+                    if newline == -1:
+                        break
+                    stop = newline + 1
+                    record = summarize_block(
+                        mm[start:stop],
+                        self.bloom_bytes,
+                        self.gram,
+                        self.hashes,
+                        stat.st_mtime,
+                    )
+                    records.append(BLOCK.pack(start, stop, *record[:3]) + record[3])
+                    consumed += stop - start
+                    start = stop
+        if records:
+            with open(sidecar, "r+b") as f:
+                f.seek(HEADER.size + blocks * (BLOCK.size + self.bloom_bytes))
+                f.write(b"".join(records))
+                f.flush()
+                f.seek(BLOCKS_FIELD)
+                f.write(struct.pack("<Q", blocks + len(records)))
+        return consumed
+
+    def load_state(self, sidecar, stat):
+        """Returns (blocks, bytes covered) of a sidecar still valid for stat, or (None, None)"""
+        try:
+            with open(sidecar, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    summary = BlockSummary(mm)
+                    settings = (
+                        summary.block_size,
+                        summary.bloom_bytes,
+                        summary.gram,
+                        summary.hashes,
+                    )
+                    if settings != (
+                        self.block_size,
+                        self.bloom_bytes,
+                        self.gram,
+                        self.hashes,
+                    ) or not summary.describes(stat):
+                        return None, None
+                    return summary.blocks, summary.size
+        except (OSError, ValueError, struct.error):
+            return None, None
+
+    def write_header(self, sidecar, inode):
+        """Starts an empty sidecar for the file with inode"""
+        header = HEADER.pack(
+            SIDECAR_MAGIC,
+            inode,
+            self.block_size,
+            self.bloom_bytes,
+            self.gram,
+            self.hashes,
+            0,
+        )
+        tmp_path = sidecar.with_suffix(".tmp")
+        tmp_path.write_bytes(header)
+        os.replace(tmp_path, sidecar)
+
+    @contextmanager
+    def summary_for(self, file_path, stat=None):
+        """Yields the BlockSummary of file_path, or None if it has no valid one"""
+        with ExitStack() as stack:
+            summary = None
+            if self.enabled:
+                summary = self.open_summary(file_path, stat, stack)
+            yield summary
+
+    def open_summary(self, file_path, stat, stack):
+        """Maps the sidecar of file_path until stack is closed"""
+        try:
+            if stat is None:
+                stat = os.stat(file_path)
+            f = stack.enter_context(open(self.sidecar_path(file_path), "rb"))
+            mm = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            summary = BlockSummary(mm)
+        except (OSError, ValueError, struct.error):
+            return None
+        return summary if summary.describes(stat) else None
+
+
+block_summaries = BlockSummaries()
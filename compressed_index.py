@@ -0,0 +1,283 @@
+"""Module providing seekable checkpoints for reading compressed log files backwards"""
+
+import os
+import zlib
+import logging
+import tempfile
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple, Any
+
+from log_filter import LogFilter
+from constants import (
+    COMPRESSED_EXTENSIONS,
+    COMPRESSED_CHECKPOINT_INTERVAL,
+    COMPRESSED_READ_SIZE,
+    COMPRESSED_INDEX_MAX_FILES,
+)
+
+try:
+    import zstandard
+except ImportError:  # .zst files are only readable with zstandard installed
+    zstandard = None
+
+
+def compression_of(file_path):
+    """Returns "gzip" or "zstd" for a compressed log file, None for a plain one"""
+    return COMPRESSED_EXTENSIONS.get(Path(file_path).suffix)
+
+
+def is_readable(file_path):
+    """Checks that the compression of file_path, if any, can be decoded here"""
+    return compression_of(file_path) != "zstd" or zstandard is not None
+
+
+def new_decompressor(kind):
+    """Returns a decompressor for one gzip member or zstd frame"""
+    if kind == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading .zst files requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    # 32 + MAX_WBITS accepts the gzip header
+    return zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+
+def iter_decoded(kind, f, in_pos, decompressor):
+    """Decodes f from in_pos in steps of at most COMPRESSED_READ_SIZE bytes.
+
+    Yields (compressed position consumed so far, output, decompressor); the
+    decompressor is replaced by a fresh one whenever a gzip member or zstd
+    frame ends.
+    """
+    f.seek(in_pos)
+    pending = b""
+    while True:
+        if not pending:
+            pending = f.read(COMPRESSED_READ_SIZE)
+            if not pending:
+                return
+        if kind == "gzip":
+            output = decompressor.decompress(pending, COMPRESSED_READ_SIZE)
+            rest = decompressor.unconsumed_tail
+        else:
+            output = decompressor.decompress(pending)
+            rest = b""
+        if decompressor.eof:
+            rest = decompressor.unused_data
+            decompressor = new_decompressor(kind)
+        in_pos += len(pending) - len(rest)
+        pending = rest
+        yield in_pos, output, decompressor
+
+
+class Checkpoint(NamedTuple):
+    """Decoder state at compressed position in_pos, which has produced out_pos bytes"""
+
+    # position in the spill file for zstd files
+    in_pos: int
+    out_pos: int
+    # a copy of the decompressor, None at the start of a member or frame
+    state: Any
+
+
+class CompressedIndex:
+    """Checkpoints taken every `interval` uncompressed bytes of a compressed file.
+
+    The file is decompressed once to build the index; afterwards any block
+    between two checkpoints is decoded on its own by resuming a copy of the
+    saved decompressor. gzip decompressors can be copied, zstd ones cannot:
+    a zstd file is recompressed while the index is built into a temporary
+    spill file of one frame per block, and blocks are decoded from there,
+    so a single frame archive is never decoded from its start again.
+    """
+
+    def __init__(self, kind, stat, interval=COMPRESSED_CHECKPOINT_INTERVAL):
+        self.kind = kind
+        self.inode = stat.st_ino
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.interval = interval
+        self.checkpoints = [Checkpoint(0, 0, None)]
+        self.length = 0
+        # deleted once the index is dropped
+        self.spill = None
+
+    def is_valid_for(self, stat):
+        """Checks that the file was not replaced or rewritten"""
+        return (stat.st_ino, stat.st_size, stat.st_mtime) == (
+            self.inode,
+            self.size,
+            self.mtime,
+        )
+
+    def build(self, f):
+        """Decompresses the whole file once, recording the checkpoints"""
+        if self.kind == "zstd":
+            self.build_spill(f)
+            return
+        out_pos = 0
+        decompressor = new_decompressor(self.kind)
+        for in_pos, output, decompressor in iter_decoded(self.kind, f, 0, decompressor):
+            out_pos += len(output)
+            if self.due(out_pos):
+                self.checkpoints.append(
+                    Checkpoint(in_pos, out_pos, decompressor.copy())
+                )
+        self.length = out_pos
+
+    def build_spill(self, f):
+        """Recompresses a zstd file as one independent frame per block"""
+        decompressor = new_decompressor(self.kind)
+        # the spill is read far more often than written, speed over ratio
+        compressor = zstandard.ZstdCompressor(level=1)
+        self.spill = tempfile.TemporaryFile(prefix="log_scanner-", suffix=".zst")
+        window = bytearray()
+        spill_pos = 0
+        for _, output, decompressor in iter_decoded(self.kind, f, 0, decompressor):
+            window += output
+            while len(window) >= self.interval:
+                spill_pos += self.spill_block(
+                    compressor, window[: self.interval], spill_pos
+                )
+                del window[: self.interval]
+        if window:
+            self.spill_block(compressor, window, spill_pos)
+        self.spill.flush()
+
+    def spill_block(self, compressor, data, spill_pos):
+        """Appends a block to the spill file, returns the size of its frame"""
+        if self.length:
+            self.checkpoints.append(Checkpoint(spill_pos, self.length, None))
+        frame = compressor.compress(bytes(data))
+        self.spill.write(frame)
+        self.length += len(data)
+        return len(frame)
+
+    def due(self, out_pos):
+        """Checks if a checkpoint at out_pos is far enough from the last one"""
+        return out_pos - self.checkpoints[-1].out_pos >= self.interval
+
+    def block_of(self, offset):
+        """Returns the number of the block holding the byte before offset"""
+        out_positions = [checkpoint.out_pos for checkpoint in self.checkpoints]
+        return max(bisect_right(out_positions, offset - 1) - 1, 0)
+
+    def read_range(self, f, block, start, stop):
+        """Decodes the uncompressed bytes [start, stop) of a block.
+
+        Decoding resumes at the checkpoint of the block, drops the output
+        before start and stops as soon as stop is reached, so only the
+        window is held in memory. zstd blocks are a single frame of the
+        spill file.
+        """
+        checkpoint = self.checkpoints[block]
+        if self.spill is not None:
+            frame_end = (
+                self.checkpoints[block + 1].in_pos
+                if block + 1 < len(self.checkpoints)
+                else os.fstat(self.spill.fileno()).st_size
+            )
+            frame = os.pread(
+                self.spill.fileno(), frame_end - checkpoint.in_pos, checkpoint.in_pos
+            )
+            data = zstandard.ZstdDecompressor().decompress(frame) if frame else b""
+            return data[start - checkpoint.out_pos : stop - checkpoint.out_pos]
+        if checkpoint.state is None:
+            decompressor = new_decompressor(self.kind)
+        else:
+            decompressor = checkpoint.state.copy()
+
+        output = []
+        position = checkpoint.out_pos
+        for _, data, _ in iter_decoded(self.kind, f, checkpoint.in_pos, decompressor):
+            if position + len(data) > start:
+                output.append(data[max(start - position, 0) :])
+            position += len(data)
+            if position >= stop:
+                break
+        return b"".join(output)[: stop - start]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_compressed_index(file_path, f):
+    """Returns the checkpoints of file_path, building them on first use"""
+    key = str(file_path)
+    stat = os.fstat(f.fileno())
+    with _indexes_lock:
+        index = _indexes.pop(key, None)
+    if index is None or not index.is_valid_for(stat):
+        index = CompressedIndex(
+            compression_of(file_path), stat, COMPRESSED_CHECKPOINT_INTERVAL
+        )
+        logging.debug("Building checkpoints of %s", file_path)
+        index.build(f)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > COMPRESSED_INDEX_MAX_FILES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def uncompressed_length(file_path):
+    """Returns the length of the uncompressed stream of file_path"""
+    with open(file_path, "rb") as f:
+        return get_compressed_index(file_path, f).length
+
+
+def iter_line_spans(data, end, begin):
+    """Yields the (start, stop) spans of the lines of data[begin:end], newest first"""
+    while end > begin:
+        start = max(data.rfind(b"\n", begin, end) + 1, begin)
+        yield start, end
+        end = start - 1
+
+
+def iter_compressed_lines(file_path, filter_text=None, offset=None, limit=100, begin=0):
+    """Yields (start, line bytes) of a compressed file in [begin, offset), newest first.
+
+    Offsets are positions in the uncompressed stream. Only the blocks
+    holding the page are decoded, in windows of at most
+    COMPRESSED_CHECKPOINT_INTERVAL bytes; a line crossing a window is carried
+    over to the window before it. Returns the next offset (None at the start).
+    """
+    log_filter = LogFilter(filter_text) if filter_text else None
+    found_logs = 0
+    with open(file_path, "rb") as f:
+        index = get_compressed_index(file_path, f)
+        end = index.length if offset is None else min(offset, index.length)
+        block = index.block_of(end)
+        carry = b""
+        while end > begin:
+            base = max(
+                index.checkpoints[block].out_pos, end - COMPRESSED_CHECKPOINT_INTERVAL
+            )
+            data = index.read_range(f, block, base, end) + carry
+            # the head of a window is the tail of a line begun in the one before
+            lines_start = 0
+            if base > 0:
+                newline = data.find(b"\n")
+                lines_start = len(data) if newline == -1 else newline + 1
+            lines_start = max(lines_start, begin - base)
+            if log_filter is None:
+                spans = iter_line_spans(data, len(data), lines_start)
+            else:
+                spans = log_filter.iter_matching_lines(data, len(data), lines_start)
+            for start, stop in spans:
+                line = data[start:stop]
+                # Empty lines are skipped
+                if not line.strip():
+                    continue
+                yield base + start, line
+                found_logs += 1
+                if found_logs >= limit:
+                    return base + start if base + start > begin else None
+            carry = data[:lines_start]
+            end = base
+            if base == index.checkpoints[block].out_pos:
+                block -= 1
+    return None
@@ -7,6 +7,14 @@ DEFAULT_PRIMARY_PORT = 8080
 DEFAULT_SECONDARY_PORT = 8082
 WS_PORT = 8081
 CHUNK_SIZE = 8192
+# Reverse page reads take CHUNK_SIZE bytes first, then chunks sized from the
+# average line length seen so far to hold the rest of the page, capped at
+# CHUNK_MAX_SIZE bytes
+CHUNK_MAX_SIZE = 1 << 20
+# where/fields queries parse blocks of this many bytes at first, doubling up
+# to CHUNK_MAX_SIZE, or batches of this many lines found by a filter
+QUERY_BLOCK_SIZE = 64 << 10
+QUERY_BATCH_LINES = 1024
 HOSTNAME = "localhost"
 ALLOWED_EXTENSIONS = {
     ".log",
@@ -24,3 +32,167 @@ SECONDARY_SERVERS = [
     "http://localhost:8082",
     "http://localhost:8084",
 ]
+
+# Replicas serving the same logs as a secondary server, queried as hedges
+# when it is slow, e.g. {"http://localhost:8082": ["http://localhost:8086"]}
+SECONDARY_REPLICAS = {}
+
+# WebSocket servers of the secondary servers, followed by fleet subscriptions
+# over one upstream connection each, reopened with a back-off between these
+# bounds (seconds) when it fails
+SECONDARY_WS_SERVERS = [
+    "ws://localhost:8083",
+    "ws://localhost:8085",
+]
+FLEET_RECONNECT_MIN_DELAY = 0.5
+FLEET_RECONNECT_MAX_DELAY = 30.0
+
+# Sparse line-offset index: one newline-count checkpoint every LINE_INDEX_STRIDE
+# bytes, at most LINE_INDEX_MAX_FILES indexes kept in memory. Set
+# LINE_INDEX_SIDECAR_DIR to a writable directory to persist indexes on disk.
+# Growth is appended to a sidecar as a record of the new checkpoints, the
+# sidecar is rewritten in one record once it holds LINE_INDEX_SIDECAR_MAX_RECORDS.
+LINE_INDEX_STRIDE = 65536
+LINE_INDEX_MAX_FILES = 64
+LINE_INDEX_SIDECAR_DIR = None
+LINE_INDEX_SIDECAR_MAX_RECORDS = 64
+
+# Size of the newline aligned windows searched by regex filters
+FILTER_WINDOW_SIZE = 1 << 20
+
+# Parallel scan of filtered reads: only files of at least PARALLEL_SCAN_MIN_SIZE
+# bytes are split into PARALLEL_SCAN_RANGE_SIZE ranges. Enabled with --scan-workers
+PARALLEL_SCAN_MIN_SIZE = 64 << 20
+PARALLEL_SCAN_RANGE_SIZE = 16 << 20
+
+# Thread pool HTTP serving (--http-workers): connections admitted beyond the
+# workers before answering 503, and idle keep-alive timeout in seconds
+HTTP_QUEUE_LIMIT = 64
+HTTP_KEEPALIVE_TIMEOUT = 5
+
+# Shared WebSocket tailers: lines buffered per client before the oldest are
+# dropped, bytes read per wakeup, frame size and batching delay (seconds),
+# polling back-off bounds without inotify and the safety timeout with inotify
+TAIL_QUEUE_LINES = 10000
+TAIL_READ_SIZE = 1 << 20
+TAIL_FRAME_MAX_BYTES = 256 << 10
+TAIL_FRAME_MAX_DELAY = 0.05
+TAIL_POLL_MIN_INTERVAL = 0.05
+TAIL_POLL_MAX_INTERVAL = 1.0
+TAIL_WATCH_TIMEOUT = 5.0
+
+# Log file catalog: refresh interval (seconds) when inotify is unavailable and
+# number of memoized filename patterns
+CATALOG_TTL = 2.0
+CATALOG_MAX_PATTERNS = 256
+
+# Fan-out client for the secondary servers: total and connect timeouts
+# (seconds), pooled connections overall and per host, idle keep-alive (seconds)
+FANOUT_TIMEOUT = 10
+FANOUT_CONNECT_TIMEOUT = 2
+FANOUT_MAX_CONNECTIONS = 100
+FANOUT_LIMIT_PER_HOST = 8
+FANOUT_KEEPALIVE_TIMEOUT = 30
+
+# Cluster queries: default deadline (seconds, `deadline` query parameter),
+# delay before a replica is hedged, and circuit breaker failure threshold
+# and cooldown (seconds)
+FANOUT_DEADLINE = 3.0
+FANOUT_HEDGE_DELAY = 0.2
+FANOUT_BREAKER_THRESHOLD = 3
+FANOUT_BREAKER_COOLDOWN = 30.0
+
+# Streamed NDJSON responses are written in chunks of about this many bytes
+NDJSON_FLUSH_SIZE = 65536
+
+# Response compression: bodies and WebSocket messages smaller than these many
+# bytes are sent uncompressed; gzip and zstd (if installed) levels
+COMPRESSION_MIN_SIZE = 1024
+WS_COMPRESSION_MIN_SIZE = 512
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Time range lookups only parse this many bytes at the start of a line
+TIMESTAMP_MAX_PREFIX = 64
+# Syslog stamps have no year: the year of the file mtime is taken, or the one
+# before when that would put the line more than this many seconds after it
+SYSLOG_MAX_AHEAD = 86400
+
+# Compressed logs: suffixes read through decompression, uncompressed bytes
+# between seek checkpoints, compressed bytes read per call and number of
+# checkpointed files kept in memory
+COMPRESSED_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+COMPRESSED_CHECKPOINT_INTERVAL = 4 << 20
+COMPRESSED_READ_SIZE = 64 << 10
+COMPRESSED_INDEX_MAX_FILES = 16
+
+# Page result cache memory budget in bytes (--page-cache-mb), 0 disables it
+PAGE_CACHE_MAX_BYTES = 64 << 20
+# Approximate memory used by a cached record besides its line bytes
+PAGE_CACHE_RECORD_OVERHEAD = 100
+# Larger pages are streamed without being buffered for the cache
+PAGE_CACHE_MAX_PAGE_BYTES = 4 << 20
+# Files whose truncation generation is remembered, least recently read dropped
+FILE_GENERATIONS_MAX_FILES = 4096
+
+# Full-text search index: directory (--search-index, None disables /search),
+# seconds between indexing passes and bytes indexed per pass. Segments are
+# merged in size tiers: once SEARCH_INDEX_MERGE_FACTOR of the newest segments
+# share a tier they are merged into one of the next tier. Past
+# SEARCH_INDEX_MAX_SEGMENTS the smallest adjacent run is merged whatever the tiers.
+SEARCH_INDEX_DIR = None
+SEARCH_INDEX_INTERVAL = 5.0
+SEARCH_INDEX_PASS_BYTES = 64 << 20
+SEARCH_INDEX_MERGE_FACTOR = 4
+SEARCH_INDEX_MAX_SEGMENTS = 32
+
+# Logging level of the servers (--log-level)
+LOG_LEVEL = "INFO"
+
+# /metrics histogram buckets: request latencies in seconds and bytes per page read
+METRICS_LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+METRICS_SIZE_BUCKETS = (1 << 10, 1 << 14, 1 << 18, 1 << 22, 1 << 26, 1 << 30)
+
+# Sampling profiler (/debug/profile, enabled with --profiler): seconds
+# between stack samples, and longest profile in seconds
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+
+# /aggregate: number of top values returned by default, heavy hitter
+# counters kept per top value asked for, and HyperLogLog precision
+# (2 ** HLL_PRECISION registers, about 1.6% standard error at 12)
+AGGREGATE_TOP_K = 10
+AGGREGATE_TOP_CAPACITY_FACTOR = 10
+HLL_PRECISION = 12
+
+# Block summaries (--block-summaries): directory of the sidecars (None
+# disables them), bytes per block, bloom filter bytes per block, length of
+# the word grams put in the bloom filters and hashes per gram, seconds
+# between summarizing passes and bytes summarized per pass
+BLOCK_SUMMARY_DIR = None
+BLOCK_SUMMARY_SIZE = 1 << 20
+BLOCK_SUMMARY_BLOOM_BYTES = 64 << 10
+BLOCK_SUMMARY_GRAM = 5
+BLOCK_SUMMARY_HASHES = 1
+BLOCK_SUMMARY_INTERVAL = 5.0
+BLOCK_SUMMARY_PASS_BYTES = 64 << 20
+
+# Multiplexed WebSocket streams: subscriptions per connection, files a glob
+# subscription may follow and lines a subscription may ask to backfill
+WS_MAX_SUBSCRIPTIONS = 64
+WS_SUBSCRIPTION_MAX_FILES = 64
+WS_BACKFILL_MAX_LINES = 10000
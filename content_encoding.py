@@ -0,0 +1,131 @@
+"""Module providing HTTP content encoding negotiation and WebSocket compression"""
+
+import zlib
+
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+from websockets.frames import OP_TEXT, OP_BINARY
+
+from constants import GZIP_LEVEL, ZSTD_LEVEL, WS_COMPRESSION_MIN_SIZE
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+# Encodings we can produce and decode, most preferred first
+SUPPORTED_ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)
+ACCEPT_ENCODING = ", ".join(SUPPORTED_ENCODINGS)
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks the supported encoding with the highest q-value of an Accept-Encoding header.
+
+    Ties go to the order of SUPPORTED_ENCODINGS. Returns None for identity.
+    """
+    weights = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class StreamCompressor:
+    """Incremental compressor whose output is decodable after every compress() call"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        """Compresses data and flushes it so the client can decode it right away"""
+        if self.encoding == "zstd":
+            flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            flush_mode = zlib.Z_SYNC_FLUSH
+        return self.compressor.compress(data) + self.compressor.flush(flush_mode)
+
+    def finish(self):
+        """Ends the compressed stream"""
+        return self.compressor.flush()
+
+
+def compress(data, encoding):
+    """Compresses a whole body with encoding"""
+    stream = StreamCompressor(encoding)
+    return stream.compress(data) + stream.finish()
+
+
+def decompress(data, encoding):
+    """Decodes a body sent with the Content-Encoding encoding"""
+    if not encoding or encoding == "identity":
+        return data
+    if encoding == "gzip":
+        return zlib.decompress(data, 47)
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that sends messages under min_size uncompressed.
+
+    RFC 7692 lets every message choose: an uncompressed one simply has RSV1
+    unset and does not touch the compression context.
+    """
+
+    def __init__(self, *args, min_size=WS_COMPRESSION_MIN_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+
+    def encode(self, frame):
+        if (
+            frame.opcode in (OP_TEXT, OP_BINARY)
+            and frame.fin
+            and len(frame.data) < self.min_size
+        ):
+            return frame
+        return super().encode(frame)
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    """Negotiates permessage-deflate like the websockets defaults, with a size threshold"""
+
+    def __init__(self, min_size=WS_COMPRESSION_MIN_SIZE):
+        super().__init__(
+            server_max_window_bits=12,
+            client_max_window_bits=12,
+            compress_settings={"memLevel": 5},
+        )
+        self.min_size = min_size
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            min_size=self.min_size,
+        )
@@ -0,0 +1,132 @@
+"""Module providing the long-lived HTTP client used to query the secondary servers"""
+
+import time
+import asyncio
+import threading
+
+import aiohttp
+
+from constants import (
+    FANOUT_TIMEOUT,
+    FANOUT_CONNECT_TIMEOUT,
+    FANOUT_MAX_CONNECTIONS,
+    FANOUT_LIMIT_PER_HOST,
+    FANOUT_KEEPALIVE_TIMEOUT,
+    FANOUT_BREAKER_THRESHOLD,
+    FANOUT_BREAKER_COOLDOWN,
+)
+from content_encoding import ACCEPT_ENCODING
+
+
+class CircuitBreaker:
+    """Stops querying a server after `threshold` consecutive failures.
+
+    Once open, one probe request is let through every `cooldown` seconds; a
+    success closes the breaker again.
+    """
+
+    def __init__(
+        self, threshold=FANOUT_BREAKER_THRESHOLD, cooldown=FANOUT_BREAKER_COOLDOWN
+    ):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        """Checks if a request may be sent, letting one probe through after cooldown"""
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        """Closes the breaker"""
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        """Counts a failure, opening the breaker at the threshold"""
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class FanoutClient:
+    """A pooled aiohttp session living on a background event loop.
+
+    HTTP handler threads submit coroutines with run(), so connections, DNS
+    lookups and the loop itself are reused across requests. Every request is
+    bounded by the session timeouts, so a stuck host only delays its own
+    result. Responses are requested compressed and decoded with
+    content_encoding.decompress. Circuit breakers per server live on the same loop.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the background loop once"""
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    target=self.loop.run_forever, name="fanout-loop", daemon=True
+                )
+                self.thread.start()
+
+    def run(self, coro):
+        """Runs coro on the background loop and waits for its result"""
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        # the session timeouts bound every request, this only guards the caller
+        return future.result(timeout=FANOUT_TIMEOUT + FANOUT_CONNECT_TIMEOUT)
+
+    async def get_session(self):
+        """Returns the shared session, creating it on first use"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=FANOUT_MAX_CONNECTIONS,
+                limit_per_host=FANOUT_LIMIT_PER_HOST,
+                keepalive_timeout=FANOUT_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            )
+            # bodies are decoded by the caller, which also understands zstd
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept-Encoding": ACCEPT_ENCODING},
+                auto_decompress=False,
+                timeout=aiohttp.ClientTimeout(
+                    total=FANOUT_TIMEOUT, connect=FANOUT_CONNECT_TIMEOUT
+                ),
+            )
+        return self.session
+
+    def breaker(self, server):
+        """Returns the circuit breaker of server"""
+        if server not in self.breakers:
+            self.breakers[server] = CircuitBreaker(
+                FANOUT_BREAKER_THRESHOLD, FANOUT_BREAKER_COOLDOWN
+            )
+        return self.breakers[server]
+
+    def close(self):
+        """Closes the session and stops the background loop"""
+        if self.loop is None:
+            return
+        if self.session is not None:
+            self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.session = None
+
+
+fanout_client = FanoutClient()
@@ -0,0 +1,164 @@
+"""Module providing the where and fields queries evaluated over blocks of parsed lines"""
+
+import re
+import json
+import operator
+from functools import partial
+from itertools import compress, repeat
+
+from log_parsers import PARSERS
+from log_filter import LogFilter
+
+# field, operator and a bare or double quoted value, e.g. status>=500 or msg~"time ?out"
+PREDICATE = re.compile(
+    r'\s*([\w.-]+)\s*(!=|!~|>=|<=|=|~|>|<)\s*("(?:[^"\\]|\\.)*"|[^\s"]+)\s*'
+)
+CONJUNCTION = re.compile(r"and\s+", re.IGNORECASE)
+# values made of these characters appear verbatim in any line holding them
+VERBATIM = re.compile(r"[A-Za-z0-9_.:-]+")
+COMPARISONS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+}
+
+
+def to_number(value):
+    """Returns value as a float, or None if it is not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def regex_test(regex, negate, value):
+    """Checks if regex finds a match in value (or does not, with negate)"""
+    found = value is not None and regex.search(value) is not None
+    return found != negate
+
+
+def number_test(compare, number, value):
+    """Checks value against number, False for values that are not numbers"""
+    value = to_number(value)
+    return value is not None and compare(value, number)
+
+
+class Predicate:
+    """One field comparison of a where clause, tested on a column at a time"""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+        if op in ("=", "!="):
+            # operator.eq and ne run as C calls over a whole column
+            self.test = partial(operator.eq if op == "=" else operator.ne, value)
+        elif op in ("~", "!~"):
+            try:
+                self.test = partial(regex_test, re.compile(value), op == "!~")
+            except re.error as e:
+                raise ValueError(f"Invalid regex for {field}") from e
+        else:
+            number = to_number(value)
+            if number is None:
+                raise ValueError(f"{field}{op} needs a number")
+            self.test = partial(number_test, COMPARISONS[op], number)
+
+    @property
+    def literal(self):
+        """Bytes that every line matching an equality has to hold, or None"""
+        if self.op == "=" and VERBATIM.fullmatch(self.value):
+            return self.value.encode("utf-8")
+        return None
+
+
+def parse_where(where):
+    """Parses "field=value and field>number ..." into Predicates"""
+    predicates = []
+    position = 0
+    while True:
+        match = PREDICATE.match(where, position)
+        if match is None:
+            raise ValueError("Invalid where clause")
+        field, op, value = match.groups()
+        if value.startswith('"'):
+            try:
+                value = json.loads(value)
+            except ValueError as e:
+                raise ValueError("Invalid where clause") from e
+        predicates.append(Predicate(field, op, value))
+        position = match.end()
+        if position == len(where):
+            return predicates
+        conjunction = CONJUNCTION.match(where, position)
+        if conjunction is None:
+            raise ValueError("Invalid where clause")
+        position = conjunction.end()
+
+
+class FieldQuery:
+    """A where clause and the fields to return, evaluated a block of lines at a time.
+
+    The lines of a block are first narrowed to those holding the literal
+    value of every equality, then only the fields the query needs are parsed
+    for them, as one column per field. Every predicate is tested over its
+    column with map/compress, narrowing the candidates as it goes.
+    """
+
+    def __init__(self, where=None, parser="logfmt", fields=()):
+        if parser not in PARSERS:
+            raise ValueError("Invalid parser")
+        self.where = where
+        self.parser = parser
+        self.parse = PARSERS[parser]
+        self.predicates = parse_where(where) if where else []
+        self.fields = tuple(fields)
+        self.literals = [
+            predicate.literal
+            for predicate in self.predicates
+            if predicate.literal is not None
+        ]
+        wanted = [predicate.field for predicate in self.predicates] + list(fields)
+        self.columns = tuple(dict.fromkeys(wanted))
+
+    @property
+    def key(self):
+        """Identifies the query in the page cache"""
+        return (self.parser, self.where, self.fields)
+
+    def literal_filter(self):
+        """Returns a LogFilter finding the lines with the longest literal, or None"""
+        if not self.literals:
+            return None
+        return LogFilter(max(self.literals, key=len).decode("utf-8"))
+
+    def select(self, lines):
+        """Returns the selected rows of lines, ascending, and their requested fields.
+
+        The fields are {field: [value per selected row]}, or None if no fields
+        were requested. Empty lines are never selected.
+        """
+        rows = list(compress(range(len(lines)), map(bytes.strip, lines)))
+        for literal in self.literals:
+            holds = map(
+                operator.contains, map(lines.__getitem__, rows), repeat(literal)
+            )
+            rows = list(compress(rows, holds))
+        if not rows:
+            return [], ({field: [] for field in self.fields} if self.fields else None)
+
+        if not self.columns:
+            return rows, None
+        columns = self.parse(list(map(lines.__getitem__, rows)), self.columns)
+        kept = range(len(rows))
+        for predicate in self.predicates:
+            values = map(columns[predicate.field].__getitem__, kept)
+            kept = list(compress(kept, map(predicate.test, values)))
+        fields = None
+        if self.fields:
+            fields = {
+                field: list(map(columns[field].__getitem__, kept))
+                for field in self.fields
+            }
+        return list(map(rows.__getitem__, kept)), fields
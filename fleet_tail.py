@@ -0,0 +1,267 @@
+"""Module providing the live tails of the secondary servers, shared and merged by the primary"""
+
+import json
+import asyncio
+import logging
+from collections import deque
+
+import websockets
+
+from tail_hub import dropped_lines
+from metrics import metrics
+from constants import (
+    SECONDARY_WS_SERVERS,
+    TAIL_QUEUE_LINES,
+    TAIL_FRAME_MAX_DELAY,
+    FANOUT_CONNECT_TIMEOUT,
+    FLEET_RECONNECT_MIN_DELAY,
+    FLEET_RECONNECT_MAX_DELAY,
+)
+
+fleet_upstreams = metrics.gauge(
+    "log_scanner_fleet_upstreams",
+    "Connected upstream WebSockets to the secondary servers",
+)
+fleet_reconnects = metrics.counter(
+    "log_scanner_fleet_reconnects_total",
+    "Upstream WebSockets to a secondary server that failed or closed",
+    ("server",),
+)
+
+
+class FleetSubscription:
+    """One client's view of the fleet: a bounded frame buffer with drop accounting.
+
+    Frames are the (fields, lines) of the messages of the secondary servers.
+    When the client cannot keep up the oldest frames are dropped and their
+    lines counted, so that it can be told how many lines it skipped.
+    """
+
+    def __init__(self, log_filter=None, max_lines=TAIL_QUEUE_LINES):
+        self.log_filter = log_filter
+        self.max_lines = max_lines
+        self.frames = deque()
+        self.queued = 0
+        self.skipped = 0
+        self.ready = asyncio.Event()
+
+    def push(self, fields, lines=()):
+        """Buffers a frame of the lines that pass the filter, dropping the oldest on overflow.
+
+        A frame without lines (a status or error message) is always kept.
+        """
+        if lines and self.log_filter is not None:
+            lines = [line for line in lines if self.log_filter.matches_text(line)]
+            if not lines:
+                return
+        self.frames.append((fields, lines))
+        self.queued += len(lines)
+        while self.queued > self.max_lines and len(self.frames) > 1:
+            _, dropped = self.frames.popleft()
+            self.queued -= len(dropped)
+            self.skipped += len(dropped)
+            dropped_lines.inc(len(dropped))
+        self.ready.set()
+
+    def skip(self, count):
+        """Counts lines a secondary server could not send"""
+        self.skipped += count
+        self.ready.set()
+
+    async def next_frame(self):
+        """Waits for a frame and returns (skipped, fields, lines), fields None if only skipped"""
+        await self.ready.wait()
+        await asyncio.sleep(TAIL_FRAME_MAX_DELAY)
+        fields, lines = None, ()
+        if self.frames:
+            fields, lines = self.frames.popleft()
+            self.queued -= len(lines)
+        if not self.frames:
+            self.ready.clear()
+        skipped, self.skipped = self.skipped, 0
+        return skipped, fields, lines
+
+
+class UpstreamFeed:
+    """A file name or glob followed on one secondary server, shared by local subscriptions"""
+
+    def __init__(self, name):
+        self.name = name
+        self.subscribers = set()
+        # file path on the secondary: offset after the last line received
+        self.offsets = {}
+
+    def publish(self, fields, lines=()):
+        """Hands a frame to every subscriber"""
+        for subscription in self.subscribers:
+            subscription.push(fields, lines)
+
+    def skip(self, count):
+        """Tells every subscriber about lines the secondary server skipped"""
+        for subscription in self.subscribers:
+            subscription.skip(count)
+
+
+class UpstreamConnection:
+    """One WebSocket to a secondary server carrying a subscription per followed name.
+
+    Every name is subscribed once with the secondary's multiplexed protocol,
+    using the name as subscription id, and with the offsets of the lines
+    already received so that a dropped connection resumes where it stopped.
+    Lost connections are opened again with an exponential back-off.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.feeds = {}
+        self.websocket = None
+        # names subscribed on the current connection
+        self.subscribed = set()
+        self.sending = set()
+        self.task = None
+
+    def start(self):
+        """Starts connecting to the secondary server"""
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Closes the connection"""
+        if self.task is not None:
+            self.task.cancel()
+
+    def follow(self, name, subscription):
+        """Adds subscription to the feed of name, subscribing upstream if needed"""
+        feed = self.feeds.get(name)
+        if feed is None:
+            feed = self.feeds[name] = UpstreamFeed(name)
+            self.in_background(self.subscribe_feeds())
+        feed.subscribers.add(subscription)
+
+    def unfollow(self, name, subscription):
+        """Removes subscription, unsubscribing upstream once nobody follows name"""
+        feed = self.feeds.get(name)
+        if feed is None:
+            return
+        feed.subscribers.discard(subscription)
+        if feed.subscribers:
+            return
+        del self.feeds[name]
+        if name in self.subscribed:
+            self.subscribed.discard(name)
+            self.in_background(self.send(action="unsubscribe", id=name))
+
+    def in_background(self, coroutine):
+        """Runs coroutine in a task that is kept until it is done"""
+        task = asyncio.create_task(coroutine)
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, **fields):
+        """Sends a JSON message, dropped if the connection is down"""
+        if self.websocket is None:
+            return
+        try:
+            await self.websocket.send(json.dumps(fields))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def subscribe_feeds(self):
+        """Subscribes the feeds not subscribed on the current connection yet"""
+        if self.websocket is None:
+            return
+        for name, feed in list(self.feeds.items()):
+            if name in self.subscribed:
+                continue
+            self.subscribed.add(name)
+            await self.send(
+                action="subscribe", id=name, file=name, resume=dict(feed.offsets)
+            )
+
+    async def run(self):
+        """Keeps the connection open and dispatches its messages"""
+        delay = FLEET_RECONNECT_MIN_DELAY
+        lost = False
+        while True:
+            try:
+                async with websockets.connect(
+                    self.server, open_timeout=FANOUT_CONNECT_TIMEOUT, max_size=None
+                ) as websocket:
+                    self.websocket = websocket
+                    fleet_upstreams.inc()
+                    try:
+                        await self.subscribe_feeds()
+                        if lost:
+                            self.publish_status(connected=True)
+                            lost = False
+                        delay = FLEET_RECONNECT_MIN_DELAY
+                        async for message in websocket:
+                            self.dispatch(message)
+                    finally:
+                        self.websocket = None
+                        self.subscribed.clear()
+                        fleet_upstreams.dec()
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                logging.warning("Upstream %s failed: %s", self.server, e)
+            if not lost:
+                self.publish_status(connected=False)
+                lost = True
+            fleet_reconnects.inc(server=self.server)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, FLEET_RECONNECT_MAX_DELAY)
+
+    def publish_status(self, **fields):
+        """Tells the subscribers of every feed about the connection"""
+        for feed in self.feeds.values():
+            feed.publish({"server": self.server, **fields})
+
+    def dispatch(self, message):
+        """Hands a message of the secondary server to the feed it belongs to"""
+        try:
+            fields = json.loads(message)
+        except ValueError:
+            return
+        feed = self.feeds.get(fields.pop("id", None))
+        if feed is None:
+            return
+        if "error" in fields:
+            feed.publish({"server": self.server, "error": fields["error"]})
+        elif "skipped" in fields:
+            feed.skip(fields["skipped"])
+        elif "log" in fields:
+            lines = fields.pop("log").split("\n")
+            offset = fields.pop("offset", None)
+            feed.publish(fields, lines)
+            if offset is not None:
+                feed.offsets[fields.get("file")] = offset
+        elif "offset" in fields:
+            feed.offsets[fields.get("file")] = fields["offset"]
+
+
+class FleetHub:
+    """Keeps one UpstreamConnection per secondary server, shared by all fleet subscriptions"""
+
+    def __init__(self, servers=None):
+        self.servers = SECONDARY_WS_SERVERS if servers is None else servers
+        self.connections = {}
+
+    def subscribe(self, name, log_filter=None):
+        """Returns a FleetSubscription receiving the new lines of name on every secondary"""
+        subscription = FleetSubscription(log_filter)
+        for server in self.servers:
+            connection = self.connections.get(server)
+            if connection is None:
+                connection = self.connections[server] = UpstreamConnection(server)
+                connection.start()
+            connection.follow(name, subscription)
+        return subscription
+
+    def unsubscribe(self, name, subscription):
+        """Removes the subscription and closes the connections nobody needs anymore"""
+        for server, connection in list(self.connections.items()):
+            connection.unfollow(name, subscription)
+            if not connection.feeds:
+                connection.stop()
+                del self.connections[server]
+
+
+fleet_hub = FleetHub()
@@ -0,0 +1,231 @@
+"""Module providing a sparse line-offset index for log files"""
+
+import os
+import json
+import mmap
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+
+from constants import (
+    LINE_INDEX_STRIDE,
+    LINE_INDEX_MAX_FILES,
+    LINE_INDEX_SIDECAR_DIR,
+    LINE_INDEX_SIDECAR_MAX_RECORDS,
+)
+
+
+class LineIndex:
+    """Sparse index of newline counts taken every `stride` bytes of a file.
+
+    checkpoints[i] holds the number of newlines in the first i * stride bytes,
+    so any line number can be turned into a byte position (and back) by
+    jumping to the nearest checkpoint and scanning at most one stride.
+    """
+
+    def __init__(self, inode, stride=LINE_INDEX_STRIDE):
+        self.inode = inode
+        self.stride = stride
+        self.size = 0
+        self.mtime = 0.0
+        self.checkpoints = array("Q", [0])
+        # newlines between the last checkpoint and self.size
+        self.tail_lines = 0
+        # checkpoints and records already in the sidecar, 0 records means rewrite it
+        self.saved_checkpoints = 0
+        self.sidecar_records = 0
+
+    @property
+    def total_lines(self):
+        """Number of newlines in the indexed part of the file"""
+        return self.checkpoints[-1] + self.tail_lines
+
+    def is_valid_for(self, stat):
+        """Checks that the index still describes the file (no rotation or rewrite)"""
+        if stat.st_ino != self.inode or stat.st_size < self.size:
+            return False
+        # same size but touched means the content was rewritten in place
+        return not (stat.st_size == self.size and stat.st_mtime != self.mtime)
+
+    def extend(self, mm, stat):
+        """Indexes the bytes appended since the last call"""
+        indexed = (len(self.checkpoints) - 1) * self.stride
+        boundary = indexed + self.stride
+        while boundary <= stat.st_size:
+            self.checkpoints.append(
+                self.checkpoints[-1] + mm[indexed:boundary].count(b"\n")
+            )
+            indexed = boundary
+            boundary += self.stride
+        self.tail_lines = mm[indexed : stat.st_size].count(b"\n")
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    def offset_for_line(self, mm, line):
+        """Returns the byte position where line number `line` (0-based) starts"""
+        if line <= 0:
+            return 0
+        if line > self.total_lines:
+            return self.size
+        block = bisect_left(self.checkpoints, line) - 1
+        position = block * self.stride - 1
+        for _ in range(line - self.checkpoints[block]):
+            position = mm.find(b"\n", position + 1, self.size)
+        return position + 1
+
+    def line_for_offset(self, mm, offset):
+        """Returns the number of lines that start before byte position `offset`"""
+        offset = max(0, min(offset, self.size))
+        block = min(offset // self.stride, len(self.checkpoints) - 1)
+        start = block * self.stride
+        return self.checkpoints[block] + mm[start:offset].count(b"\n")
+
+    def header(self):
+        """Returns the first sidecar line, identifying the indexed file"""
+        return {"inode": self.inode, "stride": self.stride}
+
+    def record(self):
+        """Returns a sidecar line with the checkpoints not saved yet and the current tail"""
+        return {
+            "size": self.size,
+            "mtime": self.mtime,
+            "checkpoints": self.checkpoints[self.saved_checkpoints :].tolist(),
+            "tail_lines": self.tail_lines,
+        }
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Restores an index from a header and records, stopping at a torn record"""
+        header = json.loads(lines[0])
+        index = cls(header["inode"], header["stride"])
+        index.checkpoints = array("Q")
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+                checkpoints = record["checkpoints"]
+                size, mtime = record["size"], record["mtime"]
+                tail_lines = record["tail_lines"]
+            except (ValueError, KeyError):
+                # appends after a torn record would be lost, rewrite the sidecar
+                index.sidecar_records = 0
+                break
+            index.checkpoints.extend(checkpoints)
+            index.size, index.mtime, index.tail_lines = size, mtime, tail_lines
+            index.sidecar_records += 1
+        if not index.checkpoints:
+            raise ValueError("no readable records")
+        index.saved_checkpoints = len(index.checkpoints)
+        return index
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+# one [lock, users] entry per file, extending an index does not hold up the
+# other files. An entry is only dropped once no thread holds or waits on it.
+_file_locks = {}
+
+
+def get_sidecar_path(file_path):
+    """Returns the sidecar location for a file or None when sidecars are disabled"""
+    if LINE_INDEX_SIDECAR_DIR is None:
+        return None
+    name = str(Path(file_path).resolve()).strip(os.sep).replace(os.sep, "_")
+    return Path(LINE_INDEX_SIDECAR_DIR) / f"{name}.lidx"
+
+
+def load_sidecar(file_path):
+    """Loads a previously saved index for file_path if one exists"""
+    sidecar = get_sidecar_path(file_path)
+    if sidecar is None or not sidecar.is_file():
+        return None
+    try:
+        with open(sidecar, "r", encoding="utf-8") as f:
+            return LineIndex.from_lines(f.read().splitlines())
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        logging.warning("Ignoring unreadable line index %s: %s", sidecar, e)
+        return None
+
+
+def save_sidecar(file_path, index):
+    """Appends the growth of the index to its sidecar, ignoring failures.
+
+    A rebuilt index, or a sidecar holding LINE_INDEX_SIDECAR_MAX_RECORDS
+    records, is rewritten in full as a header and a single record.
+    """
+    sidecar = get_sidecar_path(file_path)
+    if sidecar is None:
+        return
+    try:
+        if 0 < index.sidecar_records < LINE_INDEX_SIDECAR_MAX_RECORDS:
+            with open(sidecar, "a", encoding="utf-8") as f:
+                f.write(json.dumps(index.record()) + "\n")
+            index.sidecar_records += 1
+        else:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = sidecar.with_suffix(".tmp")
+            index.saved_checkpoints = 0
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(index.header()) + "\n")
+                f.write(json.dumps(index.record()) + "\n")
+            os.replace(tmp_path, sidecar)
+            index.sidecar_records = 1
+        index.saved_checkpoints = len(index.checkpoints)
+    except OSError as e:
+        # the next save starts the sidecar over
+        index.sidecar_records = 0
+        logging.warning("Could not write line index %s: %s", sidecar, e)
+
+
+def get_line_index(file_path, mm, stat):
+    """Returns an up to date index for file_path, building or extending it lazily"""
+    key = str(file_path)
+    with _indexes_lock:
+        entry = _file_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            with _indexes_lock:
+                index = _indexes.get(key)
+            if index is None:
+                index = load_sidecar(file_path)
+            if index is None or not index.is_valid_for(stat):
+                index = LineIndex(stat.st_ino)
+            if index.size != stat.st_size:
+                index.extend(mm, stat)
+                save_sidecar(file_path, index)
+            with _indexes_lock:
+                _indexes.pop(key, None)
+                _indexes[key] = index
+                while len(_indexes) > LINE_INDEX_MAX_FILES:
+                    evicted, _ = _indexes.popitem(last=False)
+                    if _file_locks.get(evicted, [None, 0])[1] == 0:
+                        _file_locks.pop(evicted, None)
+    finally:
+        with _indexes_lock:
+            entry[1] -= 1
+            if entry[1] == 0 and key not in _indexes:
+                _file_locks.pop(key, None)
+    return index
+
+
+def line_to_offset(file_path, line):
+    """Converts a line number cursor into the byte offset used by read_logs_reverse"""
+    with open(file_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return get_line_index(file_path, mm, stat).offset_for_line(mm, line)
+
+
+def offset_to_line(file_path, offset):
+    """Converts a byte offset cursor into the number of lines before it"""
+    with open(file_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return get_line_index(file_path, mm, stat).line_for_offset(mm, offset)
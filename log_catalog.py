@@ -0,0 +1,177 @@
+"""Module providing the cached catalog of valid log files in the log directory"""
+
+import os
+import re
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from tail_hub import (
+    DirectoryWatch,
+    IN_MODIFY,
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+)
+from constants import CATALOG_TTL, CATALOG_MAX_PATTERNS
+
+CATALOG_WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+)
+
+
+class LogFileInfo(NamedTuple):
+    """A catalogued log file"""
+
+    name: str
+    path: Path
+    real_path: Path
+    size: int
+    mtime: float
+
+
+class LogCatalog:
+    """Valid log files of a directory with their size, mtime and real path.
+
+    The catalog is kept fresh by an inotify watch on the directory, which lets
+    it update only the entries that changed. Without inotify it is refreshed
+    every `ttl` seconds: a full rescan when the directory mtime moved, a cheap
+    stat of the known files otherwise. The latest file is tracked on every
+    update and regex lookups are memoized until files are added or removed.
+    """
+
+    def __init__(self, log_dir, validate, ttl=CATALOG_TTL):
+        self.log_dir = Path(log_dir)
+        self.validate = validate
+        self.ttl = ttl
+        self.entries = {}
+        self.latest_name = None
+        self.matches = {}
+        self.watch = None
+        self.dir_mtime = None
+        self.refreshed_at = None
+        self.lock = threading.RLock()
+
+    def describe(self, path):
+        """Returns the LogFileInfo of path or None if it is not a valid log file"""
+        try:
+            if not self.validate(path):
+                return None
+            real_path = path.resolve(strict=True)
+            stat = real_path.stat()
+        except OSError:
+            return None
+        return LogFileInfo(path.name, path, real_path, stat.st_size, stat.st_mtime)
+
+    def rescan(self):
+        """Rebuilds the catalog from a full directory listing"""
+        entries = {}
+        with os.scandir(self.log_dir) as it:
+            for entry in it:
+                info = self.describe(self.log_dir / entry.name)
+                if info is not None:
+                    entries[info.name] = info
+        self.entries = entries
+        self.matches.clear()
+        self.find_latest()
+        self.dir_mtime = os.stat(self.log_dir).st_mtime
+
+    def restat(self):
+        """Refreshes size and mtime of the known files"""
+        for name, info in list(self.entries.items()):
+            try:
+                stat = info.real_path.stat()
+            except OSError:
+                del self.entries[name]
+                self.matches.clear()
+                continue
+            self.entries[name] = info._replace(size=stat.st_size, mtime=stat.st_mtime)
+        self.find_latest()
+
+    def update_entry(self, name):
+        """Re-examines a single directory entry reported by inotify"""
+        info = self.describe(self.log_dir / name)
+        previous = self.entries.pop(name, None)
+        if info is not None:
+            self.entries[name] = info
+        if (previous is None) != (info is None):
+            self.matches.clear()
+
+        if info is not None and (
+            self.latest_name is None
+            or info.mtime >= self.entries[self.latest_name].mtime
+        ):
+            self.latest_name = name
+        elif self.latest_name == name:
+            self.find_latest()
+
+    def find_latest(self):
+        """Recomputes the latest modified file"""
+        self.latest_name = max(
+            self.entries, key=lambda name: self.entries[name].mtime, default=None
+        )
+
+    def refresh(self):
+        """Brings the catalog up to date, cheaply when nothing changed"""
+        now = time.monotonic()
+        if self.refreshed_at is None:
+            try:
+                self.watch = DirectoryWatch(self.log_dir, CATALOG_WATCH_MASK)
+            except OSError as e:
+                logging.info("Catalog of %s uses a TTL: %s", self.log_dir, e)
+            self.rescan()
+            self.refreshed_at = now
+        elif self.watch is not None:
+            names = self.watch.read_names()
+            # the empty name means events were lost
+            if "" in names:
+                self.rescan()
+            else:
+                for name in names:
+                    self.update_entry(name)
+        elif now - self.refreshed_at >= self.ttl:
+            if os.stat(self.log_dir).st_mtime != self.dir_mtime:
+                self.rescan()
+            else:
+                self.restat()
+            self.refreshed_at = now
+
+    def latest(self):
+        """Returns the name of the latest modified log file or None"""
+        with self.lock:
+            self.refresh()
+            return self.latest_name
+
+    def first_match(self, file_pattern):
+        """Returns the path of the first file whose name matches the regex pattern"""
+        with self.lock:
+            self.refresh()
+            if file_pattern not in self.matches:
+                if len(self.matches) >= CATALOG_MAX_PATTERNS:
+                    self.matches.clear()
+                pattern = re.compile(file_pattern)
+                self.matches[file_pattern] = next(
+                    (name for name in self.entries if pattern.match(name)), None
+                )
+            name = self.matches[file_pattern]
+            return None if name is None else self.entries[name].path
+
+    def list_files(self, file_pattern=None):
+        """Returns the catalogued files, latest modified first"""
+        pattern = re.compile(file_pattern) if file_pattern else None
+        with self.lock:
+            self.refresh()
+            files = [
+                info
+                for info in self.entries.values()
+                if pattern is None or pattern.match(info.name)
+            ]
+        files.sort(key=lambda info: info.mtime, reverse=True)
+        return [
+            {"name": info.name, "size": info.size, "mtime": info.mtime}
+            for info in files
+        ]
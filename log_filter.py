@@ -0,0 +1,188 @@
+"""Module providing the byte-level filter engine used for the /logs filter"""
+
+import re
+
+from metrics import metrics
+from constants import FILTER_WINDOW_SIZE
+
+REGEX_SPECIAL_CHARS = frozenset(".^$*+?{}[]\\|()")
+# escapes, inline flags, negated sets and a "." not repeating with * or +
+REGEX_CHAR_TOKENS = re.compile(r"\\(.)|\(\?[a-zA-Z]|\[\^|\.(?![*+])", re.DOTALL)
+# escapes that mean the same on bytes as on text
+BYTE_SAFE_ESCAPES = frozenset("ntrfvAZ")
+
+# with log_scanner_read_lines_total{filtered="true"} this gives the filter hit ratio
+filter_scanned_lines = metrics.counter(
+    "log_scanner_filter_scanned_lines_total",
+    "Lines filtered reads went through, matching or not",
+)
+
+
+def count_lines(buffer, begin, end):
+    """Counts the newlines of buffer[begin:end], a window at a time"""
+    count = 0
+    while begin < end:
+        stop = min(begin + FILTER_WINDOW_SIZE, end)
+        count += buffer[begin:stop].count(b"\n")
+        begin = stop
+    return count
+
+
+def is_literal(filter_text) -> bool:
+    """Checks if filter_text has no regex meaning and can be matched with find"""
+    return not REGEX_SPECIAL_CHARS.intersection(filter_text)
+
+
+def is_byte_safe(filter_text) -> bool:
+    """Checks that a regex matches the same lines on UTF-8 bytes as on text.
+
+    Non-ASCII patterns, Unicode classes such as \\w or \\d, inline flags
+    (case folding) and anything matching exactly one character (".", [^...])
+    would work on bytes instead of characters.
+    """
+    if not filter_text.isascii():
+        return False
+    for token in REGEX_CHAR_TOKENS.finditer(filter_text):
+        escaped = token.group(1)
+        if escaped is None or (escaped.isalpha() and escaped not in BYTE_SAFE_ESCAPES):
+            return False
+    return True
+
+
+class LogFilter:
+    """A filter compiled once per request and matched against raw file bytes.
+
+    Literal filters are located with mmap.rfind, regex filters with a compiled
+    bytes pattern when is_byte_safe. Other regexes keep their str semantics
+    by searching the decoded window. Only the lines around a hit are ever
+    sliced.
+    """
+
+    def __init__(self, filter_text):
+        self.filter_text = filter_text
+        self.regex = None
+        self.text_regex = None
+        self.window_regex = None
+        if is_literal(filter_text):
+            self.literal = filter_text.encode("utf-8")
+            return
+        self.literal = None
+        self.text_regex = re.compile(filter_text)
+        # MULTILINE keeps ^ and $ anchored to line boundaries inside the buffer
+        if is_byte_safe(filter_text):
+            self.regex = re.compile(filter_text.encode("utf-8"), re.MULTILINE)
+        else:
+            self.window_regex = re.compile(filter_text, re.MULTILINE)
+
+    def matches(self, line) -> bool:
+        """Checks a single line (bytes, without its newline)"""
+        if self.literal is not None:
+            return self.literal in line
+        if self.regex is None:
+            return self.matches_text(line.decode("utf-8", "surrogateescape"))
+        return self.regex.search(line) is not None
+
+    def matches_text(self, line) -> bool:
+        """Checks a single already decoded line"""
+        if self.literal is not None:
+            return self.filter_text in line
+        return self.text_regex.search(line) is not None
+
+    def iter_matching_lines(self, mm, end, begin=0):
+        """Yields (start, stop) byte spans of matching lines in [begin, end), newest first
+
+        begin has to be the start of a line. The lines gone through, down to
+        the last one yielded if the caller stops early, are counted in
+        filter_scanned_lines.
+        """
+        scanned_from = end
+        try:
+            if self.literal is not None:
+                spans = self._iter_literal(mm, end, begin)
+            elif self.regex is not None:
+                spans = self._iter_regex(mm, end, begin)
+            else:
+                spans = self._iter_text_regex(mm, end, begin)
+            for start, stop in spans:
+                scanned_from = start
+                yield start, stop
+            scanned_from = begin
+        finally:
+            filter_scanned_lines.inc(count_lines(mm, scanned_from, end))
+
+    def _iter_literal(self, mm, end, begin):
+        # lines never contain a newline, so such a needle can never match
+        if b"\n" in self.literal:
+            return
+        while end > begin:
+            hit = mm.rfind(self.literal, begin, end)
+            if hit == -1:
+                return
+            newline = mm.rfind(b"\n", begin, hit)
+            start = begin if newline == -1 else newline + 1
+            stop = mm.find(b"\n", hit + len(self.literal), end)
+            yield start, end if stop == -1 else stop
+            end = start
+
+    def _iter_regex(self, mm, end, begin):
+        while end > begin:
+            # newline aligned window ending at end, searched forwards
+            window_start = self._window_start(mm, end, begin)
+
+            spans = []
+            position = window_start
+            while position <= end:
+                match = self.regex.search(mm, position, end)
+                if match is None:
+                    break
+                hit = match.start()
+                newline = mm.rfind(b"\n", window_start, hit)
+                start = window_start if newline == -1 else newline + 1
+                stop = mm.find(b"\n", hit, end)
+                stop = end if stop == -1 else stop
+                # a match running past the end of its line has to be re-checked
+                if match.end() <= stop or self.matches(mm[start:stop]):
+                    spans.append((start, stop))
+                position = stop + 1
+
+            yield from reversed(spans)
+            end = window_start
+
+    def _iter_text_regex(self, mm, end, begin):
+        while end > begin:
+            window_start = self._window_start(mm, end, begin)
+            # surrogateescape keeps invalid bytes, so encoding gives back their length
+            text = mm[window_start:end].decode("utf-8", "surrogateescape")
+            spans = []
+            # byte offset of the character at char_pos, moved forwards only
+            char_pos, byte_pos = 0, window_start
+            position = 0
+            while position <= len(text):
+                match = self.window_regex.search(text, position)
+                if match is None:
+                    break
+                hit = match.start()
+                start = text.rfind("\n", 0, hit) + 1
+                stop = text.find("\n", hit)
+                stop = len(text) if stop == -1 else stop
+                if match.end() <= stop or self.matches_text(text[start:stop]):
+                    byte_pos += len(
+                        text[char_pos:start].encode("utf-8", "surrogateescape")
+                    )
+                    line_bytes = len(
+                        text[start:stop].encode("utf-8", "surrogateescape")
+                    )
+                    char_pos = start
+                    spans.append((byte_pos, byte_pos + line_bytes))
+                position = stop + 1
+
+            yield from reversed(spans)
+            end = window_start
+
+    @staticmethod
+    def _window_start(mm, end, begin):
+        """Returns the start of the newline aligned window ending at end"""
+        if end - begin <= FILTER_WINDOW_SIZE:
+            return begin
+        newline = mm.rfind(b"\n", begin, end - FILTER_WINDOW_SIZE)
+        return begin if newline == -1 else newline + 1
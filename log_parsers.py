@@ -0,0 +1,143 @@
+"""Module providing the structured log parsers behind the where and fields parameters"""
+
+import os
+import re
+import json
+from functools import lru_cache
+
+# RFC 3164 syslog: "Jan  2 15:04:05 host program[pid]: message"
+SYSLOG = re.compile(
+    rb"(?P<timestamp>[A-Z][a-z]{2} +\d{1,2} \d{2}:\d{2}:\d{2}) (?P<host>\S+) "
+    rb"(?P<program>[^\s\[:]+)(?:\[(?P<pid>\d+)\])?: ?(?P<message>.*)"
+)
+# Apache/nginx common and combined access log formats
+COMBINED = re.compile(
+    rb"(?P<remote_addr>\S+) \S+ (?P<remote_user>\S+) \[(?P<time>[^\]]+)\] "
+    rb'"(?P<method>\S+) (?P<path>\S+)(?: (?P<protocol>[^"]*))?" '
+    rb"(?P<status>\d{3}) (?P<bytes>\d+|-)"
+    rb'(?: "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)")?'
+)
+
+
+def regex_parser(pattern):
+    """Returns a parser taking fields from the named groups of pattern"""
+
+    def parse(lines, fields):
+        matches = list(map(pattern.match, lines))
+        columns = {}
+        for field in fields:
+            if field not in pattern.groupindex:
+                columns[field] = [None] * len(lines)
+                continue
+            columns[field] = [
+                (
+                    None
+                    if match is None or match[field] is None
+                    else match[field].decode(errors="ignore")
+                )
+                for match in matches
+            ]
+        return columns
+
+    return parse
+
+
+@lru_cache(maxsize=256)
+def logfmt_field(field):
+    """Returns the regex finding the value of field in a logfmt line"""
+    return re.compile(
+        rb"(?:^|[ \t])"
+        + re.escape(field.encode("utf-8"))
+        + rb'=("(?:[^"\\]|\\.)*"|\S*)'
+    )
+
+
+def logfmt_value(match):
+    """Returns the unquoted value of a logfmt_field match, or None"""
+    if match is None:
+        return None
+    value = match[1]
+    if value.startswith(b'"'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            value = value[1:-1]
+    return value.decode(errors="ignore")
+
+
+def parse_logfmt(lines, fields):
+    """Parses key=value pairs, searching every line once per field"""
+    return {
+        field: list(map(logfmt_value, map(logfmt_field(field).search, lines)))
+        for field in fields
+    }
+
+
+def json_text(value):
+    """Returns a JSON value as text: strings as they are, anything else as JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, separators=(",", ":"))
+
+
+def json_field(document, field):
+    """Returns the value of field in document, following dots into nested objects"""
+    if not isinstance(document, dict):
+        return None
+    if field in document:
+        return json_text(document[field])
+    for key in field.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return json_text(document)
+
+
+def parse_json_documents(lines):
+    """Decodes JSON lines, the whole batch with a single json.loads when all are valid"""
+    try:
+        documents = json.loads(b"[" + b",".join(lines) + b"]")
+        if len(documents) == len(lines):
+            return documents
+    except ValueError:
+        pass
+    documents = []
+    for line in lines:
+        try:
+            documents.append(json.loads(line))
+        except ValueError:
+            documents.append(None)
+    return documents
+
+
+def parse_json(lines, fields):
+    """Parses one JSON object per line"""
+    documents = parse_json_documents(lines)
+    return {
+        field: [json_field(document, field) for document in documents]
+        for field in fields
+    }
+
+
+# Parsers by name. A parser takes a list of lines (bytes) and the field
+# names wanted and returns {field: [value or None per line]}.
+PARSERS = {
+    "logfmt": parse_logfmt,
+    "json": parse_json,
+    "syslog": regex_parser(SYSLOG),
+    "combined": regex_parser(COMBINED),
+}
+
+# Parser used for a file extension when the request does not name one
+DEFAULT_PARSERS = {".json": "json", ".syslog": "syslog"}
+
+
+def register_parser(name, parse):
+    """Adds a parser taking (lines, fields) and returning {field: column}"""
+    PARSERS[name] = parse
+
+
+def default_parser(file_path):
+    """Returns the name of the parser for file_path, logfmt unless its extension says otherwise"""
+    extension = os.path.splitext(str(file_path))[1].lower()
+    return DEFAULT_PARSERS.get(extension, "logfmt")
@@ -0,0 +1,128 @@
+"""Module providing a log file and its rotated siblings as one logical stream"""
+
+import os
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+from utils import iter_log_records
+from compressed_index import is_readable
+
+# suffixes of rotated copies: syslog.1, syslog.2.gz, app.log-20250101.zst
+ROTATED_SUFFIX = re.compile(r"[.-]\d+(\.gz|\.zst)?")
+
+
+class StreamMember(NamedTuple):
+    """A file of a logical stream"""
+
+    name: str
+    path: Path
+    inode: int
+
+
+def stream_members(file_path, validate):
+    """Returns the file followed by its valid rotated siblings, newest first.
+
+    Siblings are ordered by modification time. Empty files and .zst files
+    without the zstandard package are left out.
+    """
+    file_path = Path(file_path)
+    members = []
+    with os.scandir(file_path.parent) as it:
+        for entry in it:
+            suffix = entry.name[len(file_path.name) :]
+            if entry.name != file_path.name and not (
+                entry.name.startswith(file_path.name)
+                and ROTATED_SUFFIX.fullmatch(suffix)
+            ):
+                continue
+            path = file_path.parent / entry.name
+            if not validate(path) or not is_readable(path):
+                continue
+            stat = path.stat()
+            if stat.st_size > 0:
+                members.append(
+                    (entry.name != file_path.name, -stat.st_mtime, path, stat)
+                )
+    members.sort()
+    return [StreamMember(path.name, path, stat.st_ino) for _, _, path, stat in members]
+
+
+def cursor_state(member, offset):
+    """Returns the composite cursor state pointing at offset of member"""
+    return {"member": member.name, "inode": member.inode, "offset": offset}
+
+
+def resolve_cursor(members, state):
+    """Returns the (member position, offset) of a cursor state, following renames.
+
+    Raises ValueError when the member is gone.
+    """
+    if state is None:
+        return 0, None
+    for position, member in enumerate(members):
+        if member.inode == state.get("inode"):
+            return position, state.get("offset")
+    for position, member in enumerate(members):
+        if member.name == state.get("member"):
+            return position, state.get("offset")
+    raise ValueError("Invalid cursor")
+
+
+def iter_stream_records(
+    members, position=0, offset=None, filter_text=None, limit=100, scan_workers=0
+):
+    """Yields (path, LogRecord) of the stream, newest first, across member boundaries.
+
+    Reading starts before offset of members[position]. The generator returns
+    the cursor state of the next page (None on the last page).
+    """
+    found_logs = 0
+    for position in range(position, len(members)):
+        member = members[position]
+        records = iter_log_records(
+            member.path, filter_text, offset, limit - found_logs, scan_workers
+        )
+        while True:
+            try:
+                record = next(records)
+            except StopIteration as stop:
+                next_offset = stop.value
+                break
+            yield member.path, record
+            found_logs += 1
+        if found_logs >= limit:
+            if next_offset is not None:
+                return cursor_state(member, next_offset)
+            if position + 1 < len(members):
+                return cursor_state(members[position + 1], None)
+            return None
+        offset = None
+    return None
+
+
+def iter_stream_logs(
+    members,
+    position=0,
+    offset=None,
+    filter_text=None,
+    limit=100,
+    source="",
+    compact=False,
+    scan_workers=0,
+):
+    """Lazily yields the entries of a stream page, each naming the file it came from"""
+    records = iter_stream_records(
+        members, position, offset, filter_text, limit, scan_workers
+    )
+    file_names = {}
+    while True:
+        try:
+            path, record = next(records)
+        except StopIteration as stop:
+            return stop.value
+        if compact:
+            yield record.text
+        else:
+            file_name = file_names.setdefault(path, str(path))
+            yield {"log": record.text, "source": source, "file": file_name}
@@ -0,0 +1,190 @@
+"""Module providing the in-process metrics exported by /metrics in Prometheus text format"""
+
+import threading
+from bisect import bisect_left
+
+from constants import METRICS_LATENCY_BUCKETS
+
+
+def format_value(value):
+    """Formats a sample value as in the Prometheus text format"""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def format_labels(labels):
+    """Formats {name: value} label pairs as {name="value",...}"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    """A named family of samples, one per combination of label values.
+
+    Updates only take a short lock, so metrics are cheap enough for the hot
+    paths. With collect the samples are read when rendered instead: collect()
+    returns a number, or {label values tuple: number} for a metric with labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        # a metric without labels has its single sample from the start
+        self.values = {} if self.labels else {(): 0}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        """Returns the label values of labels in declaration order"""
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def snapshot(self):
+        """Returns a copy of {label values: value}"""
+        if self.collect is None:
+            with self.lock:
+                return dict(self.values)
+        values = self.collect()
+        return values if self.labels else {(): values}
+
+    def samples(self):
+        """Yields (name suffix, {label: value}, value) of every sample"""
+        for key, value in sorted(self.snapshot().items()):
+            yield "", dict(zip(self.labels, key)), value
+
+    def render(self):
+        """Returns the lines of the metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{format_labels(labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Adds amount to the sample of labels"""
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        """Sets the sample of labels"""
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        """Adds amount to the sample of labels"""
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Subtracts amount from the sample of labels"""
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Counts observations in cumulative buckets, with their sum and count"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, value, **labels):
+        """Counts value in the first bucket whose bound is at least value"""
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # per bucket counts (the last one is +Inf), sum
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: (list(counts), total)
+                for key, (counts, total) in self.values.items()
+            }
+
+    def samples(self):
+        for key, (counts, total) in sorted(self.snapshot().items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket = {**labels, "le": format_value(float(bound))}
+                yield "_bucket", bucket, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """The metrics of the process, by name"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Adds metric, returning the one already registered under its name if any"""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=(), collect=None):
+        """Registers and returns a Counter"""
+        return self.register(Counter(name, help_text, labels, collect))
+
+    def gauge(self, name, help_text, labels=(), collect=None):
+        """Registers and returns a Gauge"""
+        return self.register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name, help_text, labels=(), buckets=METRICS_LATENCY_BUCKETS):
+        """Registers and returns a Histogram"""
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        with self.lock:
+            registered = list(self.metrics.values())
+        lines = []
+        for metric in registered:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -1,121 +1,381 @@
 """Module providing all network configuration utilities"""
 
-import os
 import json
+import heapq
+import base64
+import binascii
 import asyncio
 import logging
-import aiofiles
+import time
+import urllib.parse
+from itertools import islice
 import websockets
-import aiohttp
 
 from constants import (
     HOSTNAME,
-    LOG_DIR,
     SECONDARY_SERVERS,
+    SECONDARY_REPLICAS,
+    FANOUT_TIMEOUT,
+    FANOUT_DEADLINE,
+    FANOUT_HEDGE_DELAY,
+    AGGREGATE_TOP_K,
 )
 
 from utils import get_response
+from stream_session import StreamSession
+from timestamps import parse_timestamp
+from fanout import fanout_client
+from content_encoding import ThresholdDeflateFactory, decompress
+from aggregation import Aggregate, parse_bucket
+from metrics import metrics
+
+websocket_clients = metrics.gauge(
+    "log_scanner_websocket_clients", "Connected WebSocket clients"
+)
+fanout_seconds = metrics.histogram(
+    "log_scanner_fanout_duration_seconds",
+    "Time a secondary server took to answer a fan-out request",
+    ("server",),
+)
+fanout_errors = metrics.counter(
+    "log_scanner_fanout_errors_total",
+    "Fan-out requests a secondary server failed, timed out or skipped",
+    ("server", "status"),
+)
 
 
 async def start_websocket_server(ws_port):
     """Starts WebSocket server."""
 
     async def websocket_log_stream(websocket):
-        """Handles dynamic log streaming via WebSockets"""
+        """Handles dynamic log streaming via WebSockets, many subscriptions per connection"""
+        websocket_clients.inc()
+        session = StreamSession(websocket, f"{HOSTNAME}:{ws_port}")
         try:
-            filename = await websocket.recv()
-            logging.debug("Received filename: %s", filename)
-
-            file_path = os.path.join(LOG_DIR, filename)
-
-            if not os.path.exists(file_path) or not os.access(file_path, os.R_OK):
-                await websocket.send(json.dumps({"error": "File not accessible"}))
-                return
-
-            last_position = os.path.getsize(file_path)  # Start at the end of file
-
-            while True:
-                await asyncio.sleep(1)  # Check for updates every 1 second
-
-                # Open the file asynchronously and read new lines
-                async with aiofiles.open(file_path, "r") as f:
-                    await f.seek(last_position)  # Move to last known position
-                    new_lines = await f.read()
-
-                    if new_lines.strip():  # If new data exists, send to WebSocket
-                        last_position += len(new_lines)
-                        await websocket.send(
-                            json.dumps(
-                                {
-                                    "log": new_lines.strip(),
-                                    "source": f"{HOSTNAME}:{ws_port}",
-                                    "file": str(file_path),
-                                }
-                            )
-                        )  # Send new logs
-
+            await session.run()
         except websockets.exceptions.ConnectionClosedError:
             logging.error("WebSocket connection closed by the client")
         except Exception as e:
             logging.error("WebSocket Error: %s", e)
             await websocket.send(json.dumps({"error": f"Internal server error: {e}"}))
         finally:
-            logging.error("WebSocket client disconnected")
+            session.close()
+            websocket_clients.dec()
+            logging.debug("WebSocket client disconnected")
 
-    server = await websockets.serve(websocket_log_stream, HOSTNAME, ws_port)
-    logging.error("WebSocket Server running on port : %d ", ws_port)
+    # permessage-deflate, skipping messages under WS_COMPRESSION_MIN_SIZE
+    server = await websockets.serve(
+        websocket_log_stream,
+        HOSTNAME,
+        ws_port,
+        extensions=[ThresholdDeflateFactory()],
+    )
+    logging.info("WebSocket Server running on port : %d ", ws_port)
     await server.wait_closed()
 
 
-def handle_external_logs():
-    """Fetches logs only from secondary servers when manually triggered."""
-    logs_from_secondary = fetch_logs_from_secondary_servers()
+def encode_cursor(states):
+    """Encodes the per-server {"offset", "skip"} states as an opaque cursor"""
+    data = json.dumps(states, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def is_valid_state(state):
+    """Checks a {"offset": int or None, "skip": int} server state of a cursor"""
+    if not isinstance(state, dict):
+        return False
+    offset, skip = state.get("offset"), state.get("skip")
+    return (
+        isinstance(skip, int)
+        and not isinstance(skip, bool)
+        and skip >= 0
+        and (offset is None or isinstance(offset, int) and not isinstance(offset, bool))
+    )
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        states = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError, binascii.Error) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(states, dict):
+        raise ValueError("Invalid cursor")
+    return states
+
+
+def decode_server_states(cursor):
+    """Decodes the per-server states of a /fetch_external_logs cursor.
+
+    Only the servers of SECONDARY_SERVERS are accepted, so a crafted cursor
+    cannot make the primary fetch any other URL.
+    """
+    states = decode_cursor(cursor)
+    if not all(
+        server in SECONDARY_SERVERS and is_valid_state(state)
+        for server, state in states.items()
+    ):
+        raise ValueError("Invalid cursor")
+    return states
+
+
+def timestamped(server, entries):
+    """Yields (timestamp, server, entry), newest first, for heapq.merge.
+
+    Lines without a timestamp (continuations, stack traces) and out of order
+    lines keep the key of the line before them so the keys never increase.
+    """
+    key = float("inf")
+    for entry in entries:
+        timestamp = parse_timestamp(entry.get("log", ""))
+        if timestamp is not None:
+            key = min(key, timestamp)
+        yield key, server, entry
+
+
+def merge_pages(pages, states, limit):
+    """k-way merges the newest-first pages of the secondaries by timestamp.
+
+    Returns the newest `limit` entries and the states for the next page. A
+    server whose page was only partly used resumes at the offset of the last
+    entry returned, so every page asks it for `limit` entries again. Entries
+    without an offset (secondaries not answering offsets=true) fall back to
+    keeping the page offset and skipping the entries already returned. An
+    exhausted server is dropped.
+    """
+    remaining = {
+        server: page.get("entries", [])[states[server]["skip"] :]
+        for server, page in pages.items()
+    }
+    streams = [timestamped(server, entries) for server, entries in remaining.items()]
+    merged = heapq.merge(*streams, key=lambda item: item[0], reverse=True)
+
+    consumed = {server: 0 for server in pages}
+    resume = {}
+    entries = []
+    for _, server, entry in islice(merged, limit):
+        consumed[server] += 1
+        resume[server] = entry.pop("offset", None)
+        entries.append(entry)
+
+    next_states = dict(states)
+    for server, page in pages.items():
+        if consumed[server] < len(remaining[server]):
+            if resume.get(server) is not None:
+                next_states[server] = {"offset": resume[server], "skip": 0}
+            else:
+                next_states[server] = {
+                    "offset": states[server]["offset"],
+                    "skip": states[server]["skip"] + consumed[server],
+                }
+        elif page.get("pagination", {}).get("offset") is None:
+            del next_states[server]
+        else:
+            next_states[server] = {"offset": page["pagination"]["offset"], "skip": 0}
+    return entries, next_states
+
+
+def handle_external_logs(query=""):
+    """Fetches a merged, paginated page of logs from the secondary servers."""
+    params = urllib.parse.parse_qs(query)
+    filename = params.get("filename", [None])[0]
+    filter_text = params.get("filter", [None])[0]
+    limit = int(params.get("limit", [100])[0])
+    cursor = params.get("cursor", [None])[0]
+    deadline = min(float(params.get("deadline", [FANOUT_DEADLINE])[0]), FANOUT_TIMEOUT)
+
+    if cursor:
+        states = decode_server_states(cursor)
+    else:
+        states = {server: {"offset": None, "skip": 0} for server in SECONDARY_SERVERS}
+
+    pages, statuses = fetch_logs_from_secondary_servers(
+        filename, filter_text, limit, states, deadline
+    )
+    entries, next_states = merge_pages(pages, states, limit)
+
+    next_cursor = encode_cursor(next_states) if next_states else None
+    next_link = None
+    if next_cursor:
+        next_params = {"limit": limit, "cursor": next_cursor}
+        if filename:
+            next_params["filename"] = filename
+        if filter_text:
+            next_params["filter"] = filter_text
+        next_link = f"/fetch_external_logs?{urllib.parse.urlencode(next_params)}"
 
     response = get_response(
-        limit=None,
-        offset=None,
-        entries=logs_from_secondary,
+        limit=limit,
+        offset=next_cursor,
+        has_next=next_cursor is not None,
+        next_link=next_link,
+        entries=entries,
+    )
+    # servers that failed or timed out keep their position in the cursor
+    response["servers"] = statuses
+    return response
+
+
+def handle_external_aggregate(query=""):
+    """Merges the partial /aggregate results of the secondary servers into one result."""
+    params = urllib.parse.parse_qs(query)
+    deadline = min(float(params.pop("deadline", [FANOUT_DEADLINE])[0]), FANOUT_TIMEOUT)
+    forwarded = {name: values[0] for name, values in params.items()}
+    forwarded["partial"] = "true"
+    aggregate = Aggregate(
+        parse_bucket(forwarded.get("bucket")),
+        forwarded.get("top"),
+        forwarded.get("distinct"),
+        int(forwarded.get("k", AGGREGATE_TOP_K)),
+    )
+
+    results = fanout_client.run(
+        fetch_from_servers(
+            {server: forwarded for server in SECONDARY_SERVERS}, deadline, "/aggregate"
+        )
     )
+    statuses = {}
+    for server, result in results.items():
+        status = result["status"]
+        if result["page"] is not None:
+            try:
+                aggregate.merge(Aggregate.from_dict(result["page"], aggregate.k))
+            except ValueError:
+                status = "error"
+        statuses[server] = {"status": status, "latency_ms": result["latency_ms"]}
+    response = aggregate.result()
+    # servers that failed or timed out are missing from the result
+    response["servers"] = statuses
     return response
 
 
-def fetch_logs_from_secondary_servers():
-    """Fetches logs from secondary servers asynchronously."""
-    logs = []
+def fetch_logs_from_secondary_servers(
+    filename, filter_text, limit, states, deadline=FANOUT_DEADLINE
+):
+    """Fetches one page per secondary server asynchronously.
+
+    Returns ({server: page} for the servers that answered within the
+    deadline, {server: {"status", "latency_ms"}} for every server).
+    """
+    requests = {}
+    for server, state in states.items():
+        params = {"limit": limit + state["skip"], "offsets": "true"}
+        if state["offset"] is not None:
+            params["offset"] = state["offset"]
+        if filename:
+            params["filename"] = filename
+        if filter_text:
+            params["filter"] = filter_text
+        requests[server] = params
+
+    # the fan-out client reuses one loop and one connection pool for all requests
+    results = fanout_client.run(fetch_from_servers(requests, deadline))
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    results = loop.run_until_complete(fetch_from_servers())
+    pages = {
+        server: result["page"]
+        for server, result in results.items()
+        if result["page"] is not None
+    }
+    statuses = {
+        server: {"status": result["status"], "latency_ms": result["latency_ms"]}
+        for server, result in results.items()
+    }
+    return pages, statuses
 
-    for result in results:
-        if result:
-            logs.extend(result)
 
-    return logs
+async def fetch_from_servers(requests, deadline=FANOUT_DEADLINE, path="/logs"):
+    """Asynchronously fetch path (/logs pages by default) from secondary servers within a deadline.
 
+    Servers whose circuit breaker is open are skipped, servers still running
+    at the deadline are cancelled and reported as timed out.
+    """
+    session = await fanout_client.get_session()
+    results = {}
+    tasks = {}
+    for server, params in requests.items():
+        if not fanout_client.breaker(server).allow():
+            fanout_errors.inc(server=server, status="skipped")
+            results[server] = {"status": "skipped", "latency_ms": 0, "page": None}
+            continue
+        task = asyncio.ensure_future(fetch_timed(session, server, params, path))
+        tasks[task] = server
 
-async def fetch_from_servers():
-    """Asynchronously fetch logs from secondary servers"""
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            fetch_log(
-                session,
-                f"{server}/logs",
+    done, pending = set(), set()
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+        server = tasks[task]
+        fanout_client.breaker(server).record_failure()
+        fanout_seconds.observe(deadline, server=server)
+        fanout_errors.inc(server=server, status="timeout")
+        results[server] = {
+            "status": "timeout",
+            "latency_ms": round(deadline * 1000),
+            "page": None,
+        }
+    for task in done:
+        server = tasks[task]
+        page, latency = task.result()
+        fanout_seconds.observe(latency, server=server)
+        if page is None:
+            fanout_client.breaker(server).record_failure()
+            fanout_errors.inc(server=server, status="error")
+        else:
+            fanout_client.breaker(server).record_success()
+        results[server] = {
+            "status": "error" if page is None else "ok",
+            "latency_ms": round(latency * 1000),
+            "page": page,
+        }
+    return results
+
+
+async def fetch_timed(session, server, params, path="/logs"):
+    """Returns (page or None, seconds taken) of a hedged fetch"""
+    started = time.monotonic()
+    page = await fetch_hedged(session, server, params, path)
+    return page, time.monotonic() - started
+
+
+async def fetch_hedged(session, server, params, path="/logs"):
+    """Fetches a page from server, hedged against its replicas.
+
+    When a replica has not answered within FANOUT_HEDGE_DELAY (or failed) the
+    next one is queried as well; the first page returned wins.
+    """
+    urls = [server, *SECONDARY_REPLICAS.get(server, [])]
+    pending = set()
+    try:
+        while urls or pending:
+            if urls:
+                url = urls.pop(0)
+                pending.add(
+                    asyncio.ensure_future(fetch_log(session, f"{url}{path}", params))
+                )
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=FANOUT_HEDGE_DELAY if urls else None,
+                return_when=asyncio.FIRST_COMPLETED,
             )
-            for server in SECONDARY_SERVERS
-        ]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        return [res for res in results if isinstance(res, list)]
+            for task in done:
+                if task.result() is not None:
+                    return task.result()
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
 
 
-async def fetch_log(session, url):
-    """Fetch logs from a single secondary server"""
+async def fetch_log(session, url, params=None):
+    """Fetch a page of logs from a single secondary server"""
     try:
-        async with session.get(url) as response:
+        async with session.get(url, params=params) as response:
             if response.status == 200:
-                data = await response.json()
-                return data.get("entries", [])
-            return []
+                body = await response.read()
+                encoding = response.headers.get("Content-Encoding")
+                return json.loads(decompress(body, encoding))
+            return None
     except Exception as e:
-        logging.info("Failed to fetch logs from %s: %e", url, e)
-        return []
+        logging.info("Failed to fetch logs from %s: %s", url, e)
+        return None
@@ -0,0 +1,89 @@
+"""Module providing the in-process cache of /logs page results"""
+
+import threading
+from collections import OrderedDict
+
+from metrics import metrics
+from constants import PAGE_CACHE_MAX_BYTES
+
+
+class PageCache:
+    """LRU cache of page results bounded by an approximate size in bytes.
+
+    Values are stored with the size given to put(); the least recently used
+    entries are evicted once the total exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=PAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value of key or None, counting hits and misses"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Caches value, evicting the least recently used entries to stay in budget"""
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """Returns the hit/miss counters and the memory in use"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+page_cache = PageCache()
+
+metrics.counter(
+    "log_scanner_page_cache_hits_total",
+    "Pages served from the page cache",
+    collect=lambda: page_cache.hits,
+)
+metrics.counter(
+    "log_scanner_page_cache_misses_total",
+    "Pages read from the file because they were not cached",
+    collect=lambda: page_cache.misses,
+)
+metrics.gauge(
+    "log_scanner_page_cache_bytes",
+    "Approximate memory held by the page cache",
+    collect=lambda: page_cache.size,
+)
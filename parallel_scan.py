@@ -0,0 +1,110 @@
+"""Module providing the multi-process scan used for filtered reads of huge files"""
+
+import mmap
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from log_filter import LogFilter, filter_scanned_lines
+from constants import PARALLEL_SCAN_RANGE_SIZE
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_process_pool(workers):
+    """Returns the shared process pool for the given worker count.
+
+    Workers are not forked from the server, whose other threads may hold locks
+    at the time of the fork.
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            start_method = (
+                "forkserver"
+                if "forkserver" in multiprocessing.get_all_start_methods()
+                else "spawn"
+            )
+            _pools[workers] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context(start_method),
+            )
+        return _pools[workers]
+
+
+def split_ranges(mm, end, begin=0, range_size=PARALLEL_SCAN_RANGE_SIZE):
+    """Splits [begin, end) into newline aligned (begin, end) ranges, newest first"""
+    ranges = []
+    while end > begin:
+        start = begin
+        if end - begin > range_size:
+            start = max(mm.rfind(b"\n", begin, end - range_size) + 1, begin)
+        ranges.append((start, end))
+        end = start
+    return ranges
+
+
+def scan_range(file_path, filter_text, begin, end, limit):
+    """Worker: returns up to limit (start, line bytes) matches of [begin, end), newest first.
+
+    Also returns the number of lines scanned, the metrics of the worker
+    process never reach the server.
+    """
+    matches = []
+    log_filter = LogFilter(filter_text)
+    # a worker runs one range at a time, the counter moves for this range only
+    scanned_before = filter_scanned_lines.snapshot()[()]
+    with open(file_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            spans = log_filter.iter_matching_lines(mm, end, begin)
+            for start, stop in spans:
+                line = mm[start:stop]
+                if not line.strip():
+                    continue
+                matches.append((start, line))
+                if len(matches) >= limit:
+                    break
+            # counts the lines scanned before the mmap is closed
+            spans.close()
+    return matches, filter_scanned_lines.snapshot()[()] - scanned_before
+
+
+def read_matches_parallel(file_path, mm, filter_text, offset, limit, workers, begin=0):
+    """Scans newline aligned ranges of the file on a process pool.
+
+    Returns the newest limit (start, line bytes) matches in [begin, offset) and
+    the next offset. Ranges are submitted newest first with at most
+    2 * workers in flight and their results are consumed in the same order,
+    so as soon as the newest ranges have produced limit matches the
+    remaining ranges are never scanned.
+    """
+    pool = get_process_pool(workers)
+    pending = deque(split_ranges(mm, offset, begin))
+    in_flight = deque()
+    matches = []
+    file_name = str(file_path)
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < 2 * workers:
+                range_begin, range_end = pending.popleft()
+                in_flight.append(
+                    pool.submit(
+                        scan_range,
+                        file_name,
+                        filter_text,
+                        range_begin,
+                        range_end,
+                        limit,
+                    )
+                )
+            range_matches, scanned_lines = in_flight.popleft().result()
+            filter_scanned_lines.inc(scanned_lines)
+            for start, line in range_matches:
+                matches.append((start, line))
+                if len(matches) >= limit:
+                    return matches, start if start > begin else None
+        return matches, None
+    finally:
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,103 @@
+"""Module providing the sampling profiler behind /debug/profile"""
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+from constants import PROFILE_INTERVAL
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread while switched on.
+
+    Sampling runs on its own thread, so it can be started and stopped while
+    the server keeps serving requests and costs nothing while off. A run
+    started with a duration stops by itself and keeps its stacks. Stacks
+    are counted in the collapsed format ("thread;outer;inner count") read by
+    flamegraph.pl and speedscope, rooted at the thread name.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.enabled = False
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        # guards stacks against the sampling thread while they are read
+        self.stacks_lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Checks if samples are being taken"""
+        thread = self.thread
+        return thread is not None and thread.is_alive()
+
+    def start(self, interval=None, seconds=None):
+        """Starts sampling from scratch, for seconds if given.
+
+        Returns False if it is already running.
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.stopping.clear()
+            deadline = None if seconds is None else time.monotonic() + seconds
+            self.thread = threading.Thread(
+                target=self.run,
+                args=(interval or self.interval, deadline),
+                name="profiler",
+                daemon=True,
+            )
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Stops sampling and returns the collapsed stacks taken since start"""
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread is not None:
+                self.stopping.set()
+                thread.join()
+            return self.collapsed()
+
+    def run(self, interval, deadline=None):
+        """Takes a sample every interval seconds until stopped or past deadline"""
+        while not self.stopping.wait(interval):
+            self.sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+
+    def sample(self):
+        """Counts the current stack of every other thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                    f":{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            with self.stacks_lock:
+                self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """Returns the stacks counted so far, one "frames count" line each"""
+        with self.stacks_lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+profiler = SamplingProfiler()
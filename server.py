@@ -1,7 +1,9 @@
 """Main Module with initializiation of servers"""
 
+import re
 import json
 import os
+import time
 import argparse
 import asyncio
 import logging
@@ -9,33 +11,196 @@ import logging
 import http.server
 import urllib.parse
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 
-from network_utils import handle_external_logs, start_websocket_server
+from network_utils import (
+    handle_external_logs,
+    handle_external_aggregate,
+    start_websocket_server,
+    encode_cursor,
+    decode_cursor,
+)
 from constants import (
     HOSTNAME,
     DEFAULT_PRIMARY_PORT,
     DEFAULT_SECONDARY_PORT,
     WS_PORT,
+    HTTP_QUEUE_LIMIT,
+    HTTP_KEEPALIVE_TIMEOUT,
+    NDJSON_FLUSH_SIZE,
+    COMPRESSION_MIN_SIZE,
+    PAGE_CACHE_MAX_BYTES,
+    LOG_DIR,
+    SEARCH_INDEX_DIR,
+    BLOCK_SUMMARY_DIR,
+    LINE_INDEX_SIDECAR_DIR,
+    LOG_LEVEL,
+    PROFILE_MAX_SECONDS,
+    AGGREGATE_TOP_K,
+)
+from utils import (
+    iter_logs_reverse,
+    iter_log_lines,
+    collect_logs,
+    get_file_path,
+    get_response,
+    get_next_url,
+    is_valid_regex,
+    is_valid_file,
+    log_catalog,
 )
-from utils import read_logs_reverse, get_file_path, get_response, get_next_url
+import line_index
+from line_index import line_to_offset, offset_to_line
+from timestamps import PARSERS, parse_time_value, find_time_range
+from compressed_index import compression_of
+from page_cache import page_cache
+from token_index import token_index
+from block_summary import block_summaries
+from log_stream import stream_members, resolve_cursor, iter_stream_logs
+from content_encoding import negotiate_encoding, compress, StreamCompressor
+from field_query import FieldQuery
+from log_filter import LogFilter
+from aggregation import Aggregate, aggregate_file, parse_bucket
+from log_parsers import default_parser
+from metrics import metrics
+from profiler import profiler
 
-# set up logger
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
+# /logs options repeated in the next link of every page
+CARRIED_OPTIONS = (
+    "format",
+    "compact",
+    "since",
+    "until",
+    "time_format",
+    "rotated",
+    "where",
+    "parser",
+    "fields",
+)
+
+# paths with their own latency series, any other path is counted as "other"
+ENDPOINTS = (
+    "/logs",
+    "/fetch_external_logs",
+    "/aggregate",
+    "/fetch_external_aggregate",
+    "/files",
+    "/search",
+    "/stats",
+    "/metrics",
+    "/debug/profile",
+)
+
+request_seconds = metrics.histogram(
+    "log_scanner_http_request_duration_seconds",
+    "Time spent serving HTTP requests",
+    ("endpoint",),
+)
+responses = metrics.counter(
+    "log_scanner_http_responses_total",
+    "HTTP responses sent",
+    ("endpoint", "code"),
+)
+pool_connections = metrics.gauge(
+    "log_scanner_http_pool_connections",
+    "Connections admitted to the HTTP worker pool, served or queued",
+)
+pool_rejections = metrics.counter(
+    "log_scanner_http_pool_rejections_total",
+    "Connections answered with 503 because the HTTP worker pool was full",
 )
 
 
+def get_time_range(params, time_format=None):
+    """Returns the {"since", "until"} epoch seconds given in params, raising ValueError if invalid"""
+    if time_format is not None and time_format not in PARSERS:
+        raise ValueError("Invalid time format")
+    time_range = {}
+    for bound in ("since", "until"):
+        if bound in params:
+            time_range[bound] = parse_time_value(params[bound][0])
+            if time_range[bound] is None:
+                raise ValueError(f"Invalid {bound} timestamp")
+    return time_range
+
+
+def resolve_time_range(file_path, time_range, time_format=None):
+    """Returns the (begin, end) byte range of the lines of file_path in time_range"""
+    with block_summaries.summary_for(file_path) as summary:
+        return find_time_range(
+            file_path,
+            time_range.get("since"),
+            time_range.get("until"),
+            time_format,
+            summary,
+        )
+
+
+def get_field_query(params, file_path, fields=()):
+    """Returns the FieldQuery of the where and parser params, raising ValueError if invalid"""
+    return FieldQuery(
+        params.get("where", [None])[0],
+        params.get("parser", [default_parser(file_path)])[0],
+        fields,
+    )
+
+
 class LogRequestHandler(http.server.SimpleHTTPRequestHandler):
     """Handles HTTP requests for log retrieval (for both primary and secondary servers)"""
 
+    # idle keep-alive connections are dropped after this many seconds
+    timeout = HTTP_KEEPALIVE_TIMEOUT
+    # headers and body are separate writes, Nagle would hold the body back
+    # until the client's delayed ACK on keep-alive connections
+    disable_nagle_algorithm = True
+
     def do_GET(self):
-        """Handles GET requests."""
+        """Handles GET requests, timing them per endpoint."""
         parsed_path = urllib.parse.urlparse(self.path)
+        self.endpoint = parsed_path.path if parsed_path.path in ENDPOINTS else "other"
+        started = time.perf_counter()
+        try:
+            self.route(parsed_path)
+        finally:
+            request_seconds.observe(
+                time.perf_counter() - started, endpoint=self.endpoint
+            )
+
+    def route(self, parsed_path):
+        """Dispatches the request to the handler of its path"""
         if parsed_path.path == "/logs":
             self.handle_logs(parsed_path.query)
         elif parsed_path.path == "/fetch_external_logs":
-            self.send_response_json(HTTPStatus.OK, handle_external_logs())
+            try:
+                response = handle_external_logs(parsed_path.query)
+            except ValueError as e:
+                self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+                return
+            self.send_response_json(HTTPStatus.OK, response)
+        elif parsed_path.path == "/aggregate":
+            self.handle_aggregate(parsed_path.query)
+        elif parsed_path.path == "/fetch_external_aggregate":
+            try:
+                response = handle_external_aggregate(parsed_path.query)
+            except ValueError as e:
+                self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+                return
+            self.send_response_json(HTTPStatus.OK, response)
+        elif parsed_path.path == "/files":
+            self.handle_files(parsed_path.query)
+        elif parsed_path.path == "/search":
+            self.handle_search(parsed_path.query)
+        elif parsed_path.path == "/stats":
+            self.send_response_json(HTTPStatus.OK, {"page_cache": page_cache.stats()})
+        elif parsed_path.path == "/metrics":
+            self.send_response_body(
+                HTTPStatus.OK,
+                metrics.render().encode("utf-8"),
+                "text/plain; version=0.0.4; charset=utf-8",
+            )
+        elif parsed_path.path == "/debug/profile":
+            self.handle_profile(parsed_path.query)
         else:
             self.send_response_json(HTTPStatus.NOT_FOUND, "Endpoint Not Found")
 
@@ -46,70 +211,590 @@ class LogRequestHandler(http.server.SimpleHTTPRequestHandler):
         is_regex = bool(params.get("is_regex", [False])[0])
         filter_text = params.get("filter", [None])[0]
         offset = int(params.get("offset", [0])[0]) if params.get("offset") else None
+        line = int(params.get("line", [0])[0]) if params.get("line") else None
         limit = int(params.get("limit", [100])[0])
+        # compact entries are plain lines, source and file are given once per page
+        compact = params.get("compact", ["false"])[0].lower() == "true"
+        # the offset of every entry, for the primary to resume right after it
+        offsets = params.get("offsets", ["false"])[0].lower() == "true"
+        time_format = params.get("time_format", [None])[0]
+        try:
+            time_range = get_time_range(params, time_format)
+        except ValueError as e:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        # rotated=true chains the file with its rotated (and compressed) siblings
+        rotated = params.get("rotated", ["false"])[0].lower() == "true"
 
         file_path, error_code, error_str = get_file_path(filename, is_regex)
         if error_code != HTTPStatus.OK:
             self.send_response_json(error_code, error_str)
+            return
+        # where and fields parse the lines with a structured log parser
+        query = None
+        if "where" in params or "fields" in params:
+            fields = params.get("fields", [""])[0]
+            try:
+                query = get_field_query(
+                    params, file_path, [field for field in fields.split(",") if field]
+                )
+            except ValueError as e:
+                self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+                return
+        if (rotated or compression_of(file_path)) and (
+            line is not None or time_range or query is not None
+        ):
+            self.send_response_json(
+                HTTPStatus.BAD_REQUEST,
+                "line, since, until, where and fields need a single uncompressed file",
+            )
+            return
+        if rotated:
+            self.handle_stream(params, file_path, filter_text, limit, compact)
+            return
 
-        # If the file is empty return empty response
-        if os.path.getsize(file_path) == 0:
-            resp = get_response(limit=limit, entries=[])
-            self.send_response_json(HTTPStatus.OK, resp)
+        try:
+            # If the file is empty return empty response
+            if os.path.getsize(file_path) == 0:
+                reader = iter(())
+            else:
+                # A line number cursor is resolved to a byte offset through the line index
+                if line is not None:
+                    offset = line_to_offset(file_path, line)
+                # A time range is resolved to a byte range by binary search
+                begin = 0
+                if time_range:
+                    begin, end = resolve_time_range(file_path, time_range, time_format)
+                    offset = end if offset is None else min(offset, end)
+                # Get the logs
+                if compact:
+                    reader = iter_log_lines(
+                        file_path,
+                        filter_text,
+                        offset,
+                        limit,
+                        self.scan_workers,
+                        begin,
+                        query,
+                    )
+                else:
+                    reader = iter_logs_reverse(
+                        file_path,
+                        filter_text,
+                        offset,
+                        limit,
+                        HOSTNAME,
+                        self.server_port,
+                        self.scan_workers,
+                        begin,
+                        query,
+                        offsets,
+                    )
+
+            def page_response(next_offset, logs):
+                next_line = None
+                if line is not None and next_offset is not None:
+                    next_line = offset_to_line(file_path, next_offset)
+                # Get the next url if it exists
+                next_url = get_next_url(
+                    filename, next_offset, limit, filter_text, next_line
+                )
+                response = get_response(
+                    offset=next_offset,
+                    line=next_line,
+                    limit=limit,
+                    has_next=next_offset is not None,
+                    next_link=self.carry_options(next_url, params),
+                    entries=logs,
+                )
+                response["source"] = f"{HOSTNAME}:{self.server_port}"
+                response["file"] = str(file_path)
+                return response
+
+            self.send_page(params, reader, page_response)
+        except Exception as e:
+            self.send_response_json(
+                HTTPStatus.INTERNAL_SERVER_ERROR, f"Error reading logs: {str(e)}"
+            )
+
+    def handle_aggregate(self, query):
+        """Aggregates the lines of a file in one pass: counts per time bucket, top and distinct values.
+
+        With partial=true the mergeable state is returned instead, for the
+        primary to combine the results of several secondaries.
+        """
+        params = urllib.parse.parse_qs(query)
+        filename = params.get("filename", [None])[0]
+        is_regex = bool(params.get("is_regex", [False])[0])
+        filter_text = params.get("filter", [None])[0]
+        time_format = params.get("time_format", [None])[0]
+        partial = params.get("partial", ["false"])[0].lower() == "true"
+        try:
+            time_range = get_time_range(params, time_format)
+            aggregate = Aggregate(
+                parse_bucket(params.get("bucket", [None])[0]),
+                params.get("top", [None])[0],
+                params.get("distinct", [None])[0],
+                int(params.get("k", [AGGREGATE_TOP_K])[0]),
+                time_format,
+            )
+        except ValueError as e:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
             return
 
+        file_path, error_code, error_str = get_file_path(filename, is_regex)
+        if error_code != HTTPStatus.OK:
+            self.send_response_json(error_code, error_str)
+            return
+        if compression_of(file_path):
+            self.send_response_json(
+                HTTPStatus.BAD_REQUEST, "Aggregations need an uncompressed file"
+            )
+            return
         try:
-            # Get the logs
-            logs, next_offset = read_logs_reverse(
-                file_path, filter_text, offset, limit, HOSTNAME, self.server_port
+            field_query = get_field_query(params, file_path, aggregate.fields)
+        except ValueError as e:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        try:
+            if os.path.getsize(file_path) > 0:
+                begin, end = 0, None
+                if time_range:
+                    begin, end = resolve_time_range(file_path, time_range, time_format)
+                log_filter = LogFilter(filter_text) if filter_text else None
+                aggregate_file(
+                    file_path, aggregate, field_query, begin, end, log_filter
+                )
+        except Exception as e:
+            self.send_response_json(
+                HTTPStatus.INTERNAL_SERVER_ERROR, f"Error reading logs: {str(e)}"
             )
-            # Get the next url if it exists
-            next_url = get_next_url(filename, next_offset, limit, filter_text)
+            return
+        response = aggregate.to_dict() if partial else aggregate.result()
+        response["source"] = f"{HOSTNAME}:{self.server_port}"
+        response["file"] = str(file_path)
+        self.send_response_json(HTTPStatus.OK, response)
 
-            response = get_response(
-                offset=next_offset,
-                limit=limit,
-                has_next=next_offset is not None,
-                next_link=next_url,
-                entries=logs,
+    def handle_stream(self, params, file_path, filter_text, limit, compact):
+        """Serves a page of file_path chained with its rotated siblings, newest first.
+
+        Pages cross file boundaries; the cursor holds the member and the
+        offset inside it.
+        """
+        filename = params.get("filename", [None])[0]
+        cursor = params.get("cursor", [None])[0]
+        try:
+            members = stream_members(file_path, is_valid_file)
+            state = decode_cursor(cursor) if cursor else None
+            position, offset = resolve_cursor(members, state)
+        except ValueError as e:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        try:
+            reader = iter_stream_logs(
+                members,
+                position,
+                offset,
+                filter_text,
+                limit,
+                f"{HOSTNAME}:{self.server_port}",
+                compact,
+                self.scan_workers,
             )
-            self.send_response_json(HTTPStatus.OK, response)
+
+            def page_response(next_state, logs):
+                next_cursor = encode_cursor(next_state) if next_state else None
+                next_url = get_next_url(
+                    filename, next_cursor, limit, filter_text, next_cursor=next_cursor
+                )
+                response = get_response(
+                    offset=next_cursor,
+                    limit=limit,
+                    has_next=next_cursor is not None,
+                    next_link=self.carry_options(next_url, params),
+                    entries=logs,
+                )
+                response["source"] = f"{HOSTNAME}:{self.server_port}"
+                response["file"] = str(file_path)
+                return response
+
+            self.send_page(params, reader, page_response)
         except Exception as e:
             self.send_response_json(
                 HTTPStatus.INTERNAL_SERVER_ERROR, f"Error reading logs: {str(e)}"
             )
 
+    def send_page(self, params, reader, page_response):
+        """Sends the page read by reader, streamed or as a single JSON document"""
+        if self.wants_ndjson(params):
+            self.send_response_ndjson(reader, page_response)
+            return
+        logs, next_offset = collect_logs(reader)
+        self.send_response_json(HTTPStatus.OK, page_response(next_offset, logs))
+
+    def carry_options(self, next_url, params):
+        """Appends the request options that every page keeps to next_url"""
+        for option in CARRIED_OPTIONS:
+            if next_url and option in params:
+                value = urllib.parse.quote(params[option][0])
+                next_url = f"{next_url}&{option}={value}"
+        return next_url
+
+    def handle_search(self, query):
+        """Searches the token index for lines holding every word of the q parameter."""
+        params = urllib.parse.parse_qs(query)
+        text = params.get("q", [None])[0]
+        limit = int(params.get("limit", [100])[0])
+        cursor = params.get("cursor", [None])[0]
+        file_pattern = params.get("pattern", [None])[0]
+        if not token_index.enabled:
+            self.send_response_json(HTTPStatus.NOT_FOUND, "Search index is disabled")
+            return
+        if not text:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, "Missing query")
+            return
+        if file_pattern and not is_valid_regex(file_pattern):
+            self.send_response_json(HTTPStatus.BAD_REQUEST, "Invalid pattern")
+            return
+
+        try:
+            state = decode_cursor(cursor) if cursor else None
+            matches, next_state = token_index.search(
+                text,
+                limit,
+                state,
+                re.compile(file_pattern) if file_pattern else None,
+            )
+        except ValueError as e:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        source = f"{HOSTNAME}:{self.server_port}"
+        entries = [
+            {
+                "log": line.decode(errors="ignore"),
+                "source": source,
+                "file": name,
+                "offset": offset,
+            }
+            for name, offset, line in matches
+        ]
+        next_cursor = encode_cursor(next_state) if next_state else None
+        next_link = None
+        if next_cursor:
+            next_params = {"q": text, "limit": limit, "cursor": next_cursor}
+            if file_pattern:
+                next_params["pattern"] = file_pattern
+            next_link = f"/search?{urllib.parse.urlencode(next_params)}"
+        self.send_response_json(
+            HTTPStatus.OK,
+            get_response(
+                entries,
+                offset=next_cursor,
+                limit=limit,
+                has_next=next_cursor is not None,
+                next_link=next_link,
+            ),
+        )
+
+    def handle_profile(self, query):
+        """Switches the sampling profiler on and off and returns its collapsed stacks.
+
+        action=start and action=stop bracket any stretch of live traffic, and
+        action=result returns the stacks so far. Without an action a profile
+        of the next `seconds` seconds is started; no request waits for it.
+        """
+        params = urllib.parse.parse_qs(query)
+        action = params.get("action", [None])[0]
+        if not profiler.enabled:
+            self.send_response_json(HTTPStatus.NOT_FOUND, "Profiler is disabled")
+            return
+        if action in ("start", None):
+            seconds = params.get("seconds", [None if action == "start" else 10])[0]
+            if seconds is not None:
+                try:
+                    seconds = min(float(seconds), PROFILE_MAX_SECONDS)
+                except ValueError:
+                    seconds = float("nan")
+                # nan fails the comparison too
+                if not seconds >= 0:
+                    self.send_response_json(HTTPStatus.BAD_REQUEST, "Invalid seconds")
+                    return
+            if not profiler.start(seconds=seconds):
+                self.send_response_json(HTTPStatus.CONFLICT, "Profiler already running")
+                return
+            self.send_response_json(
+                HTTPStatus.OK, {"running": True, "seconds": seconds}
+            )
+        elif action == "result":
+            self.send_profile(profiler.collapsed())
+        elif action == "stop":
+            if profiler.thread is None:
+                self.send_response_json(HTTPStatus.CONFLICT, "Profiler is not running")
+                return
+            self.send_profile(profiler.stop())
+        else:
+            self.send_response_json(HTTPStatus.BAD_REQUEST, "Invalid action")
+
+    def send_profile(self, collapsed):
+        """Sends collapsed stacks, the input of flamegraph.pl and speedscope"""
+        self.send_response_body(
+            HTTPStatus.OK, collapsed.encode("utf-8"), "text/plain; charset=utf-8"
+        )
+
+    def wants_ndjson(self, params):
+        """Checks if the client asked for a streamed NDJSON response"""
+        if "format" in params:
+            return params["format"][0] == "ndjson"
+        return "application/x-ndjson" in self.headers.get("Accept", "")
+
+    def handle_files(self, query):
+        """Lists the log files of the catalog, optionally matching a regex pattern."""
+        params = urllib.parse.parse_qs(query)
+        file_pattern = params.get("pattern", [None])[0]
+        if file_pattern and not is_valid_regex(file_pattern):
+            self.send_response_json(HTTPStatus.BAD_REQUEST, "Invalid pattern")
+            return
+        self.send_response_json(
+            HTTPStatus.OK, {"files": log_catalog.list_files(file_pattern)}
+        )
+
+    def send_response_ndjson(self, reader, page_response):
+        """Streams the entries of reader as NDJSON, one compact object per line.
+
+        The pagination object, only known once the reader is exhausted, is the
+        last line. HTTP/1.1 clients get chunked transfer encoding; lines are
+        flushed in chunks of NDJSON_FLUSH_SIZE bytes, the first one right away.
+        With a negotiated Content-Encoding every chunk is flushed through the
+        compressor so the client can decode it as soon as it arrives.
+        """
+        chunked = self.request_version == "HTTP/1.1" == self.protocol_version
+        encoding = negotiate_encoding(self.headers.get("Accept-Encoding"))
+        compressor = StreamCompressor(encoding) if encoding else None
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.close_connection = True
+        self.end_headers()
+
+        buffer = []
+        size = 0
+        flushed = False
+        try:
+            while True:
+                try:
+                    entry = next(reader)
+                except StopIteration as stop:
+                    last = page_response(stop.value, [])
+                    del last["entries"]
+                    break
+                line = json.dumps(entry, separators=(",", ":")) + "\n"
+                buffer.append(line)
+                size += len(line)
+                if size >= NDJSON_FLUSH_SIZE or not flushed:
+                    self.write_chunk(
+                        "".join(buffer).encode("utf-8"), chunked, compressor
+                    )
+                    buffer = []
+                    size = 0
+                    flushed = True
+        except Exception as e:
+            # the status line is gone already, report the error in the stream
+            last = {
+                "error": {
+                    "code": HTTPStatus.INTERNAL_SERVER_ERROR,
+                    "message": f"Error reading logs: {str(e)}",
+                }
+            }
+        buffer.append(json.dumps(last, separators=(",", ":")) + "\n")
+        self.write_chunk("".join(buffer).encode("utf-8"), chunked, compressor)
+        if compressor:
+            self.write_chunk(compressor.finish(), chunked)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data, chunked, compressor=None):
+        """Writes data, compressed if a compressor is given and framed as one chunk when chunked"""
+        if compressor:
+            data = compressor.compress(data)
+        if not data:
+            # an empty chunk would end the chunked body
+            return
+        if chunked:
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        else:
+            self.wfile.write(data)
+
     def send_response_json(self, code, data):
         """Sends JSON response with CORS headers."""
+        if code != HTTPStatus.OK:
+            data = {"error": {"code": code, "message": data}}
+        body = json.dumps(data, indent=4).encode("utf-8")
+        self.send_response_body(code, body, "application/json")
+
+    def send_response_body(self, code, body, content_type):
+        """Sends body with CORS headers, compressed when the client accepts it."""
         self.send_response(code)
-        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Type", content_type)
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header(
             "Content-Security-Policy",
             "default-src 'self' ws: wss:; connect-src 'self' ws: wss:",
         )
+        self.send_header("Vary", "Accept-Encoding")
+        encoding = negotiate_encoding(self.headers.get("Accept-Encoding"))
+        # small bodies are not worth the CPU nor the encoding overhead
+        if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+            body = compress(body, encoding)
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        if code != HTTPStatus.OK:
-            data = {"error": {"code": code, "message": data}}
-        self.wfile.write(json.dumps(data, indent=4).encode("utf-8"))
+        self.wfile.write(body)
+
+    def send_response(self, code, message=None):
+        """Counts the response per endpoint and status code before sending it"""
+        responses.inc(endpoint=getattr(self, "endpoint", "other"), code=int(code))
+        super().send_response(code, message)
+
+    def log_message(self, message_format, *args):
+        """Writes the access log through logging, at DEBUG level"""
+        logging.debug("%s - " + message_format, self.address_string(), *args)
+
+    def log_error(self, message_format, *args):
+        """Writes request errors through logging"""
+        logging.warning("%s - " + message_format, self.address_string(), *args)
+
 
+class BoundedThreadPoolHTTPServer(http.server.HTTPServer):
+    """HTTP server handing connections to a fixed pool of worker threads.
 
-def init_http_server(http_port, mode):
-    """Runs the HTTP server."""
+    At most workers + queue_limit connections are admitted at a time, anything
+    beyond that is answered with 503 instead of queueing without bound.
+    """
+
+    def __init__(self, server_address, handler, workers, queue_limit):
+        self.request_queue_size = max(queue_limit, 5)
+        super().__init__(server_address, handler)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-worker"
+        )
+        self.slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def process_request(self, request, client_address):
+        """Queues the connection on the pool or rejects it when the pool is full"""
+        if not self.slots.acquire(blocking=False):
+            pool_rejections.inc()
+            self.reject_request(request)
+            return
+        pool_connections.inc()
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        """Serves one connection (and its keep-alive requests) on a worker thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            pool_connections.dec()
+            self.slots.release()
+
+    def reject_request(self, request):
+        """Answers 503 without reading the request"""
+        body = json.dumps(
+            {
+                "error": {
+                    "code": HTTPStatus.SERVICE_UNAVAILABLE,
+                    "message": "Server overloaded, try again later",
+                }
+            }
+        ).encode("utf-8")
+        head = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            "Content-Type: application/json\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Retry-After: 1\r\n"
+            "Connection: close\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode("ascii")
+        try:
+            request.sendall(head + body)
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_http_server(
+    http_port, mode, scan_workers=0, http_workers=0, http_queue=HTTP_QUEUE_LIMIT
+):
+    """Runs the HTTP server, on a bounded worker pool when http_workers > 0."""
     server_address = ("", http_port)
     handler = LogRequestHandler
     handler.server_mode = mode
     handler.server_port = http_port
-    httpd = http.server.HTTPServer(server_address, handler)
+    handler.scan_workers = scan_workers
+    if http_workers > 0:
+        # keep-alive would starve other clients of the single threaded server
+        handler.protocol_version = "HTTP/1.1"
+        httpd = BoundedThreadPoolHTTPServer(
+            server_address, handler, http_workers, http_queue
+        )
+    else:
+        httpd = http.server.HTTPServer(server_address, handler)
     logging.info("%s Server running on port %d", mode.capitalize(), http_port)
     httpd.serve_forever()
 
 
-def init_servers(http_port, ws_port, mode):
+def list_uncompressed_files():
+    """Returns the paths of the uncompressed files of the catalog"""
+    return [
+        LOG_DIR / info["name"]
+        for info in log_catalog.list_files()
+        if not compression_of(info["name"])
+    ]
+
+
+def start_search_index(index_dir):
+    """Indexes the uncompressed files of the catalog in the background"""
+    token_index.start(index_dir, list_uncompressed_files)
+    logging.info("Search index kept in %s", index_dir)
+
+
+def start_block_summaries(summary_dir):
+    """Summarizes the blocks of the uncompressed files of the catalog in the background"""
+    block_summaries.start(summary_dir, list_uncompressed_files)
+    logging.info("Block summaries kept in %s", summary_dir)
+
+
+def init_servers(
+    http_port,
+    ws_port,
+    mode,
+    scan_workers=0,
+    http_workers=0,
+    http_queue=HTTP_QUEUE_LIMIT,
+):
     """initializes the servers"""
     # Initialize HTTP server
     http_thread = threading.Thread(
-        target=init_http_server, args=(http_port, mode), daemon=True
+        target=init_http_server,
+        args=(http_port, mode, scan_workers, http_workers, http_queue),
+        daemon=True,
     )
     http_thread.start()
 
@@ -125,11 +810,37 @@ if __name__ == "__main__":
     parser.add_argument("--mode", choices=["primary", "secondary"], default="primary")
     parser.add_argument("--port", type=int, default=None)
     parser.add_argument("--wsport", type=int, default=None)
+    parser.add_argument("--scan-workers", type=int, default=0)
+    parser.add_argument("--http-workers", type=int, default=0)
+    parser.add_argument("--http-queue", type=int, default=HTTP_QUEUE_LIMIT)
+    parser.add_argument("--page-cache-mb", type=int, default=PAGE_CACHE_MAX_BYTES >> 20)
+    parser.add_argument("--search-index", default=SEARCH_INDEX_DIR)
+    parser.add_argument("--block-summaries", default=BLOCK_SUMMARY_DIR)
+    parser.add_argument("--line-index-dir", default=LINE_INDEX_SIDECAR_DIR)
+    parser.add_argument(
+        "--log-level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        type=str.upper,
+        default=LOG_LEVEL,
+    )
+    parser.add_argument("--profiler", action="store_true")
     args = parser.parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    profiler.enabled = args.profiler
+    page_cache.max_bytes = args.page_cache_mb << 20
+    line_index.LINE_INDEX_SIDECAR_DIR = args.line_index_dir
+    if args.search_index:
+        start_search_index(args.search_index)
+    if args.block_summaries:
+        start_block_summaries(args.block_summaries)
     # Get ports
     port = args.port or (
         DEFAULT_PRIMARY_PORT if args.mode == "primary" else DEFAULT_SECONDARY_PORT
     )
     wsport = args.wsport or (WS_PORT)
     # Initialize servers
-    init_servers(port, wsport, args.mode)
+    init_servers(
+        port, wsport, args.mode, args.scan_workers, args.http_workers, args.http_queue
+    )
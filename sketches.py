@@ -0,0 +1,128 @@
+"""Module providing the mergeable sketches behind /aggregate: heavy hitters and HyperLogLog"""
+
+import math
+import base64
+import hashlib
+from collections import Counter
+
+from constants import HLL_PRECISION
+
+
+class HeavyHitters:
+    """Misra-Gries summary of the most frequent values, in bounded memory.
+
+    At most 2 * capacity counters are kept. When there are more, every
+    counter is lowered by the capacity-th largest count and those left at
+    zero are dropped, so updates cost O(1) amortized. Counts are lower
+    bounds that are at most `error` below the true counts. Summaries of
+    disjoint data merge by adding their counters.
+    """
+
+    def __init__(self, capacity, counts=None, error=0):
+        self.capacity = capacity
+        self.counts = Counter(counts or {})
+        self.error = error
+
+    def update(self, values):
+        """Counts every value of an iterable"""
+        self.counts.update(values)
+        if len(self.counts) > 2 * self.capacity:
+            self.prune()
+
+    def prune(self):
+        """Lowers the counters until at most capacity of them are left"""
+        ordered = sorted(self.counts.values(), reverse=True)
+        cut = ordered[self.capacity] if len(ordered) > self.capacity else 0
+        if cut == 0:
+            return
+        self.counts = Counter(
+            {value: count - cut for value, count in self.counts.items() if count > cut}
+        )
+        self.error += cut
+
+    def merge(self, other):
+        """Adds the counters of another summary"""
+        self.counts.update(other.counts)
+        self.error += other.error
+        if len(self.counts) > 2 * self.capacity:
+            self.prune()
+
+    def top(self, k):
+        """Returns [(value, lower bound, upper bound)] of the k most frequent values"""
+        return [
+            (value, count, count + self.error)
+            for value, count in self.counts.most_common(k)
+        ]
+
+    def to_dict(self):
+        """Serializes the summary for a partial aggregate"""
+        return {"capacity": self.capacity, "counts": self.counts, "error": self.error}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a summary made by to_dict"""
+        return cls(data["capacity"], data["counts"], data["error"])
+
+
+def hash64(value):
+    """Returns a 64 bit hash of value that is the same in every process"""
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog:
+    """Approximate distinct count in 2 ** precision one byte registers.
+
+    The standard error is about 1.04 / sqrt(2 ** precision), 1.6% with 4096
+    registers. Sketches merge by taking the larger value of every register.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        size = 1 << precision
+        self.registers = bytearray(registers if registers is not None else size)
+        if len(self.registers) != size:
+            raise ValueError("Invalid HyperLogLog registers")
+
+    def update(self, values):
+        """Adds every value of an iterable, hashing each distinct value once"""
+        precision = self.precision
+        registers = self.registers
+        shift = 64 - precision
+        mask = (1 << shift) - 1
+        for value in set(values):
+            hashed = hash64(value)
+            index = hashed >> shift
+            # position of the first 1 bit of the remaining bits
+            rank = shift - (hashed & mask).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other):
+        """Takes the union with a sketch of the same precision"""
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog precisions differ")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        """Returns the approximate number of distinct values added"""
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0**-rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # linear counting is more accurate for small cardinalities
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+    def to_dict(self):
+        """Serializes the sketch for a partial aggregate"""
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(self.registers).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores a sketch made by to_dict"""
+        return cls(data["precision"], base64.b64decode(data["registers"]))
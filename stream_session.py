@@ -0,0 +1,389 @@
+"""Module providing the subscriptions multiplexed on one WebSocket live stream connection"""
+
+import re
+import json
+import asyncio
+import logging
+from fnmatch import fnmatchcase
+
+import websockets
+
+from tail_hub import tail_hub
+from fleet_tail import fleet_hub
+from log_filter import LogFilter
+from line_index import offset_to_line
+from utils import (
+    read_logs_reverse,
+    iter_logs_reverse,
+    collect_logs,
+    is_valid_file,
+    log_catalog,
+)
+from compressed_index import compression_of
+from metrics import metrics
+from constants import (
+    LOG_DIR,
+    TAIL_FRAME_MAX_BYTES,
+    WS_MAX_SUBSCRIPTIONS,
+    WS_SUBSCRIPTION_MAX_FILES,
+    WS_BACKFILL_MAX_LINES,
+)
+
+websocket_subscriptions = metrics.gauge(
+    "log_scanner_websocket_subscriptions",
+    "Files followed by the subscriptions of the WebSocket clients",
+)
+
+GLOB_CHARACTERS = frozenset("*?[")
+
+
+def parse_stream_request(message):
+    """Parses a single stream request: a bare filename or {"file", "filter"} JSON.
+
+    Raises ValueError for an invalid filter, as parse_filter.
+    """
+    try:
+        request = json.loads(message)
+    except ValueError:
+        request = None
+    if not isinstance(request, dict):
+        return message, None
+    return request.get("file", ""), parse_filter(request.get("filter"))
+
+
+def parse_action(message):
+    """Returns a {"action": ...} JSON message as a dict, None for any other message"""
+    try:
+        request = json.loads(message)
+    except ValueError:
+        return None
+    if isinstance(request, dict) and "action" in request:
+        return request
+    return None
+
+
+def resolve_stream_files(name):
+    """Returns the paths of the uncompressed log files named by a file name or glob pattern"""
+    if not isinstance(name, str) or not name:
+        raise ValueError("Missing file")
+    if GLOB_CHARACTERS.isdisjoint(name):
+        path = LOG_DIR / name
+        if compression_of(path) or not is_valid_file(path):
+            raise ValueError("File not accessible")
+        return [path]
+    paths = [
+        LOG_DIR / info["name"]
+        for info in log_catalog.list_files()
+        if fnmatchcase(info["name"], name) and not compression_of(info["name"])
+    ]
+    if not paths:
+        raise ValueError("No matching log files found")
+    if len(paths) > WS_SUBSCRIPTION_MAX_FILES:
+        raise ValueError(
+            f"The pattern matches more than {WS_SUBSCRIPTION_MAX_FILES} files"
+        )
+    return paths
+
+
+def split_frames(lines):
+    """Splits lines into groups of at most TAIL_FRAME_MAX_BYTES"""
+    frame = []
+    size = 0
+    for line in lines:
+        if frame and size + len(line) >= TAIL_FRAME_MAX_BYTES:
+            yield frame
+            frame = []
+            size = 0
+        frame.append(line)
+        size += len(line) + 1
+    if frame:
+        yield frame
+
+
+def parse_filter(filter_text):
+    """Returns the LogFilter of a subscription, raising ValueError if invalid"""
+    if not filter_text:
+        return None
+    if not isinstance(filter_text, str):
+        raise ValueError("Invalid filter")
+    try:
+        return LogFilter(filter_text)
+    except re.error as e:
+        raise ValueError("Invalid filter") from e
+
+
+def parse_backfill(value):
+    """Returns the number of lines to backfill, raising ValueError if invalid"""
+    if value is None:
+        return 0
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("Invalid backfill")
+    return min(value, WS_BACKFILL_MAX_LINES)
+
+
+def parse_resume(value):
+    """Returns the {file path: offset} to resume from, raising ValueError if invalid"""
+    if value is None:
+        return None
+    if not isinstance(value, dict) or not all(
+        isinstance(offset, int) and not isinstance(offset, bool) and offset >= 0
+        for offset in value.values()
+    ):
+        raise ValueError("Invalid resume")
+    return value
+
+
+def read_missed_lines(path, filter_text, begin, end):
+    """Returns (skipped, lines) of [begin, end), oldest first.
+
+    At most WS_BACKFILL_MAX_LINES lines are returned, the newest ones;
+    skipped is the number of older lines left out.
+    """
+    logs, next_offset = collect_logs(
+        iter_logs_reverse(path, filter_text, end, WS_BACKFILL_MAX_LINES, begin=begin)
+    )
+    skipped = 0
+    if next_offset is not None:
+        skipped = offset_to_line(path, next_offset) - offset_to_line(path, begin)
+    return skipped, [entry["log"] for entry in reversed(logs)]
+
+
+class StreamSession:
+    """The subscriptions of one WebSocket connection, multiplexed on its socket.
+
+    A client subscribes with {"action": "subscribe", "id", "file", "filter",
+    "backfill"}, where file may be a glob pattern, and cancels with
+    {"action": "unsubscribe", "id"}. Every message sent for a subscription
+    carries its id. A backfill is read by the reverse reader up to the line
+    where the live stream of the file starts, so no line is sent twice or
+    missed. A bare filename or {"file", "filter"} as the first message is a
+    single subscription without an id, as sent by earlier clients.
+
+    With "resume": {file path: offset} the lines written since a dropped
+    connection are sent first, then every frame carries the "offset" to
+    resume from. With "fleet": true the file is followed on every secondary
+    server through the shared upstream connections of fleet_hub.
+    """
+
+    def __init__(self, websocket, source):
+        self.websocket = websocket
+        self.source = source
+        # id: [(tail_hub or fleet_hub, file, its Subscription, forwarding task)]
+        self.subscriptions = {}
+
+    async def send(self, subscription_id, **fields):
+        """Sends a JSON message, tagged with subscription_id unless it is None"""
+        if subscription_id is not None:
+            fields = {"id": subscription_id, **fields}
+        await self.websocket.send(json.dumps(fields))
+
+    async def run(self):
+        """Serves the messages of the client until it disconnects"""
+        first = True
+        async for message in self.websocket:
+            request = parse_action(message)
+            if request is not None:
+                await self.handle(request)
+            elif first:
+                try:
+                    filename, log_filter = parse_stream_request(message)
+                    logging.debug("Received filename: %s", filename)
+                    await self.subscribe(None, filename, log_filter)
+                except ValueError as e:
+                    await self.send(None, error=str(e))
+                    return
+            else:
+                await self.send(None, error="Invalid message")
+            first = False
+
+    async def handle(self, request):
+        """Serves a subscribe or unsubscribe request"""
+        subscription_id = request.get("id")
+        try:
+            if not isinstance(subscription_id, (str, int)):
+                raise ValueError("Missing id")
+            action = request["action"]
+            if action == "subscribe" and request.get("fleet"):
+                if request.get("backfill"):
+                    raise ValueError("Fleet subscriptions have no backfill")
+                await self.subscribe_fleet(
+                    subscription_id,
+                    request.get("file"),
+                    parse_filter(request.get("filter")),
+                )
+            elif action == "subscribe":
+                await self.subscribe(
+                    subscription_id,
+                    request.get("file"),
+                    parse_filter(request.get("filter")),
+                    parse_backfill(request.get("backfill")),
+                    parse_resume(request.get("resume")),
+                )
+            elif action == "unsubscribe":
+                self.unsubscribe(subscription_id)
+                await self.send(subscription_id, unsubscribed=True)
+            else:
+                raise ValueError("Unknown action")
+        except ValueError as e:
+            await self.send(subscription_id, error=str(e))
+
+    def check_new_id(self, subscription_id):
+        """Raises ValueError if no subscription can be added under subscription_id"""
+        if subscription_id in self.subscriptions:
+            raise ValueError("Subscription id already in use")
+        if len(self.subscriptions) >= WS_MAX_SUBSCRIPTIONS:
+            raise ValueError("Too many subscriptions")
+
+    async def subscribe(
+        self, subscription_id, name, log_filter=None, backfill=0, resume=None
+    ):
+        """Follows the files named by name, each one after its last backfill lines"""
+        self.check_new_id(subscription_id)
+        paths = resolve_stream_files(name)
+        if subscription_id is not None:
+            await self.send(subscription_id, subscribed=[str(path) for path in paths])
+        followed = []
+        for path in paths:
+            # One shared tailer per file feeds every subscription following it
+            try:
+                subscription = tail_hub.subscribe(path, log_filter)
+            except OSError as e:
+                for _, followed_path, followed_subscription, task in followed:
+                    task.cancel()
+                    tail_hub.unsubscribe(followed_path, followed_subscription)
+                raise ValueError("File not accessible") from e
+            task = asyncio.create_task(
+                self.forward(subscription_id, path, subscription, backfill, resume)
+            )
+            followed.append((tail_hub, path, subscription, task))
+        self.subscriptions[subscription_id] = followed
+        websocket_subscriptions.inc(len(followed))
+
+    async def subscribe_fleet(self, subscription_id, name, log_filter=None):
+        """Follows the file named by name on every secondary server"""
+        self.check_new_id(subscription_id)
+        if not isinstance(name, str) or not name:
+            raise ValueError("Missing file")
+        if not fleet_hub.servers:
+            raise ValueError("No secondary servers")
+        await self.send(subscription_id, fleet=list(fleet_hub.servers))
+        subscription = fleet_hub.subscribe(name, log_filter)
+        task = asyncio.create_task(self.forward_fleet(subscription_id, subscription))
+        self.subscriptions[subscription_id] = [(fleet_hub, name, subscription, task)]
+        websocket_subscriptions.inc()
+
+    async def send_backfill(self, subscription_id, path, subscription, limit):
+        """Sends the last limit lines before the live stream of path starts"""
+        log_filter = subscription.log_filter
+        logs, _ = await asyncio.get_running_loop().run_in_executor(
+            None,
+            read_logs_reverse,
+            path,
+            log_filter.filter_text if log_filter else None,
+            subscription.start_offset,
+            limit,
+        )
+        for frame in split_frames([entry["log"] for entry in reversed(logs)]):
+            await self.send(
+                subscription_id,
+                log="\n".join(frame),
+                source=self.source,
+                file=str(path),
+                backfill=True,
+            )
+
+    async def send_missed(self, subscription_id, path, subscription, begin):
+        """Sends the lines of path from begin up to the start of its live stream.
+
+        Without begin, or when begin is past the start of the live stream
+        because the file was rotated or truncated, only the offset of the
+        live stream is sent.
+        """
+        end = subscription.start_offset
+        if begin is not None and begin < end:
+            log_filter = subscription.log_filter
+            skipped, lines = await asyncio.get_running_loop().run_in_executor(
+                None,
+                read_missed_lines,
+                path,
+                log_filter.filter_text if log_filter else None,
+                begin,
+                end,
+            )
+            if skipped:
+                await self.send(
+                    subscription_id, skipped=skipped, source=self.source, file=str(path)
+                )
+            for frame in split_frames(lines):
+                await self.send(
+                    subscription_id,
+                    log="\n".join(frame),
+                    source=self.source,
+                    file=str(path),
+                )
+        await self.send(subscription_id, offset=end, source=self.source, file=str(path))
+
+    async def forward(
+        self, subscription_id, path, subscription, backfill=0, resume=None
+    ):
+        """Sends the backfill of a followed file, then its new lines as they come"""
+        try:
+            if backfill:
+                await self.send_backfill(subscription_id, path, subscription, backfill)
+            if resume is not None:
+                await self.send_missed(
+                    subscription_id, path, subscription, resume.get(str(path))
+                )
+            while True:
+                skipped, new_lines = await subscription.next_frame()
+                if skipped:
+                    # tell a client that fell behind how much it missed
+                    await self.send(
+                        subscription_id,
+                        skipped=skipped,
+                        source=self.source,
+                        file=str(path),
+                    )
+                # resuming clients are told where the frame ends in the file
+                position = {} if resume is None else {"offset": subscription.offset}
+                await self.send(
+                    subscription_id,
+                    log="\n".join(new_lines),
+                    source=self.source,
+                    file=str(path),
+                    **position,
+                )
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except OSError as e:
+            logging.error("Error streaming %s: %s", path, e)
+            await self.send(subscription_id, error=f"Error reading {path.name}")
+
+    async def forward_fleet(self, subscription_id, subscription):
+        """Sends the frames of the secondary servers as they come"""
+        try:
+            while True:
+                skipped, fields, lines = await subscription.next_frame()
+                if skipped:
+                    await self.send(subscription_id, skipped=skipped)
+                if fields is not None:
+                    if lines:
+                        fields = {"log": "\n".join(lines), **fields}
+                    await self.send(subscription_id, **fields)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def unsubscribe(self, subscription_id):
+        """Stops following the files of a subscription"""
+        followed = self.subscriptions.pop(subscription_id, None)
+        if followed is None:
+            raise ValueError("Unknown subscription")
+        for hub, path, subscription, task in followed:
+            task.cancel()
+            hub.unsubscribe(path, subscription)
+        websocket_subscriptions.dec(len(followed))
+
+    def close(self):
+        """Stops every subscription of the connection"""
+        for subscription_id in list(self.subscriptions):
+            self.unsubscribe(subscription_id)
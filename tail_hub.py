@@ -0,0 +1,370 @@
+"""Module providing the shared file tailers behind the WebSocket live stream"""
+
+import os
+import errno
+import ctypes
+import ctypes.util
+import struct
+import asyncio
+import threading
+import logging
+from itertools import accumulate, compress
+from collections import deque
+
+from metrics import metrics
+from constants import (
+    TAIL_QUEUE_LINES,
+    TAIL_READ_SIZE,
+    TAIL_FRAME_MAX_BYTES,
+    TAIL_FRAME_MAX_DELAY,
+    TAIL_POLL_MIN_INTERVAL,
+    TAIL_POLL_MAX_INTERVAL,
+    TAIL_WATCH_TIMEOUT,
+)
+
+dropped_lines = metrics.counter(
+    "log_scanner_tail_dropped_lines_total",
+    "Lines dropped for WebSocket clients that could not keep up",
+)
+
+# inotify flags, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def load_inotify():
+    """Returns libc when it provides inotify, None otherwise"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1  # pylint: disable=pointless-statement
+        return libc
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+_libc = load_inotify()
+
+
+class DirectoryWatch:
+    """inotify watch on a directory reporting the names of changed entries.
+
+    A queue overflow is reported as the empty name.
+    """
+
+    def __init__(
+        self, directory, mask=IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    ):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if _libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read_names(self):
+        """Returns the entry names of all pending events"""
+        names = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            position = 0
+            while position + INOTIFY_EVENT.size <= len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, position)
+                position += INOTIFY_EVENT.size
+                name = data[position : position + length].rstrip(b"\0")
+                names.add(os.fsdecode(name))
+                position += length
+
+    def close(self):
+        """Releases the inotify descriptor"""
+        os.close(self.fd)
+
+
+class Subscription:
+    """One client's view of a tailer: a bounded line buffer with drop accounting.
+
+    When the client cannot keep up the oldest lines are dropped and counted,
+    so that it can be told how many lines it skipped. The file offset after
+    every buffered line is kept alongside it when the tailer knows it, so
+    that a client can resume from the last line it was sent.
+    """
+
+    def __init__(self, log_filter=None, max_lines=TAIL_QUEUE_LINES, start_offset=0):
+        self.log_filter = log_filter
+        self.max_lines = max_lines
+        # position in the followed file of the first line it will receive
+        self.start_offset = start_offset
+        # position in the followed file after the last line of next_frame
+        self.offset = start_offset
+        self.lines = deque()
+        self.ends = deque()
+        self.skipped = 0
+        self.ready = asyncio.Event()
+
+    def push(self, lines, ends=None):
+        """Buffers the lines that pass the filter, dropping the oldest on overflow.
+
+        ends holds the file offset after each line, None where it is unknown.
+        """
+        if ends is None:
+            ends = [None] * len(lines)
+        if self.log_filter is not None:
+            matches = list(map(self.log_filter.matches_text, lines))
+            lines = list(compress(lines, matches))
+            ends = list(compress(ends, matches))
+        if not lines:
+            return
+        self.lines.extend(lines)
+        self.ends.extend(ends)
+        overflow = len(self.lines) - self.max_lines
+        if overflow > 0:
+            for _ in range(overflow):
+                self.lines.popleft()
+                self.ends.popleft()
+            self.skipped += overflow
+            dropped_lines.inc(overflow)
+        self.ready.set()
+
+    async def next_frame(self):
+        """Waits for lines and returns (skipped, lines) of at most TAIL_FRAME_MAX_BYTES"""
+        await self.ready.wait()
+        # let a burst accumulate so it goes out as one frame
+        await asyncio.sleep(TAIL_FRAME_MAX_DELAY)
+        frame = [self.lines.popleft()]
+        ends = [self.ends.popleft()]
+        size = len(frame[0])
+        while self.lines and size + len(self.lines[0]) < TAIL_FRAME_MAX_BYTES:
+            size += len(self.lines[0]) + 1
+            frame.append(self.lines.popleft())
+            ends.append(self.ends.popleft())
+        if ends[-1] is not None:
+            self.offset = ends[-1]
+        if not self.lines:
+            self.ready.clear()
+        skipped, self.skipped = self.skipped, 0
+        return skipped, frame
+
+
+class FileTailer:
+    """Follows one file and fans complete new lines out to every subscriber.
+
+    New data is noticed through an inotify watch on the parent directory, or
+    by polling with a back-off when inotify is unavailable. Rotation (a new
+    inode behind the path) and truncation (the file shrinking) restart the
+    tail at the beginning of the current file. Bursts are read in pieces of
+    at most TAIL_READ_SIZE bytes.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = str(file_path)
+        self.name = os.path.basename(self.file_path)
+        self.subscribers = set()
+        self.fd = None
+        self.inode = None
+        self.position = 0
+        self.partial = b""
+        # end of the last line handed to the subscribers
+        self.offset = 0
+        # file offset after each line returned by the last read_new_lines
+        self.line_ends = []
+        self.behind = False
+        self.watch = None
+        self.wakeup = asyncio.Event()
+        self.task = None
+        # held by read_new_lines in the executor, so that stop never closes the fd under it
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def start(self):
+        """Opens the file at its end and starts following it"""
+        self.open_file(from_start=False)
+        try:
+            self.watch = DirectoryWatch(os.path.dirname(self.file_path))
+            asyncio.get_running_loop().add_reader(self.watch.fd, self.on_watch_event)
+        except OSError as e:
+            logging.info("Polling %s, inotify unavailable: %s", self.file_path, e)
+            self.watch = None
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Stops following the file and releases its resources"""
+        if self.task is not None:
+            self.task.cancel()
+        if self.watch is not None:
+            asyncio.get_running_loop().remove_reader(self.watch.fd)
+            self.watch.close()
+        with self.lock:
+            self.stopped = True
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def open_file(self, from_start):
+        """(Re)opens the path, keeping the position at the end unless from_start"""
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.file_path, os.O_RDONLY)
+        stat = os.fstat(self.fd)
+        self.inode = stat.st_ino
+        self.position = 0 if from_start else stat.st_size
+        self.partial = b""
+        self.offset = self.position
+
+    def on_watch_event(self):
+        """Wakes the tailer when its file shows up in the inotify events"""
+        if self.name in self.watch.read_names():
+            self.wakeup.set()
+
+    async def run(self):
+        """Waits for changes and publishes the new lines"""
+        loop = asyncio.get_running_loop()
+        interval = TAIL_POLL_MIN_INTERVAL
+        while True:
+            # with inotify the timeout is only a safety net for missed events
+            timeout = TAIL_WATCH_TIMEOUT if self.watch else interval
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                lines = await loop.run_in_executor(None, self.read_new_lines)
+            except OSError as e:
+                logging.error("Error tailing %s: %s", self.file_path, e)
+                lines = []
+            self.offset = self.position - len(self.partial)
+            if lines:
+                self.publish(lines, self.line_ends)
+                interval = TAIL_POLL_MIN_INTERVAL
+            else:
+                interval = min(interval * 2, TAIL_POLL_MAX_INTERVAL)
+            if self.behind:
+                # more data is waiting, read the next piece straight away
+                self.wakeup.set()
+
+    def read_new_lines(self):
+        """Reads the next piece appended since the last call and returns complete lines"""
+        with self.lock:
+            if self.stopped:
+                return []
+            return self.read_piece()
+
+    def read_piece(self):
+        """Reads the next piece, rotation and truncation included, see read_new_lines"""
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            # rotated away, the new file has not been created yet
+            return []
+
+        # lines of a rotated file end at 0, the resume point of the new file
+        rotated = 0
+        if stat.st_ino != self.inode:
+            # drain what was written to the old file before switching over
+            start = self.position - len(self.partial)
+            data = self.partial + self.read_from(os.fstat(self.fd).st_size)
+            if not self.behind:
+                # the end of the old file also ends its last line
+                data += b"\n"
+                rotated = data.count(b"\n")
+                start = 0
+                self.open_file(from_start=True)
+                data += self.read_from(os.fstat(self.fd).st_size)
+        else:
+            if stat.st_size < self.position:
+                logging.info(
+                    "%s was truncated, restarting from the beginning", self.name
+                )
+                self.position = 0
+                self.partial = b""
+            start = self.position - len(self.partial)
+            data = self.partial + self.read_from(os.fstat(self.fd).st_size)
+
+        *complete, self.partial = data.split(b"\n")
+        sizes = (len(line) + 1 for line in complete[rotated:])
+        ends = [0] * rotated + list(accumulate(sizes, initial=start))[1:]
+        if len(self.partial) >= TAIL_READ_SIZE:
+            # never buffer an endless line, hand it out in pieces
+            complete.append(self.partial)
+            ends.append(self.position)
+            self.partial = b""
+        self.line_ends = list(compress(ends, map(bytes.strip, complete)))
+        return [line.decode(errors="ignore") for line in complete if line.strip()]
+
+    def read_from(self, size):
+        """Reads at most TAIL_READ_SIZE bytes between the current position and size"""
+        self.behind = size - self.position > TAIL_READ_SIZE
+        if size <= self.position:
+            return b""
+        data = os.pread(
+            self.fd, min(size - self.position, TAIL_READ_SIZE), self.position
+        )
+        self.position += len(data)
+        return data
+
+    def publish(self, lines, ends=None):
+        """Hands the lines and their end offsets to every subscriber"""
+        for subscription in self.subscribers:
+            subscription.push(lines, ends)
+
+
+class TailHub:
+    """Keeps one FileTailer per followed file, shared by all its subscribers"""
+
+    def __init__(self):
+        self.tailers = {}
+
+    def subscribe(self, file_path, log_filter=None):
+        """Returns a Subscription receiving the new lines of file_path"""
+        key = str(file_path)
+        tailer = self.tailers.get(key)
+        if tailer is None:
+            tailer = FileTailer(key)
+            tailer.start()
+            self.tailers[key] = tailer
+        subscription = Subscription(log_filter, start_offset=tailer.offset)
+        tailer.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, file_path, subscription):
+        """Removes the subscription and stops the tailer once nobody follows the file"""
+        key = str(file_path)
+        tailer = self.tailers.get(key)
+        if tailer is None:
+            return
+        tailer.subscribers.discard(subscription)
+        if not tailer.subscribers:
+            tailer.stop()
+            del self.tailers[key]
+
+    def queued_lines(self):
+        """Returns {(file,): lines buffered for its subscribers} of every followed file"""
+        # called from the /metrics handler thread, hence the copies
+        depths = {}
+        for key, tailer in list(self.tailers.items()):
+            depths[(key,)] = sum(
+                len(subscription.lines) for subscription in list(tailer.subscribers)
+            )
+        return depths
+
+
+tail_hub = TailHub()
+
+metrics.gauge(
+    "log_scanner_tail_queued_lines",
+    "Lines buffered for WebSocket clients, per followed file",
+    ("file",),
+    collect=tail_hub.queued_lines,
+)
@@ -0,0 +1,58 @@
+"""Module providing unit tests for the single pass aggregations"""
+
+import json
+
+import pytest
+
+from aggregation import Aggregate, aggregate_file, parse_bucket
+from field_query import FieldQuery
+
+
+def write_log(path, start, count):
+    lines = [
+        f"2025-01-01T00:{minute // 60:02d}:{minute % 60:02d}Z "
+        f"level={'ERROR' if minute % 4 == 0 else 'INFO'} "
+        f"service={'auth' if minute % 3 else 'billing'} user=u{minute % 7}"
+        for minute in range(start, start + count)
+    ]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_aggregate_file_counts_buckets_top_and_distinct(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file, 0, 240)
+    aggregate = Aggregate(bucket=60, top_field="service", distinct_field="user", k=1)
+    query = FieldQuery("level=ERROR", "logfmt", aggregate.fields)
+    aggregate_file(log_file, aggregate, query)
+    result = aggregate.result()
+    assert result["lines"] == 60
+    assert result["buckets"]["counts"] == [
+        [1735689600 + 60 * minute, 15] for minute in range(4)
+    ]
+    assert result["top"] == {
+        "field": "service",
+        "values": [{"value": "auth", "count": 40, "max_count": 40}],
+    }
+    assert result["distinct"] == {"field": "user", "estimate": 7}
+
+
+def test_partial_aggregates_merge_into_the_whole(tmp_path):
+    write_log(tmp_path / "a.log", 0, 120)
+    write_log(tmp_path / "b.log", 120, 120)
+    whole = Aggregate(bucket=60, top_field="service", distinct_field="user")
+    merged = Aggregate(bucket=60, top_field="service", distinct_field="user")
+    for name in ("a.log", "b.log"):
+        aggregate_file(tmp_path / name, whole, FieldQuery(fields=whole.fields))
+        partial = Aggregate(bucket=60, top_field="service", distinct_field="user")
+        aggregate_file(tmp_path / name, partial, FieldQuery(fields=partial.fields))
+        merged.merge(Aggregate.from_dict(json.loads(json.dumps(partial.to_dict()))))
+    assert merged.result() == whole.result()
+
+
+def test_invalid_input():
+    assert parse_bucket("60") == 60 and parse_bucket("0.5") == 0.5
+    for value in ("0", "-1", "inf", "nan", "x"):
+        with pytest.raises(ValueError):
+            parse_bucket(value)
+    with pytest.raises(ValueError):
+        Aggregate.from_dict({"lines": 1})
@@ -0,0 +1,120 @@
+"""Module providing unit tests for the per-block summaries"""
+
+import os
+import mmap
+from unittest.mock import patch
+
+from block_summary import BlockSummaries, word_grams
+from log_filter import LogFilter
+from timestamps import find_time_range
+from utils import iter_filtered_records, read_logs_reverse, read_skipped_bytes
+
+# 2025-01-01T00:00:00Z
+NEW_YEAR = 1735689600
+
+
+def write_log(path, start, count, needle_at=()):
+    with open(path, "a", encoding="utf-8") as f:
+        for second in range(start, start + count):
+            marker = "request-id=deadbeef" if second in needle_at else "request-id=cafe"
+            f.write(f"2025-01-01T{second // 3600:02d}:{second // 60 % 60:02d}:")
+            f.write(f"{second % 60:02d}Z INFO {marker} served in {second % 97}ms\n")
+
+
+def make_summaries(tmp_path):
+    summaries = BlockSummaries()
+    summaries.summary_dir = tmp_path / "summaries"
+    summaries.summary_dir.mkdir()
+    summaries.block_size = 4096
+    summaries.bloom_bytes = 256
+    return summaries
+
+
+def test_word_grams():
+    assert word_grams(b"id=DEADbeef ok", 5) == {b"deadb", b"eadbe", b"adbee", b"dbeef"}
+    assert not word_grams(b"a=b ok", 5)
+
+
+def test_blocks_without_the_filter_are_skipped(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file, 0, 2000, needle_at={100, 1500})
+    summaries = make_summaries(tmp_path)
+    summaries.summarize_pass([log_file])
+    log_filter = LogFilter("deadbeef")
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        with summaries.summary_for(log_file) as summary:
+            assert summary.blocks == len(mm) // 4096
+            assert summary.block(0)[2] == mm[: summary.block(0)[1]].count(b"\n")
+            positions = summary.filter_positions(log_filter)
+            ranges = list(summary.candidate_ranges(positions, 0, len(mm)))
+            # the tail after the last block and the two blocks of the needle
+            assert len(ranges) <= 3
+            assert sum(stop - start for start, stop in ranges) < len(mm) // 4
+            assert ranges[0][1] == len(mm)
+
+            skipped = read_skipped_bytes.snapshot()[()]
+            records = list(
+                iter_filtered_records(mm, log_filter, len(mm), 10, 0, summary)
+            )
+            assert records == list(iter_filtered_records(mm, log_filter, len(mm), 10))
+            assert len(records) == 2
+            assert read_skipped_bytes.snapshot()[()] - skipped > len(mm) // 2
+            # regex filters are not skipped
+            assert summary.filter_positions(LogFilter("dead.eef")) is None
+
+
+def test_summaries_grow_with_the_file_and_restart_on_rotation(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file, 0, 200)
+    summaries = make_summaries(tmp_path)
+    summarized = summaries.summarize_pass([log_file])
+    with summaries.summary_for(log_file) as summary:
+        assert (summary.blocks, summary.size) == (2, summarized)
+    write_log(log_file, 200, 200)
+    # a pass stops once it has summarized its budget
+    summaries.summarize_pass([log_file], budget=5000)
+    with summaries.summary_for(log_file) as summary:
+        assert summary.blocks == 4
+    summaries.summarize_pass([log_file])
+    with summaries.summary_for(log_file) as summary:
+        assert summary.blocks == os.path.getsize(log_file) // 4096
+
+    os.rename(log_file, tmp_path / "app.log.1")
+    write_log(log_file, 1000, 100)
+    with summaries.summary_for(log_file) as summary:
+        assert summary is None
+    summaries.summarize_pass([log_file])
+    with summaries.summary_for(log_file) as summary:
+        assert summary.blocks == 1
+        assert summary.block(0)[3] == NEW_YEAR + 1000
+
+
+def test_time_range_is_searched_inside_one_block(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file, 0, 3000)
+    summaries = make_summaries(tmp_path)
+    summaries.summarize_pass([log_file])
+    since, until = NEW_YEAR + 1234, NEW_YEAR + 2500
+    with summaries.summary_for(log_file) as summary:
+        assert find_time_range(log_file, since, until, None, summary) == (
+            find_time_range(log_file, since, until)
+        )
+        assert find_time_range(log_file, NEW_YEAR + 5000, None, None, summary) == (
+            os.path.getsize(log_file),
+            os.path.getsize(log_file),
+        )
+
+
+def test_reader_uses_the_summaries(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file, 0, 2000, needle_at={100})
+    summaries = make_summaries(tmp_path)
+    summaries.summarize_pass([log_file])
+    skipped = read_skipped_bytes.snapshot()[()]
+    with patch("utils.block_summaries", summaries):
+        logs, next_offset = read_logs_reverse(log_file, "deadbeef", limit=5)
+    assert [entry["log"][:20] for entry in logs] == ["2025-01-01T00:01:40Z"]
+    assert next_offset is None
+    assert read_skipped_bytes.snapshot()[()] > skipped
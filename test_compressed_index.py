@@ -0,0 +1,123 @@
+"""Module providing unit tests for reading compressed logs"""
+
+import gzip
+from unittest.mock import patch
+
+import pytest
+
+import compressed_index
+from compressed_index import iter_compressed_lines, get_compressed_index
+
+LINES = [f"2025-01-01 request {i} {'x' * (i % 97)}" for i in range(4000)]
+TEXT = ("\n".join(LINES) + "\n").encode("utf-8")
+
+
+def read_all(file_path, filter_text=None, limit=50):
+    """Pages through the whole file, newest first"""
+    records, offset = [], None
+    while True:
+        lines = iter_compressed_lines(file_path, filter_text, offset, limit)
+        while True:
+            try:
+                records.append(next(lines))
+            except StopIteration as stop:
+                offset = stop.value
+                break
+        if offset is None:
+            return records
+
+
+@patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000)
+@patch("compressed_index.COMPRESSED_READ_SIZE", 4096)
+def test_gzip_pages_cross_checkpoints(tmp_path):
+    # two gzip members, as written by appending to a .gz file
+    cut = TEXT.index(b"request 1500 ")
+    log_file = tmp_path / "app.log.1.gz"
+    log_file.write_bytes(gzip.compress(TEXT[:cut]) + gzip.compress(TEXT[cut:]))
+    compressed_index._indexes.clear()
+
+    records = read_all(log_file)
+    assert [line.decode("utf-8") for _, line in records] == LINES[::-1]
+    assert all(TEXT[start : start + len(line)] == line for start, line in records)
+    with open(log_file, "rb") as f:
+        index = get_compressed_index(log_file, f)
+    assert len(index.checkpoints) > 5
+    assert index.length == len(TEXT)
+
+    matches = read_all(log_file, r"request 3\d\d ")
+    assert [line.decode("utf-8") for _, line in matches] == LINES[300:400][::-1]
+
+
+def test_page_only_decodes_its_block(tmp_path):
+    log_file = tmp_path / "app.log.gz"
+    log_file.write_bytes(gzip.compress(TEXT))
+    compressed_index._indexes.clear()
+    with patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000):
+        list(iter_compressed_lines(log_file, limit=1))
+    with patch.object(
+        compressed_index.CompressedIndex,
+        "read_range",
+        side_effect=compressed_index.CompressedIndex.read_range,
+        autospec=True,
+    ) as read_range:
+        with patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000):
+            lines = list(
+                iter_compressed_lines(log_file, offset=len(TEXT) // 2, limit=3)
+            )
+    assert len(lines) == 3
+    assert read_range.call_count == 1
+
+
+@patch("compressed_index.COMPRESSED_READ_SIZE", 1024)
+def test_single_checkpoint_files_are_decoded_in_windows(tmp_path):
+    # one checkpoint for the whole file, like a single zstd frame
+    log_file = tmp_path / "app.log.gz"
+    log_file.write_bytes(gzip.compress(TEXT))
+    compressed_index._indexes.clear()
+    with open(log_file, "rb") as f:
+        assert len(get_compressed_index(log_file, f).checkpoints) == 1
+    with patch.object(
+        compressed_index.CompressedIndex,
+        "read_range",
+        side_effect=compressed_index.CompressedIndex.read_range,
+        autospec=True,
+    ) as read_range, patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000):
+        records = read_all(log_file, limit=700)
+    assert [line.decode("utf-8") for _, line in records] == LINES[::-1]
+    assert all(TEXT[start : start + len(line)] == line for start, line in records)
+    windows = [call.args[4] - call.args[3] for call in read_range.call_args_list]
+    assert max(windows) <= 20000
+    assert len(windows) >= len(TEXT) // 20000
+
+
+def test_zstd_frames(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    cut = TEXT.index(b"request 2000 ")
+    compressor = zstandard.ZstdCompressor()
+    log_file = tmp_path / "app.log.2.zst"
+    log_file.write_bytes(
+        compressor.compress(TEXT[:cut]) + compressor.compress(TEXT[cut:])
+    )
+    compressed_index._indexes.clear()
+    with patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000):
+        records = read_all(log_file)
+    assert [line.decode("utf-8") for _, line in records] == LINES[::-1]
+
+
+def test_single_frame_zstd_is_decoded_once(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    log_file = tmp_path / "app.log.1.zst"
+    log_file.write_bytes(zstandard.ZstdCompressor().compress(TEXT))
+    compressed_index._indexes.clear()
+    with patch(
+        "compressed_index.iter_decoded", side_effect=compressed_index.iter_decoded
+    ) as decoded, patch("compressed_index.COMPRESSED_CHECKPOINT_INTERVAL", 20000):
+        records = read_all(log_file, limit=300)
+        with open(log_file, "rb") as f:
+            index = get_compressed_index(log_file, f)
+    assert [line.decode("utf-8") for _, line in records] == LINES[::-1]
+    assert all(TEXT[start : start + len(line)] == line for start, line in records)
+    # the archive is decoded to build the index, every page reads the spill
+    assert decoded.call_count == 1
+    assert len(index.checkpoints) == -(-len(TEXT) // 20000)
+    assert index.read_range(None, 3, 60010, 60020) == TEXT[60010:60020]
@@ -0,0 +1,49 @@
+"""Module providing unit tests for content encoding negotiation and compression"""
+
+import zlib
+
+from websockets.frames import Frame, OP_TEXT
+
+from content_encoding import (
+    negotiate_encoding,
+    compress,
+    decompress,
+    StreamCompressor,
+    ThresholdPerMessageDeflate,
+)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("GZIP;q=0.5") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") is not None
+    assert negotiate_encoding("br") is None
+    assert negotiate_encoding(None) is None
+
+
+def test_compress_round_trip():
+    body = b"2025-01-01 10:00:00 INFO request served\n" * 200
+    compressed = compress(body, "gzip")
+    assert len(compressed) < len(body) // 10
+    assert decompress(compressed, "gzip") == body
+    assert decompress(body, None) == body
+
+
+def test_stream_compressor_chunks_decode_as_they_arrive():
+    stream = StreamCompressor("gzip")
+    decoder = zlib.decompressobj(47)
+    assert decoder.decompress(stream.compress(b'{"log":"one"}\n')) == b'{"log":"one"}\n'
+    assert decoder.decompress(stream.compress(b'{"log":"two"}\n')) == b'{"log":"two"}\n'
+    decoder.decompress(stream.finish())
+    assert decoder.eof
+
+
+def test_small_websocket_messages_are_not_compressed():
+    extension = ThresholdPerMessageDeflate(False, False, 15, 15, min_size=64)
+    small = extension.encode(Frame(OP_TEXT, b'{"log":"x"}'))
+    assert not small.rsv1
+    assert small.data == b'{"log":"x"}'
+    large = extension.encode(Frame(OP_TEXT, b'{"log":"x"}' * 100))
+    assert large.rsv1
+    assert len(large.data) < 100
@@ -0,0 +1,102 @@
+"""Module providing unit tests for the fan-out client"""
+
+import gzip
+import json
+import asyncio
+from unittest.mock import patch
+
+from aiohttp import web
+
+from fanout import FanoutClient
+from network_utils import fetch_from_servers, fetch_hedged
+
+
+async def start_app():
+    async def fast(request):
+        # answer gzipped like a secondary does when the client accepts it
+        assert "gzip" in request.headers["Accept-Encoding"]
+        body = json.dumps({"entries": [], "limit": request.query["limit"]})
+        return web.Response(
+            body=gzip.compress(body.encode("utf-8")),
+            content_type="application/json",
+            headers={"Content-Encoding": "gzip"},
+        )
+
+    async def slow(_):
+        await asyncio.sleep(2)
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_get("/fast/logs", fast)
+    app.router.add_get("/slow/logs", slow)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+@patch("fanout.FANOUT_TIMEOUT", 0.5)
+def test_session_is_reused_and_stuck_hosts_time_out():
+    client = FanoutClient()
+    with patch("network_utils.fanout_client", client):
+        runner, port = client.run(start_app())
+        base = f"http://localhost:{port}"
+        try:
+            results = client.run(
+                fetch_from_servers(
+                    {f"{base}/fast": {"limit": 5}, f"{base}/slow": {"limit": 5}}
+                )
+            )
+            assert results[f"{base}/fast"]["page"] == {"entries": [], "limit": "5"}
+            assert results[f"{base}/fast"]["status"] == "ok"
+            assert results[f"{base}/slow"]["page"] is None
+            assert results[f"{base}/slow"]["status"] == "error"
+            session = client.session
+            client.run(fetch_from_servers({f"{base}/fast": {"limit": 1}}))
+            assert client.session is session
+        finally:
+            # cleanup waits for the slow handler, longer than run() allows
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), client.loop).result()
+            client.close()
+
+
+@patch("network_utils.SECONDARY_REPLICAS", {"http://slow": ["http://replica"]})
+@patch("network_utils.FANOUT_HEDGE_DELAY", 0.05)
+def test_slow_server_is_hedged_against_its_replica():
+    async def fake_fetch_log(_, url, params):
+        if url.startswith("http://slow"):
+            await asyncio.sleep(5)
+        return {"entries": [url]}
+
+    async def scenario():
+        with patch("network_utils.fetch_log", fake_fetch_log):
+            return await fetch_hedged(None, "http://slow", {})
+
+    assert asyncio.run(scenario()) == {"entries": ["http://replica/logs"]}
+
+
+def test_deadline_and_circuit_breaker():
+    client = FanoutClient()
+    calls = []
+
+    async def fake_fetch_log(_, url, params):
+        calls.append(url)
+        if url.startswith("http://hung"):
+            await asyncio.sleep(5)
+        return {"entries": []}
+
+    requests = {"http://ok": {}, "http://hung": {}}
+    with patch("network_utils.fanout_client", client), patch(
+        "network_utils.fetch_log", fake_fetch_log
+    ), patch("fanout.FANOUT_BREAKER_THRESHOLD", 2):
+        try:
+            for _ in range(2):
+                results = client.run(fetch_from_servers(requests, deadline=0.1))
+                assert results["http://ok"]["status"] == "ok"
+                assert results["http://hung"]["status"] == "timeout"
+            results = client.run(fetch_from_servers(requests, deadline=0.1))
+            assert results["http://hung"]["status"] == "skipped"
+            assert calls.count("http://hung/logs") == 2
+        finally:
+            client.close()
@@ -0,0 +1,43 @@
+"""Module providing unit tests for the where and fields queries"""
+
+import pytest
+
+from field_query import FieldQuery, parse_where
+
+LINES = [
+    b"level=INFO service=auth status=200",
+    b"",
+    b'level=ERROR service=auth status=500 msg="token expired"',
+    b"level=ERROR service=billing status=503",
+    b"level=ERRORS service=auth status=abc",
+]
+
+
+def test_select_evaluates_every_predicate():
+    query = FieldQuery("level=ERROR and service=auth", "logfmt", ["status", "msg"])
+    assert query.select(LINES) == ([2], {"status": ["500"], "msg": ["token expired"]})
+    assert query.literals == [b"ERROR", b"auth"]
+
+    query = FieldQuery('status>=500 AND msg!~"expired"')
+    assert query.select(LINES) == ([3], None)
+    query = FieldQuery("service~^a and level!=INFO")
+    assert query.select(LINES) == ([2, 4], None)
+
+
+def test_fields_without_where_select_every_non_empty_line():
+    rows, fields = FieldQuery(fields=["level"]).select(LINES)
+    assert rows == [0, 2, 3, 4]
+    assert fields == {"level": ["INFO", "ERROR", "ERROR", "ERRORS"]}
+
+
+@pytest.mark.parametrize(
+    "where", ["level", "level=ERROR or x=1", "status>high", "msg~(", 'msg="\\q"']
+)
+def test_invalid_where_clauses(where):
+    with pytest.raises(ValueError):
+        parse_where(where)
+
+
+def test_invalid_parser():
+    with pytest.raises(ValueError):
+        FieldQuery("a=b", "xml")
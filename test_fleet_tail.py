@@ -0,0 +1,98 @@
+"""Module providing unit tests for the fleet subscriptions to the secondary servers"""
+
+import asyncio
+from unittest.mock import patch
+
+import websockets
+
+import utils
+from log_catalog import LogCatalog
+from log_filter import LogFilter
+from stream_session import StreamSession
+from fleet_tail import FleetHub, FleetSubscription
+
+
+def append(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+async def secondary(websocket):
+    session = StreamSession(websocket, "secondary:8083")
+    try:
+        await session.run()
+    finally:
+        session.close()
+
+
+async def next_frame(subscription):
+    return await asyncio.wait_for(subscription.next_frame(), 5)
+
+
+async def until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+@patch("fleet_tail.FLEET_RECONNECT_MIN_DELAY", 0.05)
+def test_upstreams_are_shared_and_resumed(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("old\n", encoding="utf-8")
+    path = str(log_file)
+    catalog = LogCatalog(tmp_path, utils.is_valid_file)
+
+    async def scenario():
+        server = await websockets.serve(secondary, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        url = f"ws://localhost:{port}"
+        hub = FleetHub([url])
+        first = hub.subscribe("app.log")
+        second = hub.subscribe("app.log", LogFilter("ERROR"))
+        connection = hub.connections[url]
+        assert list(connection.feeds) == ["app.log"]
+        feed = connection.feeds["app.log"]
+        await until(lambda: feed.offsets)
+
+        append(log_file, "n1\nn2 ERROR\n")
+        lines = {"source": "secondary:8083", "file": path}
+        assert await next_frame(first) == (0, lines, ["n1", "n2 ERROR"])
+        assert await next_frame(second) == (0, lines, ["n2 ERROR"])
+
+        server.close()
+        await server.wait_closed()
+        lost = {"server": url, "connected": False}
+        assert await next_frame(first) == (0, lost, ())
+        append(log_file, "n3\nn4\n")
+        server = await websockets.serve(secondary, "localhost", port)
+        # the lines written while disconnected are sent once, then the new ones
+        assert await next_frame(first) == (0, {"server": url, "connected": True}, ())
+        assert await next_frame(first) == (0, lines, ["n3", "n4"])
+        append(log_file, "n5\n")
+        assert await next_frame(first) == (0, lines, ["n5"])
+
+        hub.unsubscribe("app.log", first)
+        assert hub.connections
+        hub.unsubscribe("app.log", second)
+        assert not hub.connections
+        server.close()
+        await server.wait_closed()
+
+    with patch("utils.LOG_DIR", tmp_path), patch(
+        "stream_session.LOG_DIR", tmp_path
+    ), patch("stream_session.log_catalog", catalog):
+        asyncio.run(scenario())
+
+
+def test_subscription_drops_oldest_frames():
+    async def scenario():
+        subscription = FleetSubscription(max_lines=3)
+        subscription.push({"file": "a"}, ["a1", "a2"])
+        subscription.push({"file": "b"}, ["b1", "b2"])
+        subscription.skip(5)
+        assert await subscription.next_frame() == (7, {"file": "b"}, ["b1", "b2"])
+        assert not subscription.ready.is_set()
+
+    asyncio.run(scenario())
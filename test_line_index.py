@@ -0,0 +1,130 @@
+"""Module providing unit tests for the sparse line-offset index"""
+
+import os
+import mmap
+import threading
+from unittest.mock import patch
+
+import line_index
+from line_index import LineIndex, get_line_index, line_to_offset, offset_to_line
+
+
+def write_lines(path, count, start=0):
+    with open(path, "a", encoding="utf-8") as f:
+        for i in range(start, start + count):
+            f.write(f"line {i}\n")
+
+
+def test_offset_for_line_and_back(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_lines(log_file, 500)
+    content = log_file.read_bytes()
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        index = LineIndex(os.fstat(f.fileno()).st_ino, stride=64)
+        index.extend(mm, os.fstat(f.fileno()))
+        assert index.total_lines == 500
+        for line in (0, 1, 7, 250, 499, 500):
+            offset = index.offset_for_line(mm, line)
+            assert offset == len(b"".join(content.splitlines(True)[:line]))
+            assert index.line_for_offset(mm, offset) == line
+
+
+@patch("line_index.LINE_INDEX_STRIDE", 32)
+def test_index_extends_and_rebuilds(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_lines(log_file, 10)
+    line_index._indexes.clear()
+    assert offset_to_line(log_file, log_file.stat().st_size) == 10
+
+    write_lines(log_file, 5, start=10)
+    assert offset_to_line(log_file, log_file.stat().st_size) == 15
+    assert line_to_offset(log_file, 12) == log_file.read_bytes().index(b"line 12")
+
+    # truncation invalidates the cached index
+    log_file.write_text("only\n", encoding="utf-8")
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        index = get_line_index(log_file, mm, os.fstat(f.fileno()))
+    assert index.total_lines == 1
+
+
+def test_sidecar_round_trip(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_lines(log_file, 100)
+    line_index._indexes.clear()
+    with patch("line_index.LINE_INDEX_SIDECAR_DIR", tmp_path / "idx"):
+        assert line_to_offset(log_file, 3) == len(b"line 0\nline 1\nline 2\n")
+        line_index._indexes.clear()
+        loaded = line_index.load_sidecar(log_file)
+        assert loaded is not None
+        assert loaded.total_lines == 100
+
+
+@patch("line_index.LINE_INDEX_STRIDE", 32)
+@patch("line_index.LINE_INDEX_SIDECAR_MAX_RECORDS", 3)
+def test_sidecar_appends_growth(tmp_path):
+    log_file = tmp_path / "app.log"
+    sidecar_dir = tmp_path / "idx"
+    line_index._indexes.clear()
+    with patch("line_index.LINE_INDEX_SIDECAR_DIR", sidecar_dir):
+        sidecar = line_index.get_sidecar_path(log_file)
+        record_counts = []
+        for i in range(4):
+            write_lines(log_file, 10, start=10 * i)
+            assert offset_to_line(log_file, log_file.stat().st_size) == 10 * (i + 1)
+            record_counts.append(len(sidecar.read_text().splitlines()) - 1)
+        # a record per growth, rewritten as one once there are 3
+        assert record_counts == [1, 2, 3, 1]
+        assert line_index.load_sidecar(log_file).total_lines == 40
+
+        # a torn record keeps the ones before it, the next save rewrites
+        write_lines(log_file, 10, start=40)
+        assert offset_to_line(log_file, log_file.stat().st_size) == 50
+        with open(sidecar, "a", encoding="utf-8") as f:
+            f.write('{"size": ')
+        loaded = line_index.load_sidecar(log_file)
+        assert loaded.total_lines == 50
+        assert loaded.sidecar_records == 0
+        line_index._indexes.clear()
+        write_lines(log_file, 10, start=50)
+        assert line_to_offset(log_file, 55) == log_file.read_bytes().index(b"line 55")
+        assert len(sidecar.read_text().splitlines()) == 2
+        assert line_index.load_sidecar(log_file).total_lines == 60
+
+
+@patch("line_index.LINE_INDEX_MAX_FILES", 1)
+def test_eviction_keeps_held_file_lock(tmp_path):
+    first, second = tmp_path / "first.log", tmp_path / "second.log"
+    write_lines(first, 10)
+    write_lines(second, 10)
+    line_index._indexes.clear()
+    line_index._file_locks.clear()
+    offset_to_line(first, 0)
+    write_lines(first, 10, start=10)
+
+    extending, release = threading.Event(), threading.Event()
+    extend = LineIndex.extend
+
+    def slow_extend(self, mm, stat):
+        if stat.st_ino == first.stat().st_ino:
+            extending.set()
+            release.wait(5)
+        extend(self, mm, stat)
+
+    with patch.object(LineIndex, "extend", slow_extend):
+        worker = threading.Thread(target=offset_to_line, args=(first, 0))
+        worker.start()
+        assert extending.wait(5)
+        held = line_index._file_locks[str(first)][0]
+        assert held.locked()
+        # indexing the second file evicts the first while its lock is held
+        offset_to_line(second, 0)
+        assert str(first) not in line_index._indexes
+        assert line_index._file_locks[str(first)][0] is held
+        release.set()
+        worker.join(5)
+    assert line_to_offset(first, 20) == first.stat().st_size
+    assert len(line_index._file_locks) == 1
@@ -0,0 +1,56 @@
+"""Module providing unit tests for the log file catalog"""
+
+import os
+from unittest.mock import patch
+
+from log_catalog import LogCatalog
+
+
+def write(path, text, mtime):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def is_log(path):
+    return path.suffix == ".log"
+
+
+def test_catalog_follows_directory_changes(tmp_path):
+    write(tmp_path / "a.log", "a\n", 100)
+    write(tmp_path / "b.log", "b\n", 200)
+    write(tmp_path / "notes.md", "c\n", 300)
+    catalog = LogCatalog(tmp_path, is_log)
+
+    assert catalog.latest() == "b.log"
+    assert catalog.first_match(r"a\.") == tmp_path / "a.log"
+    assert [f["name"] for f in catalog.list_files()] == ["b.log", "a.log"]
+
+    write(tmp_path / "a.log", "a\na\n", 400)
+    write(tmp_path / "c.log", "c\n", 50)
+    os.remove(tmp_path / "b.log")
+    assert catalog.latest() == "a.log"
+    assert catalog.first_match(r"c\.") == tmp_path / "c.log"
+    assert catalog.first_match(r"b\.") is None
+    assert catalog.list_files(r"a")[0]["size"] == 4
+
+
+@patch("log_catalog.DirectoryWatch", side_effect=OSError("no inotify"))
+def test_catalog_without_inotify_uses_ttl(_, tmp_path):
+    write(tmp_path / "a.log", "a\n", 100)
+    catalog = LogCatalog(tmp_path, is_log, ttl=0)
+    assert catalog.latest() == "a.log"
+    assert catalog.watch is None
+
+    write(tmp_path / "b.log", "b\n", 200)
+    assert catalog.latest() == "b.log"
+    write(tmp_path / "a.log", "a\n", 300)
+    assert catalog.latest() == "a.log"
+
+
+def test_first_match_is_memoized(tmp_path):
+    write(tmp_path / "a.log", "a\n", 100)
+    catalog = LogCatalog(tmp_path, is_log)
+    catalog.first_match(r"a")
+    with patch("log_catalog.re.compile") as mock_compile:
+        assert catalog.first_match(r"a") == tmp_path / "a.log"
+        mock_compile.assert_not_called()
@@ -0,0 +1,102 @@
+"""Module providing unit tests for the byte-level filter engine"""
+
+import re
+import mmap
+from unittest.mock import patch
+
+from log_filter import LogFilter, is_literal, is_byte_safe, filter_scanned_lines
+
+CONTENT = (
+    b"INFO start\nERROR disk full\n\nWARN low memory\nERROR net down\n"
+    b"INFO ERRORS are counted\nerror lower\nINFO done"
+)
+
+
+def expected_spans(filter_text):
+    spans = []
+    position = 0
+    for line in CONTENT.split(b"\n"):
+        if re.search(filter_text, line.decode()):
+            spans.append((position, position + len(line)))
+        position += len(line) + 1
+    return list(reversed(spans))
+
+
+def test_is_literal():
+    assert is_literal("ERROR disk")
+    assert not is_literal("ERROR|WARN")
+    assert not is_literal("^INFO")
+
+
+@patch("log_filter.FILTER_WINDOW_SIZE", 16)
+def test_iter_matching_lines_matches_line_by_line_search(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_bytes(CONTENT)
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for filter_text in ("ERROR", "ERROR|WARN", "^INFO", "done$", r"n\s*d", "x\n"):
+            log_filter = LogFilter(filter_text)
+            spans = list(log_filter.iter_matching_lines(mm, len(mm)))
+            assert spans == expected_spans(filter_text), filter_text
+
+
+def test_iter_matching_lines_respects_end(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_bytes(CONTENT)
+    end = CONTENT.index(b"WARN")
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        spans = list(LogFilter("ERROR").iter_matching_lines(mm, end))
+    assert [CONTENT[start:stop] for start, stop in spans] == [b"ERROR disk full"]
+
+
+def test_scanned_lines_are_counted():
+    def scanned(spans_read):
+        before = filter_scanned_lines.snapshot()[()]
+        spans = LogFilter("ERROR").iter_matching_lines(CONTENT, len(CONTENT))
+        for _ in zip(range(spans_read), spans):
+            pass
+        spans.close()
+        return filter_scanned_lines.snapshot()[()] - before
+
+    # the 7 newlines of the whole buffer, or those after the last line returned
+    assert scanned(10) == 7
+    assert scanned(1) == 2
+
+
+def test_is_byte_safe():
+    for filter_text in ("ERROR|WARN", "^INFO", r"id=\d", r"a\.b", "x.*y", r"\n"):
+        assert is_byte_safe(filter_text) == (filter_text != r"id=\d"), filter_text
+    for filter_text in ("café|x", r"\w+", "(?i)error", "a.b", "[^a]", r"\u00e9"):
+        assert not is_byte_safe(filter_text), filter_text
+
+
+UNICODE_CONTENT = "naïve café\nfête\nÉRROR x\naéb\nplain ab\n\xe9t\xe9".encode("utf-8")
+
+
+@patch("log_filter.FILTER_WINDOW_SIZE", 12)
+def test_regex_keeps_str_semantics(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_bytes(UNICODE_CONTENT)
+    lines = UNICODE_CONTENT.split(b"\n")
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        for filter_text in (r"caf\w", "(?i)érror", "[éè]", "a.b", r"^\w+$", "ab"):
+            log_filter = LogFilter(filter_text)
+            spans = list(log_filter.iter_matching_lines(mm, len(mm)))
+            expected = [
+                line
+                for line in reversed(lines)
+                if re.search(filter_text, line.decode("utf-8"))
+            ]
+            assert [mm[start:stop] for start, stop in spans] == expected, filter_text
+            assert [log_filter.matches(line) for line in lines] == [
+                re.search(filter_text, line.decode("utf-8")) is not None
+                for line in lines
+            ], filter_text
+    # byte safe patterns keep the bytes regex
+    assert LogFilter("ERROR|WARN").regex is not None
+    assert LogFilter("[éè]").regex is None
@@ -0,0 +1,58 @@
+"""Module providing unit tests for the structured log parsers"""
+
+from log_parsers import PARSERS, default_parser, register_parser
+
+
+def test_logfmt_and_json_columns():
+    lines = [b'level=ERROR service=auth msg="bad \\"token\\""', b"level=INFO"]
+    columns = PARSERS["logfmt"](lines, ("level", "service", "msg"))
+    assert columns == {
+        "level": ["ERROR", "INFO"],
+        "service": ["auth", None],
+        "msg": ['bad "token"', None],
+    }
+
+    lines = [b'{"level": "ERROR", "http": {"status": 500}}', b"not json", b"[1]"]
+    columns = PARSERS["json"](lines, ("level", "http.status"))
+    assert columns == {
+        "level": ["ERROR", None, None],
+        "http.status": ["500", None, None],
+    }
+
+
+def test_syslog_and_combined_columns():
+    lines = [b"Jan  2 15:04:05 web01 sshd[42]: Accepted key", b"garbage"]
+    columns = PARSERS["syslog"](lines, ("host", "program", "pid", "message", "x"))
+    assert columns == {
+        "host": ["web01", None],
+        "program": ["sshd", None],
+        "pid": ["42", None],
+        "message": ["Accepted key", None],
+        "x": [None, None],
+    }
+
+    lines = [
+        b'10.0.0.1 - bob [10/Oct/2025:13:55:36 +0000] "GET /a.png HTTP/1.1" 404 0 '
+        b'"http://ref/" "curl/8.0"',
+        b'10.0.0.2 - - [10/Oct/2025:13:55:37 +0000] "POST /login HTTP/1.1" 200 51',
+    ]
+    columns = PARSERS["combined"](
+        lines, ("remote_addr", "path", "status", "user_agent")
+    )
+    assert columns == {
+        "remote_addr": ["10.0.0.1", "10.0.0.2"],
+        "path": ["/a.png", "/login"],
+        "status": ["404", "200"],
+        "user_agent": ["curl/8.0", None],
+    }
+
+
+def test_default_and_registered_parsers():
+    assert default_parser("/var/log/app.json") == "json"
+    assert default_parser("/var/log/auth.syslog") == "syslog"
+    assert default_parser("/var/log/app.log") == "logfmt"
+    register_parser("csv", lambda lines, fields: {"a": [line for line in lines]})
+    try:
+        assert PARSERS["csv"]([b"1,2"], ("a",)) == {"a": [b"1,2"]}
+    finally:
+        del PARSERS["csv"]
@@ -0,0 +1,70 @@
+"""Module providing unit tests for rotated log streams"""
+
+import os
+import gzip
+
+from log_stream import stream_members, resolve_cursor, iter_stream_records
+
+
+def write_rotated(tmp_path):
+    """syslog holds lines 20-29, syslog.1 lines 10-19, syslog.2.gz lines 0-9"""
+    files = {
+        "syslog.2.gz": range(0, 10),
+        "syslog.1": range(10, 20),
+        "syslog": range(20, 30),
+    }
+    for age, (name, numbers) in enumerate(files.items()):
+        text = "".join(f"line {i}\n" for i in numbers).encode("utf-8")
+        path = tmp_path / name
+        path.write_bytes(gzip.compress(text) if name.endswith(".gz") else text)
+        os.utime(path, (1000 + age, 1000 + age))
+    (tmp_path / "syslog.old").write_text("not rotated\n", encoding="utf-8")
+    (tmp_path / "syslog.3").write_text("", encoding="utf-8")
+
+
+def read_page(members, state, limit):
+    position, offset = resolve_cursor(members, state)
+    records = iter_stream_records(members, position, offset, None, limit)
+    lines = []
+    while True:
+        try:
+            path, record = next(records)
+        except StopIteration as stop:
+            return lines, stop.value
+        lines.append((path.name, record.text))
+
+
+def test_stream_members_are_newest_first(tmp_path):
+    write_rotated(tmp_path)
+    members = stream_members(tmp_path / "syslog", lambda path: True)
+    assert [member.name for member in members] == ["syslog", "syslog.1", "syslog.2.gz"]
+
+
+def test_pages_cross_file_boundaries(tmp_path):
+    write_rotated(tmp_path)
+    members = stream_members(tmp_path / "syslog", lambda path: True)
+    lines, state = read_page(members, None, 12)
+    assert lines[:2] == [("syslog", "line 29"), ("syslog", "line 28")]
+    assert lines[-2:] == [("syslog.1", "line 19"), ("syslog.1", "line 18")]
+    assert state["member"] == "syslog.1"
+
+    lines, state = read_page(members, state, 8)
+    assert lines[0] == ("syslog.1", "line 17")
+    assert state == {"member": "syslog.2.gz", "inode": members[2].inode, "offset": None}
+
+    lines, state = read_page(members, state, 12)
+    assert [text for _, text in lines] == [f"line {i}" for i in range(9, -1, -1)]
+    assert state is None
+
+
+def test_cursor_follows_rotation(tmp_path):
+    write_rotated(tmp_path)
+    members = stream_members(tmp_path / "syslog", lambda path: True)
+    _, state = read_page(members, None, 5)
+    # syslog is rotated to syslog.1 before the next page is requested
+    os.rename(tmp_path / "syslog.1", tmp_path / "syslog.1.bak")
+    os.rename(tmp_path / "syslog", tmp_path / "syslog.1")
+    (tmp_path / "syslog").write_text("line 30\n", encoding="utf-8")
+    members = stream_members(tmp_path / "syslog", lambda path: True)
+    lines, _ = read_page(members, state, 1)
+    assert lines == [("syslog.1", "line 24")]
@@ -0,0 +1,43 @@
+"""Module providing unit tests for the in-process metrics"""
+
+from metrics import MetricsRegistry
+
+
+def test_counters_and_gauges_render_per_label():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("code",))
+    clients = registry.gauge("clients", "Clients")
+    requests.inc(code=200)
+    requests.inc(2, code=404)
+    clients.inc()
+    clients.inc()
+    clients.dec()
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{code="200"} 1\n' in text
+    assert 'requests_total{code="404"} 2\n' in text
+    assert "clients 1\n" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency", ("path",), (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, path="/logs")
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{path="/logs",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{path="/logs",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{path="/logs",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{path="/logs"} 3.65' in lines
+    assert 'latency_seconds_count{path="/logs"} 4' in lines
+
+
+def test_collected_metrics_and_label_escaping():
+    registry = MetricsRegistry()
+    registry.gauge("queued", "Queued lines", ("file",), collect=lambda: {('a"b\n',): 3})
+    registry.counter("hits_total", "Hits", collect=lambda: 7)
+    # registering a name twice keeps the first metric
+    assert registry.counter("hits_total", "Other").collect is not None
+    text = registry.render()
+    assert 'queued{file="a\\"b\\n"} 3\n' in text
+    assert "hits_total 7\n" in text
@@ -1,28 +1,167 @@
 """Module providing unit test for all network utility functions"""
 
 from unittest.mock import patch, AsyncMock
+
+import pytest
+
+from aggregation import Aggregate
+from stream_session import parse_stream_request
 from network_utils import (
     handle_external_logs,
+    handle_external_aggregate,
     fetch_logs_from_secondary_servers,
+    merge_pages,
+    encode_cursor,
+    decode_cursor,
+    decode_server_states,
 )
 
 
+def page(lines, offset):
+    return {
+        "pagination": {"offset": offset},
+        "entries": [{"log": line, "source": "server"} for line in lines],
+    }
+
+
+@patch("network_utils.SECONDARY_SERVERS", ["http://a", "http://b"])
 def test_handle_external_logs():
+    pages = {
+        "http://a": page(["2025-01-01T00:00:05Z a3", "2025-01-01T00:00:01Z a1"], 10),
+        "http://b": page(["2025-01-01T00:00:04Z b2", "2025-01-01T00:00:02Z b1"], None),
+    }
+    statuses = {
+        "http://a": {"status": "ok", "latency_ms": 3},
+        "http://b": {"status": "ok", "latency_ms": 5},
+    }
     with patch(
         "network_utils.fetch_logs_from_secondary_servers",
-        return_value=[{"log": "log1", "source": "server1"}],
+        return_value=(pages, statuses),
+    ) as mock_fetch:
+        response = handle_external_logs("limit=3&filter=x&deadline=1.5")
+    mock_fetch.assert_called_once_with(
+        None,
+        "x",
+        3,
+        {
+            "http://a": {"offset": None, "skip": 0},
+            "http://b": {"offset": None, "skip": 0},
+        },
+        1.5,
+    )
+    assert response["servers"] == statuses
+    assert [entry["log"][-2:] for entry in response["entries"]] == ["a3", "b2", "b1"]
+    assert response["pagination"]["has_next"]
+    assert decode_cursor(response["pagination"]["offset"]) == {
+        "http://a": {"offset": None, "skip": 1},
+    }
+    assert "cursor=" in response["pagination"]["next"]
+
+
+def test_merge_pages_moves_exhausted_pages_to_their_next_offset():
+    pages = {"http://a": page(["2025-01-01T00:00:05Z a3", "continuation"], 42)}
+    states = {"http://a": {"offset": 100, "skip": 1}}
+    entries, next_states = merge_pages(pages, states, 5)
+    assert [entry["log"] for entry in entries] == ["continuation"]
+    assert next_states == {"http://a": {"offset": 42, "skip": 0}}
+
+
+def test_merge_pages_resumes_after_the_last_entry_returned():
+    a = page(["2025-01-01T00:00:05Z a3", "2025-01-01T00:00:01Z a1"], 10)
+    for position, entry in zip((20, 10), a["entries"]):
+        entry["offset"] = position
+    b = page(["2025-01-01T00:00:04Z b2"], None)
+    states = {
+        server: {"offset": None, "skip": 0} for server in ("http://a", "http://b")
+    }
+    entries, next_states = merge_pages({"http://a": a, "http://b": b}, states, 2)
+    assert [entry["log"][-2:] for entry in entries] == ["a3", "b2"]
+    assert "offset" not in entries[0]
+    # the next page of http://a starts before a3, without skipping anything
+    assert next_states == {"http://a": {"offset": 20, "skip": 0}}
+
+
+def test_decode_cursor_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+    assert decode_cursor(encode_cursor({"x": None})) == {"x": None}
+
+
+@patch("network_utils.SECONDARY_SERVERS", ["http://a"])
+def test_decode_server_states_only_accepts_the_secondaries():
+    state = {"offset": 7, "skip": 0}
+    cursor = encode_cursor({"http://a": state})
+    assert decode_server_states(cursor) == {"http://a": state}
+    for states in (
+        # only the configured secondaries may be fetched
+        {"http://169.254.169.254/latest": state},
+        {"http://a": None},
+        {"http://a": {"offset": 7}},
+        {"http://a": {"offset": "7", "skip": 0}},
+        {"http://a": {"offset": None, "skip": -1}},
+        {"http://a": {"offset": None, "skip": True}},
+        ["http://a"],
     ):
-        response = handle_external_logs()
-        assert response == {
-            "source": "External Logs",
-            "entries": [{"log": "log1", "source": "server1"}],
-        }
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            decode_server_states(encode_cursor(states))
 
 
 def test_fetch_logs_from_secondary_servers():
     with patch(
         "network_utils.fetch_from_servers", new_callable=AsyncMock
     ) as mock_fetch:
-        mock_fetch.return_value = [[{"log": "log1", "source": "server1"}]]
-        logs = fetch_logs_from_secondary_servers()
-        assert logs == [{"log": "log1", "source": "server1"}]
+        mock_fetch.return_value = {
+            "http://a": {"status": "ok", "latency_ms": 4, "page": page(["log1"], None)},
+            "http://b": {"status": "timeout", "latency_ms": 3000, "page": None},
+        }
+        pages, statuses = fetch_logs_from_secondary_servers(
+            "syslog", None, 10, {"http://a": {"offset": 7, "skip": 2}}, 3.0
+        )
+        mock_fetch.assert_called_once_with(
+            {
+                "http://a": {
+                    "limit": 12,
+                    "offsets": "true",
+                    "offset": 7,
+                    "filename": "syslog",
+                }
+            },
+            3.0,
+        )
+        assert pages == {"http://a": page(["log1"], None)}
+        assert statuses["http://b"] == {"status": "timeout", "latency_ms": 3000}
+
+
+def test_parse_stream_request():
+    assert parse_stream_request("syslog") == ("syslog", None)
+    filename, log_filter = parse_stream_request('{"file": "syslog", "filter": "ERR"}')
+    assert filename == "syslog"
+    assert log_filter.matches_text("ERROR here")
+    assert parse_stream_request('{"file": "syslog", "filter": ""}') == ("syslog", None)
+    for filter_value in ('"(unclosed"', "42", '["ERR"]'):
+        with pytest.raises(ValueError, match="Invalid filter"):
+            parse_stream_request(f'{{"file": "syslog", "filter": {filter_value}}}')
+
+
+@patch("network_utils.SECONDARY_SERVERS", ["http://a", "http://b", "http://c"])
+def test_handle_external_aggregate():
+    partial = Aggregate(top_field="service")
+    partial.add([b"service=auth", b"service=db"], [0, 1], {"service": ["auth", "db"]})
+    with patch(
+        "network_utils.fetch_from_servers", new_callable=AsyncMock
+    ) as mock_fetch:
+        mock_fetch.return_value = {
+            "http://a": {"status": "ok", "latency_ms": 4, "page": partial.to_dict()},
+            "http://b": {"status": "ok", "latency_ms": 5, "page": partial.to_dict()},
+            "http://c": {"status": "ok", "latency_ms": 6, "page": {"lines": 1}},
+        }
+        response = handle_external_aggregate("top=service&k=1&deadline=1")
+    forwarded = {"top": "service", "k": "1", "partial": "true"}
+    mock_fetch.assert_called_once_with(
+        {server: forwarded for server in ("http://a", "http://b", "http://c")},
+        1.0,
+        "/aggregate",
+    )
+    assert response["lines"] == 4
+    assert response["top"]["values"] == [{"value": "auth", "count": 2, "max_count": 2}]
+    assert response["servers"]["http://c"]["status"] == "error"
@@ -0,0 +1,76 @@
+"""Module providing unit tests for the page result cache"""
+
+from unittest.mock import patch
+
+from page_cache import PageCache
+from utils import read_logs_reverse
+
+
+def test_lru_eviction_by_size():
+    cache = PageCache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 40)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    cache.put("huge", 4, 101)
+    assert cache.get("huge") is None
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 2
+    assert stats["evictions"] == 1 and stats["bytes"] == 80
+
+
+def test_appends_only_invalidate_the_head_page(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("".join(f"line {i}\n" for i in range(10)), encoding="utf-8")
+    cache = PageCache()
+    with patch("utils.page_cache", cache):
+        head, next_offset = read_logs_reverse(log_file, limit=3)
+        older, _ = read_logs_reverse(log_file, offset=next_offset, limit=3)
+        assert read_logs_reverse(log_file, limit=3)[0] == head
+        assert cache.stats()["hits"] == 1
+
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write("line 10\n")
+        new_head, _ = read_logs_reverse(log_file, limit=3)
+        assert new_head[0]["log"] == "line 10"
+        assert read_logs_reverse(log_file, offset=next_offset, limit=3)[0] == older
+        assert cache.stats()["hits"] == 2
+        assert cache.stats()["misses"] == 3
+
+
+def test_large_pages_are_streamed_without_being_cached(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("".join(f"line {i}\n" for i in range(100)), encoding="utf-8")
+    cache = PageCache()
+    with patch("utils.page_cache", cache), patch(
+        "utils.PAGE_CACHE_MAX_PAGE_BYTES", 1000
+    ):
+        logs, _ = read_logs_reverse(log_file, limit=100)
+        assert len(logs) == 100
+        assert cache.stats()["entries"] == 0
+        read_logs_reverse(log_file, limit=3)
+        assert cache.stats()["entries"] == 1
+
+
+def test_truncated_files_do_not_serve_old_pages(tmp_path):
+    log_file = tmp_path / "app.log"
+    old = "".join(f"old {i}\n" for i in range(10))
+    log_file.write_text(old, encoding="utf-8")
+    cache = PageCache()
+    with patch("utils.page_cache", cache):
+        older, _ = read_logs_reverse(log_file, offset=30, limit=2)
+        assert [entry["log"] for entry in older] == ["old 4", "old 3"]
+
+        # copytruncate, noticed while the file is still small
+        log_file.write_text("new 0\n", encoding="utf-8")
+        read_logs_reverse(log_file)
+        log_file.write_text(old.replace("old", "new"), encoding="utf-8")
+        logs, _ = read_logs_reverse(log_file, offset=30, limit=2)
+        assert [entry["log"] for entry in logs] == ["new 4", "new 3"]
+
+        # truncated and grown again between two reads
+        log_file.write_text(old.replace("old", "mid"), encoding="utf-8")
+        logs, _ = read_logs_reverse(log_file, offset=30, limit=2)
+        assert [entry["log"] for entry in logs] == ["mid 4", "mid 3"]
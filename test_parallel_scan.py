@@ -0,0 +1,53 @@
+"""Module providing unit tests for the parallel filtered scan"""
+
+import mmap
+from unittest.mock import patch
+
+from parallel_scan import split_ranges, read_matches_parallel
+from utils import read_logs_reverse
+from log_filter import filter_scanned_lines
+
+
+def write_log(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(2000):
+            level = "ERROR" if i % 7 == 0 else "INFO"
+            f.write(f"{level} event {i}\n")
+
+
+def test_split_ranges_are_newline_aligned(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file)
+    content = log_file.read_bytes()
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        ranges = split_ranges(mm, len(mm), range_size=1000)
+    assert ranges[0][1] == len(content)
+    assert ranges[-1][0] == 0
+    for (begin, _), (_, end) in zip(ranges, ranges[1:]):
+        assert begin == end
+        assert content[begin - 1 : begin] == b"\n"
+
+
+def test_parallel_scan_matches_sequential(tmp_path):
+    log_file = tmp_path / "app.log"
+    write_log(log_file)
+    expected, expected_next = read_logs_reverse(log_file, "ERROR", None, 50)
+    with open(log_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        with patch(
+            "parallel_scan.split_ranges",
+            side_effect=lambda mm, end, begin: split_ranges(
+                mm, end, begin, range_size=1000
+            ),
+        ):
+            scanned_before = filter_scanned_lines.snapshot()[()]
+            matches, next_offset = read_matches_parallel(
+                log_file, mm, "ERROR", len(mm), 50, 2
+            )
+    # the lines scanned by the workers are counted by the server
+    assert filter_scanned_lines.snapshot()[()] - scanned_before >= 50 * 7
+    assert [line.decode() for _, line in matches] == [e["log"] for e in expected]
+    assert next_offset == expected_next
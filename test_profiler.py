@@ -0,0 +1,43 @@
+"""Module providing unit tests for the sampling profiler"""
+
+import time
+import threading
+
+from profiler import SamplingProfiler
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_collapsed_stacks_of_running_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    try:
+        assert profiler.start()
+        assert not profiler.start()
+        time.sleep(0.1)
+        collapsed = profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+    assert not profiler.running
+    assert profiler.samples > 0
+    stacks = [line.rsplit(" ", 1) for line in collapsed.splitlines()]
+    busy = [stack for stack, _ in stacks if stack.startswith("busy;")]
+    assert busy and all("busy_loop (test_profiler.py:" in stack for stack in busy)
+    assert all(int(count) > 0 for _, count in stacks)
+
+
+def test_timed_profile_stops_by_itself():
+    profiler = SamplingProfiler(interval=0.001)
+    assert profiler.start(seconds=0.02)
+    profiler.thread.join(5)
+    assert not profiler.running
+    samples = profiler.samples
+    assert samples > 0
+    assert profiler.collapsed() == profiler.stop()
+    assert profiler.samples == samples
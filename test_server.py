@@ -0,0 +1,324 @@
+"""Module providing unit tests for the HTTP server"""
+
+import os
+import gzip
+import json
+import time
+import threading
+import http.client
+from unittest.mock import patch
+
+from server import LogRequestHandler, BoundedThreadPoolHTTPServer
+from profiler import profiler
+from token_index import TokenIndex
+
+
+def start_server(workers, queue_limit):
+    handler = type("Handler", (LogRequestHandler,), {})
+    handler.protocol_version = "HTTP/1.1"
+    handler.server_port = 0
+    handler.scan_workers = 0
+    httpd = BoundedThreadPoolHTTPServer(("localhost", 0), handler, workers, queue_limit)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def test_keep_alive_serves_several_requests_per_connection():
+    httpd = start_server(workers=2, queue_limit=0)
+    try:
+        conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+        for _ in range(3):
+            conn.request("GET", "/unknown")
+            response = conn.getresponse()
+            body = json.loads(response.read())
+            assert response.status == 404
+            assert body["error"]["message"] == "Endpoint Not Found"
+            assert not response.will_close
+        conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_overload_is_rejected_with_503():
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        # occupy the only slot
+        assert httpd.slots.acquire(blocking=False)
+        conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+        conn.request("GET", "/logs")
+        response = conn.getresponse()
+        assert response.status == 503
+        assert response.getheader("Retry-After") == "1"
+        conn.close()
+        httpd.slots.release()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_logs_stream_as_ndjson(tmp_path):
+    (tmp_path / "app.log").write_text("one\ntwo\nthree\n", encoding="utf-8")
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request(
+                "GET",
+                "/logs?filename=app.log&limit=2&filter=e",
+                headers={"Accept": "application/x-ndjson"},
+            )
+            response = conn.getresponse()
+            assert response.getheader("Transfer-Encoding") == "chunked"
+            lines = [json.loads(line) for line in response.read().splitlines()]
+            conn.close()
+        assert [entry["log"] for entry in lines[:-1]] == ["three", "one"]
+        assert lines[-1]["pagination"]["has_next"] is False
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_responses_are_compressed_when_accepted(tmp_path):
+    (tmp_path / "app.log").write_text("a fairly long log line\n" * 200, "utf-8")
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            for accept in ("application/json", "application/x-ndjson"):
+                conn.request(
+                    "GET",
+                    "/logs?filename=app.log&limit=50",
+                    headers={"Accept": accept, "Accept-Encoding": "gzip"},
+                )
+                response = conn.getresponse()
+                assert response.getheader("Content-Encoding") == "gzip"
+                body = gzip.decompress(response.read()).decode("utf-8")
+                assert body.count("a fairly long log line") == 50
+            # small bodies are sent as they are
+            conn.request("GET", "/unknown", headers={"Accept-Encoding": "gzip"})
+            response = conn.getresponse()
+            assert response.getheader("Content-Encoding") is None
+            assert json.loads(response.read())["error"]["code"] == 404
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_logs_time_range(tmp_path):
+    lines = [f"2025-01-01T10:{minute:02d}:00Z event {minute}" for minute in range(60)]
+    (tmp_path / "app.log").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request(
+                "GET",
+                "/logs?filename=app.log&limit=4&since=2025-01-01T10:14:00Z"
+                "&until=2025-01-01T10:20:00Z&filter=event",
+            )
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"][-2:] for entry in page["entries"]] == [
+                "20",
+                "19",
+                "18",
+                "17",
+            ]
+            conn.request("GET", page["pagination"]["next"])
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"][-2:] for entry in page["entries"]] == [
+                "16",
+                "15",
+                "14",
+            ]
+            assert page["pagination"]["has_next"] is False
+            conn.request("GET", "/logs?filename=app.log&since=noon")
+            assert conn.getresponse().status == 400
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_logs_rotated_stream(tmp_path):
+    (tmp_path / "app.log.1.gz").write_bytes(gzip.compress(b"one\ntwo\n"))
+    (tmp_path / "app.log").write_text("three\nfour\n", encoding="utf-8")
+    os.utime(tmp_path / "app.log.1.gz", (1000, 1000))
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request("GET", "/logs?filename=app.log&rotated=true&limit=3")
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"] for entry in page["entries"]] == [
+                "four",
+                "three",
+                "two",
+            ]
+            assert page["entries"][2]["file"].endswith("app.log.1.gz")
+            conn.request("GET", page["pagination"]["next"])
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"] for entry in page["entries"]] == ["one"]
+            assert page["pagination"]["has_next"] is False
+            conn.request("GET", "/logs?filename=app.log&rotated=true&cursor=bad")
+            assert conn.getresponse().status == 400
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_search_endpoint(tmp_path):
+    (tmp_path / "app.log").write_text("id=a1 one\nid=b2 two\nid=a1 three\n", "utf-8")
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+    index.index_pass([tmp_path / "app.log"])
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("server.token_index", index):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request("GET", "/search?q=id%3Da1&limit=1")
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"] for entry in page["entries"]] == ["id=a1 three"]
+            conn.request("GET", page["pagination"]["next"])
+            page = json.loads(conn.getresponse().read())
+            assert [entry["offset"] for entry in page["entries"]] == [0]
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_metrics_endpoint(tmp_path):
+    (tmp_path / "app.log").write_text("one\ntwo\nthree\n", encoding="utf-8")
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path), patch("utils.page_cache.max_bytes", 0):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request("GET", "/logs?filename=app.log&filter=t")
+            conn.getresponse().read()
+            conn.request("GET", "/metrics")
+            response = conn.getresponse()
+            text = response.read().decode("utf-8")
+            conn.close()
+        assert response.getheader("Content-Type").startswith("text/plain")
+        assert (
+            'log_scanner_http_request_duration_seconds_count{endpoint="/logs"}' in text
+        )
+        assert 'log_scanner_http_responses_total{endpoint="/logs",code="200"}' in text
+        assert 'log_scanner_read_lines_total{filtered="true"}' in text
+        assert 'log_scanner_read_scanned_bytes_sum{filtered="true"}' in text
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_profile_endpoint():
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+        conn.request("GET", "/debug/profile?seconds=0.05")
+        response = conn.getresponse()
+        response.read()
+        assert response.status == 404
+        with patch("server.profiler.enabled", True):
+            # the profile runs in the background, the request returns at once
+            conn.request("GET", "/debug/profile?seconds=0.05")
+            response = conn.getresponse()
+            assert json.loads(response.read()) == {"running": True, "seconds": 0.05}
+            assert response.status == 200
+            conn.request("GET", "/debug/profile?action=start")
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 409
+            while profiler.running:
+                time.sleep(0.01)
+            conn.request("GET", "/debug/profile?action=result")
+            response = conn.getresponse()
+            collapsed = response.read().decode("utf-8")
+            assert response.status == 200
+            assert "serve_forever" in collapsed
+            conn.request("GET", "/debug/profile?action=stop")
+            response = conn.getresponse()
+            assert response.read().decode("utf-8") == collapsed
+            for seconds in ("abc", "-1", "nan"):
+                conn.request("GET", f"/debug/profile?seconds={seconds}")
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 400
+        conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_logs_where_and_fields(tmp_path):
+    lines = [f"level={'ERROR' if i % 3 else 'INFO'} n={i}" for i in range(30)]
+    (tmp_path / "app.log").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    (tmp_path / "app.log.gz").write_bytes(gzip.compress(b"level=ERROR\n"))
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request("GET", "/logs?filename=app.log&where=level%3DINFO&limit=4")
+            page = json.loads(conn.getresponse().read())
+            assert [entry["log"] for entry in page["entries"]] == [
+                "level=INFO n=27",
+                "level=INFO n=24",
+                "level=INFO n=21",
+                "level=INFO n=18",
+            ]
+            next_link = page["pagination"]["next"]
+            assert "where=level%3DINFO" in next_link
+            conn.request("GET", next_link + "&fields=n")
+            page = json.loads(conn.getresponse().read())
+            assert [entry["fields"] for entry in page["entries"]] == [
+                {"n": str(n)} for n in (15, 12, 9, 6)
+            ]
+            conn.request("GET", "/logs?filename=app.log&where=level")
+            response = conn.getresponse()
+            assert response.status == 400
+            response.read()
+            conn.request("GET", "/logs?filename=app.log.gz&where=level%3DINFO")
+            response = conn.getresponse()
+            assert response.status == 400
+            response.read()
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_aggregate_endpoint(tmp_path):
+    lines = [
+        f"2025-01-01T00:00:{i:02d}Z level={'ERROR' if i % 3 else 'INFO'} user=u{i % 4}"
+        for i in range(30)
+    ]
+    (tmp_path / "app.log").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    httpd = start_server(workers=1, queue_limit=0)
+    try:
+        with patch("utils.LOG_DIR", tmp_path):
+            conn = http.client.HTTPConnection("localhost", httpd.server_address[1])
+            conn.request(
+                "GET",
+                "/aggregate?filename=app.log&where=level%3DERROR"
+                "&bucket=10&top=user&distinct=user&k=2",
+            )
+            result = json.loads(conn.getresponse().read())
+            assert result["lines"] == 20
+            assert result["buckets"]["counts"] == [
+                [1735689600, 6],
+                [1735689610, 7],
+                [1735689620, 7],
+            ]
+            assert len(result["top"]["values"]) == 2
+            assert result["distinct"]["estimate"] == 4
+            conn.request("GET", "/aggregate?filename=app.log&bucket=0")
+            response = conn.getresponse()
+            assert response.status == 400
+            response.read()
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
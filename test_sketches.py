@@ -0,0 +1,39 @@
+"""Module providing unit tests for the heavy hitters and HyperLogLog sketches"""
+
+import random
+
+from sketches import HeavyHitters, HyperLogLog
+
+
+def test_heavy_hitters_find_frequent_values_in_bounded_memory():
+    rng = random.Random(0)
+    values = ["hot"] * 3000 + ["warm"] * 1500 + [f"cold{i}" for i in range(20000)]
+    rng.shuffle(values)
+    summary = HeavyHitters(capacity=20)
+    for start in range(0, len(values), 1000):
+        summary.update(values[start : start + 1000])
+        assert len(summary.counts) <= 40
+    (hot, low, high), (warm, *_) = summary.top(2)
+    assert (hot, warm) == ("hot", "warm")
+    assert low <= 3000 <= high
+
+
+def test_heavy_hitters_merge_and_serialize():
+    left, right = HeavyHitters(5), HeavyHitters(5)
+    left.update(["a", "a", "b"])
+    right.update(["a", "c", "c"])
+    left.merge(HeavyHitters.from_dict(right.to_dict()))
+    assert left.top(2) == [("a", 3, 3), ("c", 2, 2)]
+
+
+def test_hyperloglog_estimates_and_merges():
+    left, right = HyperLogLog(), HyperLogLog()
+    left.update(f"user{i}" for i in range(60000))
+    right.update(f"user{i}" for i in range(40000, 100000))
+    assert abs(left.estimate() - 60000) < 60000 * 0.05
+    left.merge(HyperLogLog.from_dict(right.to_dict()))
+    assert abs(left.estimate() - 100000) < 100000 * 0.05
+
+    small = HyperLogLog()
+    small.update(["a", "b", "a", "c"])
+    assert small.estimate() == 3
@@ -0,0 +1,224 @@
+"""Module providing unit tests for the multiplexed WebSocket subscriptions"""
+
+import json
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+import utils
+from log_catalog import LogCatalog
+from tail_hub import tail_hub
+from fleet_tail import FleetHub
+from stream_session import StreamSession, split_frames
+
+
+class FakeWebSocket:
+    """Feeds queued client messages to a session and collects what it sends"""
+
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.incoming.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def send(self, message):
+        await self.sent.put(json.loads(message))
+
+    async def request(self, **fields):
+        await self.incoming.put(json.dumps(fields))
+
+    async def receive(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+
+def append(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    (tmp_path / "app.log").write_text("a1\na2 ERROR\na3\n", encoding="utf-8")
+    (tmp_path / "web.log").write_text("w1\nw2\n", encoding="utf-8")
+    catalog = LogCatalog(tmp_path, utils.is_valid_file)
+    with patch("utils.LOG_DIR", tmp_path), patch(
+        "stream_session.LOG_DIR", tmp_path
+    ), patch("stream_session.log_catalog", catalog):
+        yield tmp_path
+
+
+def test_subscriptions_are_multiplexed_on_one_socket(log_dir):
+    async def scenario():
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        running = asyncio.create_task(session.run())
+
+        await websocket.request(action="subscribe", id="all", file="*.log", backfill=2)
+        acknowledgement = await websocket.receive()
+        assert sorted(acknowledgement["subscribed"]) == [
+            str(log_dir / "app.log"),
+            str(log_dir / "web.log"),
+        ]
+        backfills = {}
+        for _ in range(2):
+            message = await websocket.receive()
+            assert message["id"] == "all" and message["backfill"]
+            backfills[message["file"]] = message["log"]
+        assert backfills == {
+            str(log_dir / "app.log"): "a2 ERROR\na3",
+            str(log_dir / "web.log"): "w1\nw2",
+        }
+
+        await websocket.request(
+            action="subscribe", id=7, file="app.log", filter="ERROR", backfill=5
+        )
+        assert await websocket.receive() == {
+            "id": 7,
+            "subscribed": [str(log_dir / "app.log")],
+        }
+        assert (await websocket.receive())["log"] == "a2 ERROR"
+        assert len(tail_hub.tailers) == 2
+
+        append(log_dir / "app.log", "a4\na5 ERROR\n")
+        received = {}
+        for _ in range(2):
+            message = await websocket.receive()
+            received[message["id"]] = message["log"]
+        assert received == {"all": "a4\na5 ERROR", 7: "a5 ERROR"}
+
+        await websocket.request(action="unsubscribe", id="all")
+        assert await websocket.receive() == {"id": "all", "unsubscribed": True}
+        assert list(tail_hub.tailers) == [str(log_dir / "app.log")]
+
+        await websocket.request(action="subscribe", id=7, file="web.log")
+        assert await websocket.receive() == {
+            "id": 7,
+            "error": "Subscription id already in use",
+        }
+        await websocket.request(action="subscribe", id="x", file="../etc/passwd")
+        assert (await websocket.receive())["error"] == "File not accessible"
+        await websocket.request(action="subscribe", id="x", file="*.gz")
+        assert (await websocket.receive())["error"] == "No matching log files found"
+        await websocket.request(action="subscribe", id="x", file="app.log", backfill=-1)
+        assert (await websocket.receive())["error"] == "Invalid backfill"
+        await websocket.request(action="unsubscribe", id="x")
+        assert (await websocket.receive())["error"] == "Unknown subscription"
+
+        await websocket.incoming.put(None)
+        await running
+        session.close()
+        assert not tail_hub.tailers
+
+    asyncio.run(scenario())
+
+
+def test_single_file_requests_of_earlier_clients(log_dir):
+    async def scenario():
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        running = asyncio.create_task(session.run())
+        await websocket.incoming.put("app.log")
+        await asyncio.sleep(0.1)
+        append(log_dir / "app.log", "a4\n")
+        assert await websocket.receive() == {
+            "log": "a4",
+            "source": "host:8081",
+            "file": str(log_dir / "app.log"),
+        }
+        await websocket.incoming.put(None)
+        await running
+        session.close()
+
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        await websocket.incoming.put("missing.log")
+        await session.run()
+        assert await websocket.receive() == {"error": "File not accessible"}
+
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        await websocket.request(file="app.log", filter="(unclosed")
+        await session.run()
+        assert await websocket.receive() == {"error": "Invalid filter"}
+
+    asyncio.run(scenario())
+
+
+def test_resume_sends_the_lines_written_since_the_offset(log_dir):
+    async def scenario():
+        path = str(log_dir / "app.log")
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        running = asyncio.create_task(session.run())
+
+        # the offset of "a2 ERROR", after a connection dropped at "a1"
+        await websocket.request(
+            action="subscribe", id=1, file="app.log", resume={path: 3}
+        )
+        await websocket.receive()
+        assert await websocket.receive() == {
+            "id": 1,
+            "log": "a2 ERROR\na3",
+            "source": "host:8081",
+            "file": path,
+        }
+        end = (log_dir / "app.log").stat().st_size
+        assert (await websocket.receive())["offset"] == end
+
+        append(log_dir / "app.log", "a4\n")
+        message = await websocket.receive()
+        assert (message["log"], message["offset"]) == ("a4", end + 3)
+
+        # beyond WS_BACKFILL_MAX_LINES the older missed lines are counted
+        with patch("stream_session.WS_BACKFILL_MAX_LINES", 1):
+            await websocket.request(
+                action="subscribe", id=2, file="app.log", resume={path: 0}
+            )
+            await websocket.receive()
+            assert (await websocket.receive())["skipped"] == 3
+            assert (await websocket.receive())["log"] == "a4"
+            assert (await websocket.receive())["offset"] == end + 3
+        await websocket.request(action="subscribe", id=3, file="app.log", resume=[1])
+        assert (await websocket.receive())["error"] == "Invalid resume"
+
+        await websocket.incoming.put(None)
+        await running
+        session.close()
+
+    asyncio.run(scenario())
+
+
+def test_fleet_subscription_requests(log_dir):
+    async def scenario():
+        websocket = FakeWebSocket()
+        session = StreamSession(websocket, "host:8081")
+        with patch("stream_session.fleet_hub", FleetHub([])):
+            await session.handle(
+                {"action": "subscribe", "id": 1, "file": "app.log", "fleet": True}
+            )
+        assert (await websocket.receive())["error"] == "No secondary servers"
+        await session.handle(
+            {"action": "subscribe", "id": 1, "fleet": True, "backfill": 5}
+        )
+        assert (await websocket.receive())["error"] == (
+            "Fleet subscriptions have no backfill"
+        )
+
+    asyncio.run(scenario())
+
+
+def test_split_frames():
+    with patch("stream_session.TAIL_FRAME_MAX_BYTES", 10):
+        assert list(split_frames(["abcd", "efgh", "ijklmnopqrst", "u"])) == [
+            ["abcd", "efgh"],
+            ["ijklmnopqrst"],
+            ["u"],
+        ]
@@ -0,0 +1,140 @@
+"""Module providing unit tests for the shared WebSocket tailers"""
+
+import os
+import asyncio
+from unittest.mock import patch
+
+from log_filter import LogFilter
+from tail_hub import TailHub, FileTailer, Subscription
+
+
+async def next_lines(subscription):
+    _, lines = await asyncio.wait_for(subscription.next_frame(), 5)
+    return lines
+
+
+def append(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_subscribers_share_one_tailer(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("old line\n", encoding="utf-8")
+
+    async def scenario():
+        hub = TailHub()
+        first = hub.subscribe(log_file)
+        second = hub.subscribe(log_file, LogFilter("2"))
+        assert len(hub.tailers) == 1
+        append(log_file, "new 1\nnew 2\npartial")
+        assert await next_lines(first) == ["new 1", "new 2"]
+        assert await next_lines(second) == ["new 2"]
+        append(log_file, " line\n")
+        assert await next_lines(first) == ["partial line"]
+        hub.unsubscribe(log_file, first)
+        hub.unsubscribe(log_file, second)
+        assert not hub.tailers
+
+    asyncio.run(scenario())
+
+
+@patch("tail_hub._libc", None)
+def test_polling_follows_rotation_and_truncation(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("", encoding="utf-8")
+
+    async def scenario():
+        hub = TailHub()
+        subscription = hub.subscribe(log_file)
+        assert hub.tailers[str(log_file)].watch is None
+
+        append(log_file, "before rotation\n")
+        assert await next_lines(subscription) == ["before rotation"]
+
+        append(log_file, "last old line")
+        os.rename(log_file, tmp_path / "app.log.1")
+        append(log_file, "first new line\n")
+        assert await next_lines(subscription) == ["last old line", "first new line"]
+
+        log_file.write_text("cut\n", encoding="utf-8")
+        assert await next_lines(subscription) == ["cut"]
+        hub.unsubscribe(log_file, subscription)
+
+    asyncio.run(scenario())
+
+
+@patch("tail_hub.TAIL_READ_SIZE", 16)
+def test_bursts_are_read_in_bounded_pieces(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("", encoding="utf-8")
+    tailer = FileTailer(log_file)
+    tailer.open_file(from_start=True)
+    append(log_file, "".join(f"line {i}\n" for i in range(10)))
+
+    lines = tailer.read_new_lines()
+    assert lines == ["line 0", "line 1"]
+    assert tailer.behind
+    while tailer.behind:
+        lines += tailer.read_new_lines()
+    assert lines == [f"line {i}" for i in range(10)]
+    os.close(tailer.fd)
+
+
+def test_stopped_tailer_does_not_reopen_the_file(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("", encoding="utf-8")
+    tailer = FileTailer(log_file)
+    tailer.open_file(from_start=True)
+    tailer.stop()
+    assert tailer.fd is None
+    # a read still queued in the executor must not follow the rotation
+    os.rename(log_file, tmp_path / "app.log.1")
+    append(log_file, "new\n")
+    assert tailer.read_new_lines() == []
+    assert tailer.fd is None
+
+
+@patch("tail_hub.TAIL_FRAME_MAX_BYTES", 12)
+def test_subscription_drops_oldest_and_batches_frames():
+    async def scenario():
+        subscription = Subscription(max_lines=3)
+        subscription.push(["a1", "a2"])
+        subscription.push(["b1", "b2", "b3"])
+        assert list(subscription.lines) == ["b1", "b2", "b3"]
+        assert await subscription.next_frame() == (2, ["b1", "b2", "b3"])
+        subscription.push(["long line 1", "long line 2"])
+        assert await subscription.next_frame() == (0, ["long line 1"])
+        assert await subscription.next_frame() == (0, ["long line 2"])
+        assert not subscription.ready.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_lines_carry_their_end_offsets(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("", encoding="utf-8")
+    tailer = FileTailer(log_file)
+    tailer.open_file(from_start=True)
+    append(log_file, "one\n\ntwo\nthr")
+    assert tailer.read_new_lines() == ["one", "two"]
+    assert tailer.line_ends == [4, 9]
+    append(log_file, "ee\n")
+    assert tailer.read_new_lines() == ["three"]
+    assert tailer.line_ends == [log_file.stat().st_size]
+
+    # lines of the old file resume at the start of the new one
+    os.rename(log_file, tmp_path / "app.log.1")
+    append(log_file, "new\n")
+    append(tmp_path / "app.log.1", "last\n")
+    assert tailer.read_new_lines() == ["last", "new"]
+    assert tailer.line_ends == [0, 4]
+    os.close(tailer.fd)
+
+    async def scenario():
+        subscription = Subscription(LogFilter("t"), start_offset=4)
+        subscription.push(["one", "two", "three"], [4, 8, 14])
+        assert await subscription.next_frame() == (0, ["two", "three"])
+        assert subscription.offset == 14
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+"""Module providing unit tests for timestamp extraction"""
+
+import mmap
+import os
+import random
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from timestamps import (
+    PARSERS,
+    parse_timestamp,
+    parse_time_value,
+    register_parser,
+    find_time_offset,
+    find_time_range,
+)
+
+NEW_YEAR = 1735689600.0
+
+
+def test_parse_timestamp_formats():
+    assert parse_timestamp("2025-01-01T00:00:00Z started") == NEW_YEAR
+    assert parse_timestamp("2025-01-01T01:00:00+01:00 started") == NEW_YEAR
+    assert parse_timestamp("[2025-01-01 00:00:00.250] started") == NEW_YEAR + 0.25
+    assert parse_timestamp("1735689600 started") == NEW_YEAR
+    year = datetime.now().year
+    assert (
+        parse_timestamp("Jan  1 00:00:00 host sshd: started")
+        == datetime(year, 1, 1).timestamp()
+    )
+
+
+def test_parse_syslog_year_from_reference():
+    january = datetime(2026, 1, 2, 8, 0).timestamp()
+    line = "Dec 31 23:59:59 host cron: rotated"
+    assert parse_timestamp(line, reference=january) == (
+        datetime(2025, 12, 31, 23, 59, 59).timestamp()
+    )
+    line = "Jan  2 07:00:00 host cron: started"
+    assert parse_timestamp(line, "syslog", january) == (
+        datetime(2026, 1, 2, 7, 0).timestamp()
+    )
+    # Feb 29 only exists in the year before
+    march = datetime(2025, 3, 1).timestamp()
+    line = "Feb 29 12:00:00 host cron: leap"
+    assert parse_timestamp(line, reference=march) == (
+        datetime(2024, 2, 29, 12, 0).timestamp()
+    )
+
+
+def test_find_time_range_across_new_year(tmp_path):
+    path = tmp_path / "syslog"
+    lines = ["Dec 31 23:00:00 host a: one\n", "Jan  1 01:00:00 host a: two\n"]
+    path.write_text("".join(lines))
+    mtime = datetime(2026, 1, 1, 2, 0).timestamp()
+    os.utime(path, (mtime, mtime))
+    since = datetime(2026, 1, 1).timestamp()
+    assert find_time_range(str(path), since, None, "syslog", None) == (
+        len(lines[0]),
+        len(lines[0]) + len(lines[1]),
+    )
+
+
+def test_parse_timestamp_without_timestamp():
+    assert parse_timestamp("    at Foo.bar(Foo.java:12)") is None
+    assert parse_timestamp("2025-13-45T00:00:00Z invalid date") is None
+
+
+def write_log(path, moments):
+    """Writes one ISO line per moment, with a stack trace after every third one"""
+    offsets = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i, moment in enumerate(moments):
+            offsets.append(f.tell())
+            stamp = datetime.fromtimestamp(moment, timezone.utc).isoformat()
+            f.write(f"{stamp} event {i}\n")
+            if i % 3 == 0:
+                f.write("    at Foo.bar(Foo.java:12)\n")
+    return offsets
+
+
+def test_find_time_offset_matches_a_linear_scan(tmp_path):
+    moments = sorted(NEW_YEAR + random.randrange(0, 600) for _ in range(300))
+    offsets = write_log(tmp_path / "app.log", moments)
+    with open(tmp_path / "app.log", "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for target in (NEW_YEAR - 1, NEW_YEAR + 250, NEW_YEAR + 601, moments[7]):
+                first = next((i for i, m in enumerate(moments) if m >= target), None)
+                expected = len(mm) if first is None else offsets[first]
+                assert find_time_offset(mm, target) == expected
+                after = next((i for i, m in enumerate(moments) if m > target), None)
+                expected = len(mm) if after is None else offsets[after]
+                assert find_time_offset(mm, target, after=True) == expected
+
+
+def test_find_time_range(tmp_path):
+    offsets = write_log(tmp_path / "app.log", [NEW_YEAR + i * 60 for i in range(10)])
+    assert find_time_range(tmp_path / "app.log", NEW_YEAR + 120, NEW_YEAR + 300) == (
+        offsets[2],
+        offsets[6],
+    )
+    assert find_time_range(tmp_path / "app.log", until=NEW_YEAR - 1) == (0, 0)
+
+
+def test_parse_time_value():
+    assert parse_time_value("1735689600.5") == NEW_YEAR + 0.5
+    assert parse_time_value("2025-01-01T00:00:00Z") == NEW_YEAR
+    assert parse_time_value("yesterday") is None
+
+
+@patch.dict(PARSERS)
+def test_register_parser():
+    register_parser("millis", lambda line: int(line.split()[0]) / 1000)
+    assert parse_timestamp("1735689600000 started", "millis") == NEW_YEAR
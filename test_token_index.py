@@ -0,0 +1,192 @@
+"""Module providing unit tests for the inverted token index"""
+
+import os
+import itertools
+from unittest.mock import patch
+
+import pytest
+
+from token_index import (
+    TokenIndex,
+    tokenize,
+    encode_postings,
+    decode_postings,
+    intersect_sorted,
+    write_segment,
+    pick_merge,
+    merge_segments,
+    Segment,
+)
+
+
+def test_postings_round_trip():
+    postings = [(1, 0), (1, 130), (1, 100000), (3, 5), (7, 2**40)]
+    data = encode_postings(postings)
+    assert list(decode_postings(data)) == postings
+    # small deltas take a byte each
+    assert len(encode_postings([(1, 0), (1, 10), (1, 20)])) == 6
+
+
+def test_intersect_sorted_streams():
+    assert list(intersect_sorted([[1, 3, 5, 7], [2, 3, 7, 9], [3, 4, 7]])) == [3, 7]
+    assert list(intersect_sorted([[1, 2], []])) == []
+    # the streams are read lazily, a shorter one ends the intersection
+    assert list(intersect_sorted([[4, 9], itertools.count(0, 2)])) == [4]
+
+
+def test_segments_are_read_through_their_directory(tmp_path):
+    path = tmp_path / "segment.bin"
+    items = [(f"t{i:03}".encode(), encode_postings([(1, i)])) for i in range(200)]
+    assert write_segment(path, iter(items)) == 200
+    segment = Segment(path)
+    assert list(segment.items()) == items
+    assert list(decode_postings(segment.postings(b"t137"))) == [(1, 137)]
+    for missing in (b"a", b"t1370", b"z"):
+        assert segment.postings(missing) == b""
+
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError):
+        Segment(path)
+
+
+@patch("token_index.SEARCH_INDEX_MERGE_FACTOR", 4)
+@patch("token_index.SEARCH_INDEX_MAX_SEGMENTS", 6)
+def test_pick_merge_merges_tiers():
+    assert pick_merge([]) is None
+    assert pick_merge([1000, 100, 100, 100]) is None
+    # four segments of the newest tier make one of the next
+    assert pick_merge([1000, 100, 100, 100, 120]) == (1, 5)
+    assert pick_merge([5000, 1000, 1000, 1000, 100]) is None
+    # past the cap the smallest adjacent run goes whatever the tiers
+    assert pick_merge([9000, 100, 30, 2000, 40, 600, 2]) == (1, 5)
+
+
+def test_tokenize():
+    assert tokenize("GET /api request-id=DEAD42 ok") == {
+        b"get",
+        b"api",
+        b"request",
+        b"id",
+        b"dead42",
+        b"ok",
+    }
+
+
+def test_incremental_index_and_search(tmp_path):
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    app = logs / "app.log"
+    web = logs / "web.log"
+    app.write_text("start\nrequest-id=abc1 begin\nother\n", encoding="utf-8")
+    web.write_text("request-id=abc1 served\n", encoding="utf-8")
+    os.utime(app, (1000, 1000))
+
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+    index.index_pass([app, web])
+    with open(app, "a", encoding="utf-8") as f:
+        f.write("request-id=abc1 done\npartial request-id=abc1")
+    os.utime(app, (1000, 1000))
+    index.index_pass([app, web])
+    assert len(index.segments) == 2
+
+    results, state = index.search("REQUEST-ID=abc1", limit=2)
+    assert [(os.path.basename(name), line) for name, _, line in results] == [
+        ("web.log", b"request-id=abc1 served"),
+        ("app.log", b"request-id=abc1 done"),
+    ]
+    # the index is reloaded from disk by a new instance
+    reopened = TokenIndex()
+    reopened.open(tmp_path / "index")
+    results, state = reopened.search("request-id=abc1", limit=2, state=state)
+    assert [line for _, _, line in results] == [b"request-id=abc1 begin"]
+    assert state is None
+
+
+@patch("token_index.SEARCH_INDEX_MAX_SEGMENTS", 2)
+def test_rotation_and_compaction(tmp_path):
+    app = tmp_path / "app.log"
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+    for i in range(3):
+        # a rotated file (new inode) is indexed again under a new id
+        (tmp_path / "new.log").write_text(f"generation g{i}\n", encoding="utf-8")
+        os.replace(tmp_path / "new.log", app)
+        index.index_pass([app])
+    index.index_pass([app])
+    assert len(index.segments) == 1
+    assert list(index.lookup("generation")) == [str(app)]
+    assert index.search("generation g0")[0] == []
+    assert [line for _, _, line in index.search("generation")[0]] == [b"generation g2"]
+    assert sorted(os.listdir(tmp_path / "index")) == [
+        "catalog.json",
+        index.segment_names[0],
+    ]
+
+
+def test_search_cursor_keeps_its_file_order(tmp_path):
+    app = tmp_path / "app.log"
+    web = tmp_path / "web.log"
+    app.write_text("hit a1\nhit a2\n", encoding="utf-8")
+    web.write_text("hit w1\nhit w2\n", encoding="utf-8")
+    os.utime(app, (1000, 1000))
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+    index.index_pass([app, web])
+
+    results, state = index.search("hit", limit=3)
+    assert [line for _, _, line in results] == [b"hit w2", b"hit w1", b"hit a2"]
+    # app.log becomes the latest modified file between the two pages
+    with open(app, "a", encoding="utf-8") as f:
+        f.write("other\n")
+    results, state = index.search("hit", limit=3, state=state)
+    assert [line for _, _, line in results] == [b"hit a1"]
+    assert state is None
+
+    for state in ({"files": [str(app)]}, {"files": [], "offset": 1}, {"offset": 1}):
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            index.search("hit", state=state)
+
+
+@patch("token_index.SEARCH_INDEX_PASS_BYTES", 64)
+def test_lines_longer_than_a_pass_are_skipped(tmp_path):
+    app = tmp_path / "app.log"
+    app.write_text("first\nhuge " + "x" * 200, encoding="utf-8")
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+    index.index_pass([app])
+    # the long line is not finished yet
+    assert index.search("huge")[0] == []
+    with open(app, "a", encoding="utf-8") as f:
+        f.write("\nlast\n")
+    for _ in range(3):
+        index.index_pass([app])
+    assert [offset for _, offset, _ in index.search("huge")[0]] == [6]
+    assert [line for _, _, line in index.search("last")[0]] == [b"last"]
+
+
+@patch("token_index.SEARCH_INDEX_MERGE_FACTOR", 2)
+def test_compaction_does_not_block_searches(tmp_path):
+    app = tmp_path / "app.log"
+    index = TokenIndex()
+    index.open(tmp_path / "index")
+
+    def merge(segments, file_ids):
+        # a search can take the lock while the merged segment is written
+        assert not index.lock.locked()
+        return merge_segments(segments, file_ids)
+
+    with patch("token_index.merge_segments", side_effect=merge) as merged:
+        for i in range(4):
+            with open(app, "a", encoding="utf-8") as f:
+                f.write(f"event e{i}\n")
+            index.index_pass([app])
+    assert merged.called
+    assert len(index.segments) < 4
+    assert [line for _, _, line in index.search("event")[0]] == [
+        f"event e{i}".encode() for i in reversed(range(4))
+    ]
+    # merged away segments are deleted
+    assert sorted(os.listdir(tmp_path / "index")) == sorted(
+        ["catalog.json", *index.segment_names]
+    )
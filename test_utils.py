@@ -1,5 +1,7 @@
 """Module providing all unit tests for utility functions"""
 
+import os
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 from pathlib import Path
 from http import HTTPStatus
@@ -12,8 +14,17 @@ from utils import (
     get_file_path,
     get_response,
     get_next_url,
+    iter_log_records,
+    iter_log_lines,
+    iter_logs_reverse,
+    collect_logs,
+    LogRecord,
+    file_generation,
+    file_generations,
 )
 
+from log_catalog import LogCatalog
+from page_cache import PageCache
 from constants import HOSTNAME, DEFAULT_PRIMARY_PORT, LOG_DIR
 
 
@@ -22,15 +33,11 @@ def test_is_valid_regex():
     assert not is_valid_regex(r"[")
 
 
-@patch("utils.LOG_DIR", new_callable=MagicMock)
-def test_get_first_matching_file(mock_log_dir):
-    mock_file = MagicMock()
-    mock_file.is_file.return_value = True
-    mock_file.name = "logfile.log"
-    mock_log_dir.iterdir.return_value = [mock_file]
-
-    assert get_first_matching_file(r"logfile\.log") == mock_file
-    assert get_first_matching_file(r"nonexistent\.log") is None
+def test_get_first_matching_file(tmp_path):
+    (tmp_path / "logfile.log").write_text("log1\n", encoding="utf-8")
+    with patch("utils.log_catalog", LogCatalog(tmp_path, lambda path: True)):
+        assert get_first_matching_file(r"logfile\.log") == tmp_path / "logfile.log"
+        assert get_first_matching_file(r"nonexistent\.log") is None
 
 
 @patch("utils.LOG_DIR", new_callable=MagicMock)
@@ -54,36 +61,23 @@ def test_is_valid_file(mock_log_dir):
     assert not is_valid_file(mock_file)
 
 
-@patch("utils.LOG_DIR", new_callable=MagicMock)
-@patch("utils.is_valid_file")
-def test_get_latest_log_file(mock_is_valid_file, mock_log_dir):
-    mock_file = MagicMock()
-    mock_file.is_file.return_value = True
-    mock_file.stat.return_value.st_mtime = 100
-    mock_log_dir.iterdir.return_value = [mock_file]
-    mock_is_valid_file.return_value = True
-
-    assert get_latest_log_file() == mock_file.name
-    mock_is_valid_file.return_value = False
-    assert get_latest_log_file() is None
+def test_get_latest_log_file(tmp_path):
+    (tmp_path / "old.log").write_text("log1\n", encoding="utf-8")
+    (tmp_path / "new.log").write_text("log2\n", encoding="utf-8")
+    os.utime(tmp_path / "old.log", (100, 100))
+    with patch("utils.log_catalog", LogCatalog(tmp_path, lambda path: True)):
+        assert get_latest_log_file() == "new.log"
+    with patch("utils.log_catalog", LogCatalog(tmp_path, lambda path: False)):
+        assert get_latest_log_file() is None
 
 
-@patch("utils.os.path.getsize")
-@patch("utils.mmap.mmap")
-@patch("utils.open", new_callable=MagicMock)
-def test_read_logs_reverse(mock_open, mock_mmap, mock_getsize):
-    mock_file = MagicMock()
-    mock_open.return_value.__enter__.return_value = mock_file
-    mock_getsize.return_value = 100
-
-    file_content = b"log1\nlog2\nlog3\nlog4\nlog5"
-    mock_mmap_instance = MagicMock()
-    mock_mmap_instance.read.return_value = file_content
-    mock_mmap_instance.__enter__.return_value = mock_mmap_instance
-    mock_mmap.return_value = mock_mmap_instance
+@patch("utils.page_cache", PageCache(0))
+def test_read_logs_reverse(tmp_path):
+    log_file = tmp_path / "install.log"
+    log_file.write_bytes(b"log1\nlog2\nlog3\nlog4\nlog5")
 
     logs, next_offset = read_logs_reverse(
-        Path("/var/log/install.log"),
+        log_file,
         None,
         None,
         3,
@@ -92,23 +86,36 @@ def test_read_logs_reverse(mock_open, mock_mmap, mock_getsize):
     )
     expected_logs = [
         {
-            "log": "log5",
-            "source": f"{HOSTNAME}:{DEFAULT_PRIMARY_PORT}",
-            "file": "/var/log/install.log",
-        },
-        {
-            "log": "log4",
+            "log": f"log{number}",
             "source": f"{HOSTNAME}:{DEFAULT_PRIMARY_PORT}",
-            "file": "/var/log/install.log",
-        },
-        {
-            "log": "log3",
-            "source": f"{HOSTNAME}:{DEFAULT_PRIMARY_PORT}",
-            "file": "/var/log/install.log",
-        },
+            "file": str(log_file),
+        }
+        for number in (5, 4, 3)
     ]
     assert logs == expected_logs
-    assert next_offset is not None
+    assert next_offset == 10
+
+
+@patch("utils.page_cache", PageCache(0))
+@patch("utils.CHUNK_SIZE", 16)
+@patch("utils.CHUNK_MAX_SIZE", 64)
+def test_read_logs_reverse_keeps_lines_across_chunks(tmp_path):
+    log_file = tmp_path / "app.log"
+    lines = [f"line {number} " + "x" * (number * 7 % 90) for number in range(200)]
+    log_file.write_bytes("\n".join(lines).encode("utf-8") + b"\n")
+    content = log_file.read_bytes()
+
+    read = []
+    offset = None
+    while True:
+        records, offset = collect_logs(iter_log_records(log_file, None, offset, 37))
+        for record in records:
+            assert content[record.offset :].startswith(record.data + b"\n")
+        read.extend(record.text for record in records)
+        if offset is None:
+            break
+        assert content[offset - 1 : offset] == b"\n"
+    assert read == lines[::-1]
 
 
 @patch("utils.get_latest_log_file")
@@ -129,7 +136,6 @@ def test_get_file_path(mock_is_valid_file, mock_get_latest_log_file):
 
 def test_get_response():
     response = get_response(
-        "logfile.log",
         ["log1", "log2"],
         offset=0,
         limit=2,
@@ -139,6 +145,7 @@ def test_get_response():
     expected_response = {
         "pagination": {
             "offset": 0,
+            "line": None,
             "limit": 2,
             "has_next": True,
             "next": "/next",
@@ -151,3 +158,69 @@ def test_get_response():
 def test_get_next_url():
     next_url = get_next_url("logfile.log", 100, 10, "error")
     assert next_url == "/logs?filename=logfile.log&offset=100&limit=10&filter=error"
+    next_url = get_next_url("logfile.log", 100, 10, None, next_line=42)
+    assert next_url == "/logs?filename=logfile.log&line=42&limit=10"
+
+
+def test_read_logs_reverse_with_filter(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text(
+        "INFO a\nERROR b\nINFO c\nERROR d\nERROR e\nINFO f\n", encoding="utf-8"
+    )
+    logs, next_offset = read_logs_reverse(log_file, "ERROR", None, 2)
+    assert [entry["log"] for entry in logs] == ["ERROR e", "ERROR d"]
+    assert next_offset == log_file.read_bytes().index(b"ERROR d")
+
+    logs, next_offset = read_logs_reverse(log_file, "ERROR", next_offset, 2)
+    assert [entry["log"] for entry in logs] == ["ERROR b"]
+    assert next_offset is None
+
+
+def test_iter_log_records_are_lazy_and_exact(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_bytes(b"first\n\nsecond\nthird\n")
+    records = iter_log_records(log_file, limit=2)
+    assert next(records) == LogRecord(14, b"third")
+    assert next(records).text == "second"
+    try:
+        next(records)
+    except StopIteration as stop:
+        assert stop.value == 7
+
+    lines, next_offset = collect_logs(iter_log_lines(log_file, offset=7))
+    assert lines == ["first"]
+    assert next_offset is None
+
+
+def test_read_logs_reverse_entries_share_metadata(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("a\nb\n", encoding="utf-8")
+    logs, _ = read_logs_reverse(log_file)
+    assert logs[0]["source"] is logs[1]["source"]
+    assert logs[0]["file"] is logs[1]["file"]
+
+
+def test_entries_with_offsets_resume_right_after_them(tmp_path):
+    log_file = tmp_path / "app.log"
+    log_file.write_text("a\nb\nc\n", encoding="utf-8")
+    logs, _ = collect_logs(iter_logs_reverse(log_file, limit=2, offsets=True))
+    assert [(entry["log"], entry["offset"]) for entry in logs] == [("c", 4), ("b", 2)]
+    logs, _ = read_logs_reverse(log_file, offset=logs[0]["offset"], limit=1)
+    assert logs[0]["log"] == "b"
+
+
+@patch("utils.FILE_GENERATIONS_MAX_FILES", 2)
+def test_file_generations_are_bounded():
+    file_generations.clear()
+
+    def stat(inode, size):
+        return SimpleNamespace(st_dev=1, st_ino=inode, st_size=size)
+
+    assert file_generation(stat(1, 100)) == 0
+    assert file_generation(stat(1, 10)) == 1
+    assert file_generation(stat(2, 10)) == 0
+    # reading the first file again keeps it over the second one
+    assert file_generation(stat(1, 20)) == 1
+    assert file_generation(stat(3, 10)) == 0
+    assert list(file_generations) == [(1, 1), (1, 3)]
+    file_generations.clear()
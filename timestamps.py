@@ -0,0 +1,215 @@
+"""Module providing timestamp extraction from log lines and time range lookups"""
+
+import os
+import re
+import mmap
+import time
+from datetime import datetime, timedelta, timezone
+
+from constants import TIMESTAMP_MAX_PREFIX, SYSLOG_MAX_AHEAD
+
+# optional "[" before the timestamp, as in "[2025-01-01 10:00:00] ..."
+ISO_8601 = re.compile(
+    r"\[?(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(\.\d+)?"
+    r"(Z|[+-]\d{2}:?\d{2})?"
+)
+SYSLOG = re.compile(r"\[?([A-Z][a-z]{2}) +(\d{1,2}) (\d{2}):(\d{2}):(\d{2})")
+EPOCH = re.compile(r"\[?(\d{10})(\.\d+)?\b")
+MONTHS = {
+    name: number
+    for number, name in enumerate(
+        ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
+        + ["Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+        start=1,
+    )
+}
+
+
+def parse_iso8601(line):
+    """Parses an ISO-8601 timestamp, taken as UTC without a zone"""
+    match = ISO_8601.match(line)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    tzinfo = timezone.utc
+    if zone and zone != "Z":
+        sign = -1 if zone[0] == "-" else 1
+        tzinfo = timezone(
+            sign * timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        )
+    try:
+        moment = datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            tzinfo=tzinfo,
+        )
+    except ValueError:
+        return None
+    return moment.timestamp() + float(fraction or 0)
+
+
+def parse_syslog(line, reference=None):
+    """Parses a syslog timestamp ("Jan  2 15:04:05") in the local timezone.
+
+    The year is that of reference, the mtime of the file (now by default),
+    or the year before if the line would be more than SYSLOG_MAX_AHEAD past
+    it, as December lines of a file last written in January.
+    """
+    match = SYSLOG.match(line)
+    if not match or match.group(1) not in MONTHS:
+        return None
+    month, day, hour, minute, second = match.groups()
+    reference = time.time() if reference is None else reference
+    year = datetime.fromtimestamp(reference).year
+    timestamp = None
+    for candidate in (year, year - 1):
+        try:
+            moment = datetime(
+                candidate,
+                MONTHS[month],
+                int(day),
+                int(hour),
+                int(minute),
+                int(second),
+            )
+        except ValueError:
+            # Feb 29 only exists in one of the two years
+            continue
+        timestamp = moment.timestamp()
+        if timestamp <= reference + SYSLOG_MAX_AHEAD:
+            break
+    return timestamp
+
+
+def parse_epoch(line):
+    """Parses epoch seconds"""
+    match = EPOCH.match(line)
+    if not match:
+        return None
+    return float(match.group(1)) + float(match.group(2) or 0)
+
+
+# Timestamp parsers by name, tried in this order by parse_timestamp
+PARSERS = {
+    "iso8601": parse_iso8601,
+    "syslog": parse_syslog,
+    "epoch": parse_epoch,
+}
+# parsers of stamps without a year, also given the reference time of the line
+YEARLESS_PARSERS = {parse_syslog}
+
+
+def register_parser(name, parse):
+    """Adds a parser taking a line and returning epoch seconds or None"""
+    PARSERS[name] = parse
+
+
+def parse_timestamp(line, time_format=None, reference=None):
+    """Returns the epoch seconds of the timestamp starting line, or None.
+
+    With time_format only the parser of that name is used, otherwise every
+    registered parser is tried. reference, the mtime of the file the line
+    comes from, completes stamps without a year.
+    """
+    parsers = PARSERS.values() if time_format is None else [PARSERS[time_format]]
+    for parse in parsers:
+        if parse in YEARLESS_PARSERS:
+            timestamp = parse(line, reference)
+        else:
+            timestamp = parse(line)
+        if timestamp is not None:
+            return timestamp
+    return None
+
+
+def parse_time_value(value):
+    """Parses a since/until query value: epoch seconds or any known timestamp"""
+    try:
+        return float(value)
+    except ValueError:
+        return parse_timestamp(value)
+
+
+def next_timestamped_line(mm, pos, end, time_format=None, reference=None):
+    """Returns (start, timestamp) of the first timestamped line starting in [pos, end).
+
+    Lines without a timestamp (continuations, stack traces) are skipped.
+    Returns (None, None) if there is none.
+    """
+    start = pos
+    if pos > 0:
+        newline = mm.find(b"\n", pos - 1, end)
+        if newline == -1:
+            return None, None
+        start = newline + 1
+    while start < end:
+        stop = mm.find(b"\n", start, start + TIMESTAMP_MAX_PREFIX)
+        head = mm[start : stop if stop != -1 else start + TIMESTAMP_MAX_PREFIX]
+        timestamp = parse_timestamp(
+            head.decode(errors="ignore"), time_format, reference
+        )
+        if timestamp is not None:
+            return start, timestamp
+        newline = mm.find(b"\n", start, end)
+        if newline == -1:
+            break
+        start = newline + 1
+    return None, None
+
+
+def find_time_offset(
+    mm, moment, time_format=None, after=False, low=0, high=None, reference=None
+):
+    """Binary searches the file for the first line stamped at or after moment.
+
+    With after=True the first line stamped strictly after moment is searched
+    for instead. Lines are assumed to be in chronological order; the offset
+    of the line is returned, or len(mm) when there is none. Each step costs
+    one seek and a short forward scan, O(log n) steps in total. The search
+    can be narrowed to [low, high) when the line is known to start there;
+    low has to be a line start. reference is the mtime of the file.
+    """
+    high = len(mm) if high is None else high
+    while low < high:
+        middle = (low + high) // 2
+        start, timestamp = next_timestamped_line(
+            mm, middle, high, time_format, reference
+        )
+        if start is None:
+            high = middle
+        elif timestamp > moment if after else timestamp >= moment:
+            high = middle
+        else:
+            low = start + 1
+    start, _ = next_timestamped_line(mm, low, len(mm), time_format, reference)
+    return len(mm) if start is None else start
+
+
+def find_time_range(file_path, since=None, until=None, time_format=None, summary=None):
+    """Returns the (begin, end) byte range of the lines stamped in [since, until]
+
+    With the BlockSummary of the file, each binary search only runs inside
+    the block whose timestamps reach the moment searched for.
+    """
+    if time_format is not None:
+        # the block timestamps were taken with every parser
+        summary = None
+    with open(file_path, "rb") as f:
+        reference = os.fstat(f.fileno()).st_mtime
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            begin, end = 0, len(mm)
+            if since is not None:
+                bounds = summary.time_bounds(since) if summary else (0, None)
+                begin = find_time_offset(
+                    mm, since, time_format, False, *bounds, reference=reference
+                )
+            if until is not None:
+                bounds = summary.time_bounds(until, True) if summary else (0, None)
+                end = find_time_offset(
+                    mm, until, time_format, True, *bounds, reference=reference
+                )
+            return begin, max(begin, end)
@@ -0,0 +1,533 @@
+"""Module providing the inverted token index behind the /search endpoint"""
+
+import os
+import re
+import json
+import math
+import mmap
+import struct
+import logging
+import heapq
+import threading
+from pathlib import Path
+from itertools import groupby
+from operator import itemgetter
+from collections import defaultdict
+
+from constants import (
+    CHUNK_MAX_SIZE,
+    SEARCH_INDEX_INTERVAL,
+    SEARCH_INDEX_PASS_BYTES,
+    SEARCH_INDEX_MERGE_FACTOR,
+    SEARCH_INDEX_MAX_SEGMENTS,
+)
+
+# tokens are runs of 2 to 64 word characters, matched case-insensitively
+TOKEN = re.compile(rb"\w{2,64}")
+SEGMENT_MAGIC = b"LSIX2\n"
+# directory entry: postings offset and length, token offset and length
+DIRECTORY_ENTRY = struct.Struct("<QQQH")
+# footer: directory offset and number of entries
+SEGMENT_FOOTER = struct.Struct("<QQ")
+
+
+def tokenize(data):
+    """Returns the set of lowercase tokens of a line (bytes or str)"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return set(TOKEN.findall(data.lower()))
+
+
+def encode_varint(value, out):
+    """Appends value to the bytearray out as a LEB128 varint"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def iter_varints(data):
+    """Yields the varints encoded in data"""
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = shift = 0
+
+
+class PostingsWriter:
+    """Encodes (file id, offset) pairs as varint deltas as they are added in order.
+
+    Offsets are deltas from the previous offset of the same file; a new file
+    restarts them from 0.
+    """
+
+    __slots__ = ("data", "last_file", "last_offset")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.last_file = self.last_offset = 0
+
+    def add(self, file_id, offset):
+        """Appends a pair, not lower than the last one"""
+        if file_id != self.last_file:
+            self.last_offset = 0
+        encode_varint(file_id - self.last_file, self.data)
+        encode_varint(offset - self.last_offset, self.data)
+        self.last_file, self.last_offset = file_id, offset
+
+
+def encode_postings(postings):
+    """Encodes sorted (file id, offset) pairs as varint deltas"""
+    writer = PostingsWriter()
+    for file_id, offset in postings:
+        writer.add(file_id, offset)
+    return bytes(writer.data)
+
+
+def decode_postings(data):
+    """Yields the (file id, offset) pairs of encode_postings"""
+    file_id = offset = 0
+    varints = iter_varints(data)
+    for file_delta in varints:
+        if file_delta:
+            offset = 0
+        file_id += file_delta
+        offset += next(varints)
+        yield file_id, offset
+
+
+def intersect_sorted(streams):
+    """Yields the items found in every one of the ascending streams"""
+    iterators = [iter(stream) for stream in streams]
+    try:
+        current = [next(iterator) for iterator in iterators]
+        while True:
+            highest = max(current)
+            if all(item == highest for item in current):
+                yield highest
+                current = [next(iterator) for iterator in iterators]
+                continue
+            for i, iterator in enumerate(iterators):
+                while current[i] < highest:
+                    current[i] = next(iterator)
+    except StopIteration:
+        return
+
+
+def write_segment(path, items):
+    """Writes the (token, postings) of items, in token order, to path.
+
+    The file holds the postings, then the tokens, then a directory of fixed
+    size entries sorted by token and a footer locating it. Returns the
+    number of tokens written.
+    """
+    tmp_path = path.with_suffix(".tmp")
+    entries = []
+    tokens = bytearray()
+    with open(tmp_path, "wb") as f:
+        f.write(SEGMENT_MAGIC)
+        position = len(SEGMENT_MAGIC)
+        for token, postings in items:
+            f.write(postings)
+            entries.append((position, len(postings), len(tokens), len(token)))
+            tokens += token
+            position += len(postings)
+        f.write(tokens)
+        for postings_offset, postings_length, token_offset, token_length in entries:
+            f.write(
+                DIRECTORY_ENTRY.pack(
+                    postings_offset,
+                    postings_length,
+                    position + token_offset,
+                    token_length,
+                )
+            )
+        f.write(SEGMENT_FOOTER.pack(position + len(tokens), len(entries)))
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+class Segment:
+    """A segment file mapped in memory, its postings found through the token directory.
+
+    Lookups binary search the directory and read only the postings of their
+    tokens. The mapping is released with the last reference to the segment,
+    so a search still reading a merged away segment is not cut short.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mm)
+        if (
+            self.size < len(SEGMENT_MAGIC) + SEGMENT_FOOTER.size
+            or self.mm[: len(SEGMENT_MAGIC)] != SEGMENT_MAGIC
+        ):
+            raise ValueError(f"{path} is not an index segment")
+        self.directory, self.count = SEGMENT_FOOTER.unpack_from(
+            self.mm, self.size - SEGMENT_FOOTER.size
+        )
+        if self.directory + self.count * DIRECTORY_ENTRY.size != (
+            self.size - SEGMENT_FOOTER.size
+        ):
+            raise ValueError(f"{path} has a corrupt directory")
+
+    def entry(self, position):
+        """Returns (token, postings offset, postings length) of a directory entry"""
+        postings_offset, postings_length, token_offset, token_length = (
+            DIRECTORY_ENTRY.unpack_from(
+                self.mm, self.directory + position * DIRECTORY_ENTRY.size
+            )
+        )
+        token = self.mm[token_offset : token_offset + token_length]
+        return token, postings_offset, postings_length
+
+    def postings(self, token):
+        """Returns the encoded postings of token, empty if the segment lacks it"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.entry(middle)[0] < token:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            found, offset, length = self.entry(low)
+            if found == token:
+                return self.mm[offset : offset + length]
+        return b""
+
+    def items(self):
+        """Yields the (token, encoded postings) of the segment in token order"""
+        for position in range(self.count):
+            token, offset, length = self.entry(position)
+            yield token, self.mm[offset : offset + length]
+
+
+def merge_segments(segments, file_ids):
+    """Yields the (token, postings) of segments merged, keeping the postings of file_ids"""
+    items = heapq.merge(*(segment.items() for segment in segments), key=itemgetter(0))
+    for token, group in groupby(items, key=itemgetter(0)):
+        writer = PostingsWriter()
+        pairs = heapq.merge(*(decode_postings(postings) for _, postings in group))
+        for file_id, offset in pairs:
+            if file_id in file_ids:
+                writer.add(file_id, offset)
+        if writer.data:
+            yield token, writer.data
+
+
+def pick_merge(sizes):
+    """Returns the (start, stop) slice of the segments to merge next, None if none.
+
+    sizes are the segment sizes, oldest first. The newest segments of one
+    size tier are merged once there are SEARCH_INDEX_MERGE_FACTOR of them,
+    so every posting is rewritten once per tier rather than on each merge.
+    """
+    factor = SEARCH_INDEX_MERGE_FACTOR
+    if not sizes:
+        return None
+    tiers = [int(math.log(max(size, 1), factor)) for size in sizes]
+    start = len(tiers)
+    while start > 0 and tiers[start - 1] == tiers[-1]:
+        start -= 1
+    if len(tiers) - start >= factor:
+        return start, len(tiers)
+    if len(sizes) > SEARCH_INDEX_MAX_SEGMENTS:
+        run = min(factor, len(sizes))
+        start = min(range(len(sizes) - run + 1), key=lambda i: sum(sizes[i : i + run]))
+        return start, start + run
+    return None
+
+
+def find_line_end(f, start):
+    """Returns the position after the newline ending the line at start, 0 if unfinished"""
+    f.seek(start)
+    position = start
+    while True:
+        chunk = f.read(CHUNK_MAX_SIZE)
+        if not chunk:
+            return 0
+        newline = chunk.find(b"\n")
+        if newline != -1:
+            return position + newline + 1
+        position += len(chunk)
+
+
+class TokenIndex:
+    """On-disk inverted index of the tokens of the log files.
+
+    Every indexing pass tokenizes the complete lines appended since the last
+    one and writes them as a new segment of {token: postings}; postings are
+    (file id, line offset) pairs compressed with delta/varint encoding. A
+    file that is rotated or truncated gets a new id and is indexed again,
+    postings of dropped ids are ignored and removed by the next compaction.
+    """
+
+    def __init__(self):
+        self.index_dir = None
+        self.files = {}
+        self.next_id = 1
+        self.segments = []
+        self.segment_names = []
+        self.next_segment = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        """Checks if an index directory was opened"""
+        return self.index_dir is not None
+
+    def open(self, index_dir):
+        """Loads the index kept in index_dir, creating it if needed"""
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        catalog_path = self.index_dir / "catalog.json"
+        if not catalog_path.is_file():
+            return
+        try:
+            catalog = json.loads(catalog_path.read_text(encoding="utf-8"))
+            segments = [Segment(self.index_dir / n) for n in catalog["segments"]]
+            next_segment = catalog["next_segment"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Rebuilding unreadable search index %s: %s", index_dir, e)
+            return
+        self.files = {int(file_id): info for file_id, info in catalog["files"].items()}
+        self.next_id = catalog["next_id"]
+        self.segments = segments
+        self.segment_names = catalog["segments"]
+        self.next_segment = next_segment
+
+    def save_catalog(self):
+        """Writes the file states and the segment list"""
+        catalog = {
+            "next_id": self.next_id,
+            "files": self.files,
+            "segments": self.segment_names,
+            "next_segment": self.next_segment,
+        }
+        tmp_path = self.index_dir / "catalog.tmp"
+        tmp_path.write_text(json.dumps(catalog), encoding="utf-8")
+        os.replace(tmp_path, self.index_dir / "catalog.json")
+
+    def start(self, index_dir, list_files, interval=SEARCH_INDEX_INTERVAL):
+        """Opens index_dir and indexes the paths returned by list_files in the background"""
+        self.open(index_dir)
+        self.thread = threading.Thread(
+            target=self.run, args=(list_files, interval), name="indexer", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """Stops the background indexer"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self, list_files, interval):
+        """Indexes new data every interval seconds"""
+        while not self.stopped.is_set():
+            try:
+                self.index_pass(list_files())
+            except OSError as e:
+                logging.error("Search indexing failed: %s", e)
+            self.stopped.wait(interval)
+
+    def index_pass(self, paths):
+        """Indexes what was appended to paths since the last pass.
+
+        At most SEARCH_INDEX_PASS_BYTES are read; the rest waits for the
+        next pass. Returns the number of bytes indexed.
+        """
+        ids_by_name = {info["name"]: file_id for file_id, info in self.files.items()}
+        # postings are encoded as they come, files are read in id order to keep them sorted
+        postings = defaultdict(PostingsWriter)
+        budget = SEARCH_INDEX_PASS_BYTES
+        files = dict(self.files)
+        appended = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            file_id = ids_by_name.get(str(path))
+            info = files.get(file_id)
+            if (
+                info is None
+                or info["inode"] != stat.st_ino
+                or stat.st_size < info["size"]
+            ):
+                # new, rotated or truncated: index it from the start under a new id
+                files.pop(file_id, None)
+                file_id, self.next_id = self.next_id, self.next_id + 1
+                info = {"name": str(path), "inode": stat.st_ino, "size": 0}
+            files[file_id] = info
+            if stat.st_size > info["size"]:
+                appended.append((file_id, path))
+        for file_id, path in sorted(appended):
+            if budget <= 0:
+                break
+            info = files[file_id]
+            indexed = self.index_file(path, file_id, info, budget, postings)
+            files[file_id] = dict(info, size=info["size"] + indexed)
+            budget -= indexed
+        # files that disappeared are dropped
+        wanted = {str(path) for path in paths}
+        files = {i: info for i, info in files.items() if info["name"] in wanted}
+
+        segment = None
+        if postings:
+            name = self.new_segment_name()
+            items = ((token, postings[token].data) for token in sorted(postings))
+            write_segment(self.index_dir / name, items)
+            segment = Segment(self.index_dir / name)
+        with self.lock:
+            if segment is not None:
+                self.segments.append(segment)
+                self.segment_names.append(name)
+            self.files = files
+            self.save_catalog()
+        self.compact()
+        return SEARCH_INDEX_PASS_BYTES - budget
+
+    def new_segment_name(self):
+        """Returns the file name of the next segment"""
+        name = f"segment-{self.next_segment}.bin"
+        self.next_segment += 1
+        return name
+
+    def index_file(self, path, file_id, info, budget, postings):
+        """Tokenizes the complete lines after info["size"], returns the bytes consumed.
+
+        A line longer than SEARCH_INDEX_PASS_BYTES can never fit a pass, so
+        only its first budget bytes are indexed and the pass moves past it.
+        """
+        with open(path, "rb") as f:
+            f.seek(info["size"])
+            data = f.read(budget)
+            end = data.rfind(b"\n") + 1
+            if end == 0 and len(data) == budget:
+                line_end = find_line_end(f, info["size"])
+                if line_end - info["size"] > SEARCH_INDEX_PASS_BYTES:
+                    for token in tokenize(data):
+                        postings[token].add(file_id, info["size"])
+                    return line_end - info["size"]
+        position = info["size"]
+        for line in data[:end].split(b"\n")[:-1]:
+            for token in tokenize(line):
+                postings[token].add(file_id, position)
+            position += len(line) + 1
+        return end
+
+    def compact(self):
+        """Merges the runs of segments picked by pick_merge, dropping removed files.
+
+        Only the indexer thread changes the segment list, so the merged
+        segment is written outside the lock; searches keep reading the old
+        segments until they are swapped for it.
+        """
+        picked = pick_merge([segment.size for segment in self.segments])
+        while picked is not None:
+            start, stop = picked
+            with self.lock:
+                segments = self.segments[start:stop]
+                file_ids = set(self.files)
+            name = self.new_segment_name()
+            path = self.index_dir / name
+            if write_segment(path, merge_segments(segments, file_ids)):
+                merged, merged_names = [Segment(path)], [name]
+            else:
+                path.unlink()
+                merged, merged_names = [], []
+            with self.lock:
+                old_names = self.segment_names[start:stop]
+                self.segments[start:stop] = merged
+                self.segment_names[start:stop] = merged_names
+                self.save_catalog()
+            for old_name in old_names:
+                (self.index_dir / old_name).unlink(missing_ok=True)
+            picked = pick_merge([segment.size for segment in self.segments])
+
+    def lookup(self, query):
+        """Returns {file name: offsets} of the lines holding every token of query"""
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        with self.lock:
+            segments = list(self.segments)
+            files = dict(self.files)
+
+        # postings are decoded lazily and merged in step, only the matches are kept
+        matches = defaultdict(list)
+        streams = [self.postings_of(token, segments) for token in tokens]
+        for file_id, offset in intersect_sorted(streams):
+            if file_id in files:
+                matches[files[file_id]["name"]].append(offset)
+        return matches
+
+    @staticmethod
+    def postings_of(token, segments):
+        """Yields the (file id, offset) pairs of token in all segments, ascending"""
+        return heapq.merge(
+            *(decode_postings(segment.postings(token)) for segment in segments)
+        )
+
+    def search(self, query, limit=100, state=None, pattern=None):
+        """Returns up to limit (file name, offset, line) matches and the next cursor state.
+
+        Files are ordered latest modified first and lines newest first. The
+        cursor state holds the files still to search in that order, starting
+        with the file of the last match returned, and the offset of that
+        match, so files appended to between two pages do not move around.
+        Lines that no longer hold the tokens (rewritten files) are left out.
+        """
+        tokens = tokenize(query)
+        matches = self.lookup(query)
+        mtimes = {}
+        for name in matches:
+            if pattern is None or pattern.match(Path(name).name):
+                try:
+                    mtimes[name] = os.stat(name).st_mtime
+                except OSError:
+                    continue
+        if state is None:
+            ordered = sorted(mtimes, key=lambda name: (-mtimes[name], name))
+            first, before = None, None
+        else:
+            files, before = state.get("files"), state.get("offset")
+            if (
+                not isinstance(files, list)
+                or not files
+                or not all(isinstance(name, str) for name in files)
+                or not isinstance(before, int)
+                or isinstance(before, bool)
+            ):
+                raise ValueError("Invalid cursor")
+            first = files[0]
+            ordered = [name for name in files if name in mtimes]
+
+        results = []
+        for position, name in enumerate(ordered):
+            offsets = sorted(matches[name], reverse=True)
+            if name == first:
+                offsets = [offset for offset in offsets if offset < before]
+            with open(name, "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    line = f.readline().rstrip(b"\n")
+                    if not tokens <= tokenize(line):
+                        continue
+                    results.append((name, offset, line))
+                    if len(results) >= limit:
+                        return results, {"files": ordered[position:], "offset": offset}
+        return results, None
+
+
+token_index = TokenIndex()
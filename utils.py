@@ -4,15 +4,67 @@ import re
 import os
 import mmap
 import logging
+import threading
+from collections import OrderedDict
 from http import HTTPStatus
+from itertools import accumulate, islice
 from pathlib import Path
+from typing import NamedTuple
 
+from log_filter import LogFilter, filter_scanned_lines
+from log_catalog import LogCatalog
+from parallel_scan import read_matches_parallel
+from compressed_index import (
+    compression_of,
+    iter_compressed_lines,
+    uncompressed_length,
+)
+from page_cache import page_cache
+from block_summary import block_summaries
+from metrics import metrics
 from constants import (
     LOG_DIR,
     CHUNK_SIZE,
+    CHUNK_MAX_SIZE,
+    FILE_GENERATIONS_MAX_FILES,
+    QUERY_BLOCK_SIZE,
+    QUERY_BATCH_LINES,
     HOSTNAME,
     DEFAULT_PRIMARY_PORT,
+    PARALLEL_SCAN_MIN_SIZE,
+    PAGE_CACHE_RECORD_OVERHEAD,
+    PAGE_CACHE_MAX_PAGE_BYTES,
+    METRICS_SIZE_BUCKETS,
+)
+
+# page reads that missed the page cache, labelled by filtered="true"/"false"
+read_scanned_bytes = metrics.histogram(
+    "log_scanner_read_scanned_bytes",
+    "Bytes of the file a page read went through",
+    ("filtered",),
+    METRICS_SIZE_BUCKETS,
+)
+read_returned_bytes = metrics.histogram(
+    "log_scanner_read_returned_bytes",
+    "Bytes of the lines a page read returned",
+    ("filtered",),
+    METRICS_SIZE_BUCKETS,
 )
+read_lines = metrics.counter(
+    "log_scanner_read_lines_total",
+    "Lines returned by page reads, those that passed a filter as filtered=true",
+    ("filtered",),
+)
+read_skipped_bytes = metrics.counter(
+    "log_scanner_read_skipped_bytes_total",
+    "Bytes of the file page reads skipped because their block summary ruled out a match",
+)
+
+# (device, inode): (last size seen, times the file was seen shrinking), in LRU
+# order. A file dropped from it starts over at generation 0, which cached pages
+# still cannot be served for: a hit also checks the newest line of the page.
+file_generations = OrderedDict()
+file_generations_lock = threading.Lock()
 
 
 def is_valid_regex(file_name) -> bool:
@@ -25,15 +77,9 @@ def is_valid_regex(file_name) -> bool:
 
 
 def get_first_matching_file(file_pattern):
-    """Searches the log directory for the first file matching the regex pattern."""
+    """Searches the log catalog for the first file matching the regex pattern."""
     try:
-        # get regex pattern
-        pattern = re.compile(file_pattern)
-        # go through the log directory and get the first matched pattern
-        for log_file in LOG_DIR.iterdir():
-            if log_file.is_file() and pattern.match(log_file.name):
-                return log_file
-        return None
+        return log_catalog.first_match(file_pattern)
     except Exception as e:
         logging.error("Error finding matching file: %s", e)
         return None
@@ -57,15 +103,29 @@ def is_valid_file(file_path):
 def get_latest_log_file():
     """Returns the file name for latest created log file"""
     try:
-        log_files = [f for f in LOG_DIR.iterdir() if f.is_file() and is_valid_file(f)]
-        if not log_files:
-            return None
-        # return the file with latest modified time
-        return max(log_files, key=lambda f: f.stat().st_mtime).name
+        return log_catalog.latest()
     except Exception:
         return None
 
 
+# Valid files of LOG_DIR, shared by all requests
+log_catalog = LogCatalog(LOG_DIR, is_valid_file)
+
+
+class LogRecord(NamedTuple):
+    """A log line as read from the file: its byte offset and its raw bytes"""
+
+    offset: int
+    data: bytes
+    # {field: value} extracted by a FieldQuery with fields, None otherwise
+    fields: dict = None
+
+    @property
+    def text(self):
+        """The decoded line"""
+        return self.data.decode(errors="ignore")
+
+
 def read_logs_reverse(
     file_path,
     filter_text=None,
@@ -73,59 +133,440 @@ def read_logs_reverse(
     limit=100,
     hostname=HOSTNAME,
     server_port=DEFAULT_PRIMARY_PORT,
+    scan_workers=0,
 ) -> (list, int):
-    """Reads logs in reverse order efficiently while ensuring offset is the actual file position"""
+    """Reads logs in reverse order efficiently while ensuring offset is the actual file position
+
+    With scan_workers > 0, filtered reads of large files are spread over that many processes.
+    """
+    return collect_logs(
+        iter_logs_reverse(
+            file_path, filter_text, offset, limit, hostname, server_port, scan_workers
+        )
+    )
+
+
+def collect_logs(reader) -> (list, int):
+    """Drains a reader made by iter_logs_reverse into (logs, next_offset)"""
     logs = []
+    while True:
+        try:
+            logs.append(next(reader))
+        except StopIteration as stop:
+            return logs, stop.value
+
+
+def iter_logs_reverse(
+    file_path,
+    filter_text=None,
+    offset=None,
+    limit=100,
+    hostname=HOSTNAME,
+    server_port=DEFAULT_PRIMARY_PORT,
+    scan_workers=0,
+    begin=0,
+    query=None,
+    offsets=False,
+):
+    """Lazily yields the {"log", "source", "file"} entries of read_logs_reverse.
+
+    All entries share the same source and file strings. Entries of a query
+    with fields also have the "fields" extracted from their line, and with
+    offsets=True every entry has the "offset" of its line, which as the
+    offset of a page returns the lines before it. The generator returns the
+    next offset (None on the last page).
+    """
+    source = f"{hostname}:{server_port}"
+    file_name = str(file_path)
+    records = iter_log_records(
+        file_path, filter_text, offset, limit, scan_workers, begin, query
+    )
+    while True:
+        try:
+            record = next(records)
+        except StopIteration as stop:
+            return stop.value
+        entry = {"log": record.text, "source": source, "file": file_name}
+        if record.fields is not None:
+            entry["fields"] = record.fields
+        if offsets:
+            entry["offset"] = record.offset
+        yield entry
+
+
+def iter_log_lines(
+    file_path,
+    filter_text=None,
+    offset=None,
+    limit=100,
+    scan_workers=0,
+    begin=0,
+    query=None,
+):
+    """Lazily yields the decoded lines of a page, for responses with page-level metadata"""
+    records = iter_log_records(
+        file_path, filter_text, offset, limit, scan_workers, begin, query
+    )
+    while True:
+        try:
+            record = next(records)
+        except StopIteration as stop:
+            return stop.value
+        yield record.text
+
+
+def iter_log_records(
+    file_path,
+    filter_text=None,
+    offset=None,
+    limit=100,
+    scan_workers=0,
+    begin=0,
+    query=None,
+):
+    """Lazily yields LogRecords of [begin, offset), newest first.
+
+    begin has to be the start of a line. A FieldQuery further selects the
+    lines and extracts their fields. Lines are only decoded by the
+    consumer. The generator returns the next offset (None on the last page).
+    Offsets of compressed files are positions in the uncompressed stream.
+    Pages read to the end are kept in the page cache, unless they grow past
+    PAGE_CACHE_MAX_PAGE_BYTES (or the cache budget): those are streamed
+    without holding their records.
+    """
+    if page_cache.max_bytes <= 0:
+        return (
+            yield from read_log_records(
+                file_path, filter_text, offset, limit, scan_workers, begin, query
+            )
+        )
+    key = get_page_key(file_path, filter_text, offset, limit, begin, query)
+    cached = page_cache.get(key)
+    if cached is not None and is_page_current(file_path, cached[0]):
+        records, next_offset = cached
+        yield from records
+        return next_offset
+
+    records = []
+    size = PAGE_CACHE_RECORD_OVERHEAD
+    max_size = min(page_cache.max_bytes, PAGE_CACHE_MAX_PAGE_BYTES)
+    reader = read_log_records(
+        file_path, filter_text, offset, limit, scan_workers, begin, query
+    )
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration as stop:
+            if records is not None:
+                page_cache.put(key, (tuple(records), stop.value), size)
+            return stop.value
+        if records is not None:
+            records.append(record)
+            size += len(record.data) + PAGE_CACHE_RECORD_OVERHEAD
+            if size > max_size:
+                # too large to cache, keep streaming in constant memory
+                records = None
+        yield record
+
+
+def file_generation(stat):
+    """Returns how many times the file of stat was seen shrinking, as by a copytruncate"""
+    identity = (stat.st_dev, stat.st_ino)
+    with file_generations_lock:
+        size, generation = file_generations.pop(identity, (0, 0))
+        if stat.st_size < size:
+            generation += 1
+        file_generations[identity] = (stat.st_size, generation)
+        while len(file_generations) > FILE_GENERATIONS_MAX_FILES:
+            file_generations.popitem(last=False)
+    return generation
+
+
+def is_page_current(file_path, records):
+    """Checks that the newest line of a cached page is still at its offset.
+
+    It catches a file truncated and grown again between two reads, which
+    the generation of get_page_key cannot see.
+    """
+    if not records or compression_of(file_path):
+        return True
+    newest = records[0]
+    try:
+        with open(file_path, "rb") as f:
+            return os.pread(f.fileno(), len(newest.data), newest.offset) == newest.data
+    except OSError:
+        return False
+
+
+def get_page_key(file_path, filter_text, offset, limit, begin, query=None):
+    """Returns the page cache key of a page of file_path.
+
+    A page before an offset inside the file only depends on bytes that an
+    append does not touch, so it is keyed by the file identity and the
+    number of times the file was seen shrinking, and stays cached while the
+    file grows. A truncation starts a new generation, so pages of the old
+    contents are not served once the file grows past their offset again.
+    The head page (and any page of a file that shrank below its offset) is
+    also keyed by size and mtime.
+    """
+    stat = os.stat(file_path)
+    identity = (stat.st_dev, stat.st_ino, file_generation(stat))
+    if offset is None or offset > stat.st_size:
+        identity += (stat.st_size, stat.st_mtime)
+    query_key = query.key if query is not None else None
+    return identity + (offset, limit, filter_text, begin, query_key)
+
+
+def read_log_records(
+    file_path,
+    filter_text=None,
+    offset=None,
+    limit=100,
+    scan_workers=0,
+    begin=0,
+    query=None,
+):
+    """Reads the LogRecords of iter_log_records without the page cache.
+
+    A read drained to the end is counted in the metrics: the bytes between
+    its offset and the next one as scanned, the lines yielded as returned.
+    """
+    if compression_of(file_path):
+        length = uncompressed_length(file_path)
+    else:
+        length = os.path.getsize(file_path)
+    end = length if offset is None else min(offset, length)
+    returned = 0
+    lines = 0
+    records = scan_log_records(
+        file_path, filter_text, end, limit, scan_workers, begin, query
+    )
+    while True:
+        try:
+            record = next(records)
+        except StopIteration as stop:
+            next_offset = stop.value
+            break
+        returned += len(record.data)
+        lines += 1
+        yield record
+
+    filtered = "true" if filter_text or query is not None else "false"
+    stop = begin if next_offset is None else next_offset
+    read_scanned_bytes.observe(max(end - stop, 0), filtered=filtered)
+    read_returned_bytes.observe(returned, filtered=filtered)
+    read_lines.inc(lines, filtered=filtered)
+    return next_offset
+
+
+def scan_log_records(
+    file_path,
+    filter_text=None,
+    offset=None,
+    limit=100,
+    scan_workers=0,
+    begin=0,
+    query=None,
+):
+    """Scans the file for the LogRecords of read_log_records.
+
+    Queries are only read from uncompressed files, on a single process.
+    """
+    if compression_of(file_path):
+        lines = iter_compressed_lines(file_path, filter_text, offset, limit, begin)
+        while True:
+            try:
+                start, data = next(lines)
+            except StopIteration as stop:
+                return stop.value
+            yield LogRecord(start, data)
+
     file_size = os.path.getsize(file_path)
     # for the first request start from the end of the file
     if offset is None:
         offset = file_size
 
-    found_logs = 0
-    last_valid_offset = offset
-
     with open(file_path, "rb") as f:
         with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-            while offset > 0:
-                chunk_size = min(CHUNK_SIZE, offset)
-                new_offset = offset - chunk_size
-
-                mm.seek(new_offset)
-                chunk = mm.read(chunk_size).decode(errors="ignore")
-
-                lines = chunk.split("\n")
-                if new_offset > 0:
-                    # this indicates that a parital line exists at the begining of the chunk
-                    lines = lines[1:]
-
-                for line in reversed(lines):
-                    # Empty lines are skipped
-                    if not line.strip():
-                        continue
-                    # only add to the log file if the filter texts exists
-                    if filter_text and not re.search(filter_text, line):
-                        continue
-                    log_entry = {
-                        "log": line,
-                        "source": f"{hostname}:{server_port}",
-                        "file": str(file_path),
-                    }
-
-                    logs.append(log_entry)
-                    found_logs += 1
-
-                    if found_logs >= limit:
-                        remaining_data = "\n".join(lines[:-found_logs])
-                        last_valid_offset = (
-                            new_offset + len(remaining_data.encode()) + 1
+            if query is None and not filter_text:
+                return (
+                    yield from iter_unfiltered_records(
+                        mm, min(offset, len(mm)), limit, begin
+                    )
+                )
+            if (
+                query is None
+                and scan_workers
+                and offset - begin >= PARALLEL_SCAN_MIN_SIZE
+            ):
+                matches, next_offset = read_matches_parallel(
+                    file_path,
+                    mm,
+                    filter_text,
+                    min(offset, len(mm)),
+                    limit,
+                    scan_workers,
+                    begin,
+                )
+                for start, data in matches:
+                    yield LogRecord(start, data)
+                return next_offset
+            log_filter = LogFilter(filter_text) if filter_text else None
+            stat = os.fstat(f.fileno())
+            with block_summaries.summary_for(file_path, stat) as summary:
+                if query is not None:
+                    return (
+                        yield from iter_query_records(
+                            mm,
+                            query,
+                            min(offset, len(mm)),
+                            limit,
+                            begin,
+                            log_filter,
+                            summary,
                         )
-                        break
+                    )
+                return (
+                    yield from iter_filtered_records(
+                        mm, log_filter, min(offset, len(mm)), limit, begin, summary
+                    )
+                )
+
 
-                offset = new_offset
+def iter_unfiltered_records(mm, offset, limit, begin=0):
+    """Yields the LogRecords of [begin, offset), newest first.
 
-    next_offset = last_valid_offset if found_logs >= limit else None
+    Chunks start right after a newline found with rfind, so a line never
+    straddles two chunks and offsets are exact byte positions. The first
+    chunk is CHUNK_SIZE bytes; the next ones are sized from the average line
+    length seen so far to hold the rest of the page, up to CHUNK_MAX_SIZE,
+    so deep pages take few reads and little is split beyond the page.
+    """
+    found_logs = 0
+    lines_read = 0
+    chunk_size = CHUNK_SIZE
+    end = offset
+    while end > begin:
+        chunk_start = begin
+        if end - begin > chunk_size:
+            chunk_start = max(mm.rfind(b"\n", begin, end - chunk_size) + 1, begin)
+        lines = mm[chunk_start:end].split(b"\n")
+        line_end = end
+        for line in reversed(lines):
+            line_start = line_end - len(line)
+            line_end = line_start - 1
+            # Empty lines are skipped
+            if not line.strip():
+                continue
+            yield LogRecord(line_start, line)
+            found_logs += 1
+            if found_logs >= limit:
+                return line_start if line_start > begin else None
+        lines_read += len(lines)
+        end = chunk_start
+        average = (offset - end) / lines_read
+        chunk_size = int(average * (limit - found_logs + 1))
+        chunk_size = min(max(chunk_size, CHUNK_SIZE), CHUNK_MAX_SIZE)
+    return None
+
+
+def iter_query_records(
+    mm, query, offset, limit, begin=0, log_filter=None, summary=None
+):
+    """Yields the LogRecords of [begin, offset) selected by a FieldQuery, newest first.
+
+    The query sees the lines a batch at a time. Without log_filter, the
+    longest literal value of the where clause is looked for with a
+    LogFilter so that only the lines holding it are parsed at all.
+    """
+    if log_filter is None:
+        log_filter = query.literal_filter()
+    found_logs = 0
+    for starts, lines in iter_line_batches(mm, offset, begin, log_filter, summary):
+        selected, fields = query.select(lines)
+        for index, row in enumerate(selected):
+            line_fields = None
+            if fields is not None:
+                line_fields = {field: fields[field][index] for field in fields}
+            yield LogRecord(starts[row], lines[row], line_fields)
+            found_logs += 1
+            if found_logs >= limit:
+                return starts[row] if starts[row] > begin else None
+    return None
 
-    return logs, next_offset
+
+def iter_line_batches(mm, offset, begin=0, log_filter=None, summary=None):
+    """Yields (starts, lines) batches of the lines of [begin, offset), newest first.
+
+    With log_filter a batch holds up to QUERY_BATCH_LINES matching lines.
+    Otherwise a batch is a newline aligned block, QUERY_BLOCK_SIZE bytes at
+    first and twice as large every time up to CHUNK_MAX_SIZE.
+    """
+    if log_filter is not None:
+        spans = iter_matching_spans(mm, log_filter, offset, begin, summary)
+        while True:
+            batch = list(islice(spans, QUERY_BATCH_LINES))
+            if not batch:
+                return
+            yield [start for start, _ in batch], [
+                mm[start:stop] for start, stop in batch
+            ]
+
+    block_size = QUERY_BLOCK_SIZE
+    end = offset
+    while end > begin:
+        block_start = begin
+        if end - begin > block_size:
+            block_start = max(mm.rfind(b"\n", begin, end - block_size) + 1, begin)
+        lines = mm[block_start:end].split(b"\n")
+        # line i starts after the i lines before it and their newlines
+        starts = list(
+            accumulate(map((1).__add__, map(len, lines)), initial=block_start)
+        )
+        del starts[-1]
+        starts.reverse()
+        lines.reverse()
+        # every line of the block goes through the query
+        filter_scanned_lines.inc(len(lines))
+        yield starts, lines
+        end = block_start
+        block_size = min(block_size * 2, CHUNK_MAX_SIZE)
+
+
+def iter_matching_spans(mm, log_filter, offset, begin=0, summary=None):
+    """Yields the spans of log_filter.iter_matching_lines, skipping ruled out blocks.
+
+    Blocks whose summary shows they cannot hold the filter are not searched;
+    the skipped bytes are counted as they are passed.
+    """
+    positions = summary.filter_positions(log_filter) if summary else None
+    if positions is None:
+        yield from log_filter.iter_matching_lines(mm, offset, begin)
+        return
+    end = offset
+    for start, stop in summary.candidate_ranges(positions, begin, offset):
+        if end > stop:
+            read_skipped_bytes.inc(end - stop)
+        yield from log_filter.iter_matching_lines(mm, stop, start)
+        end = start
+    if end > begin:
+        read_skipped_bytes.inc(end - begin)
+
+
+def iter_filtered_records(mm, log_filter, offset, limit, begin=0, summary=None):
+    """Yields LogRecords matching log_filter in [begin, offset)"""
+    found_logs = 0
+    for start, stop in iter_matching_spans(mm, log_filter, offset, begin, summary):
+        line = mm[start:stop]
+        # Empty lines are skipped
+        if not line.strip():
+            continue
+        yield LogRecord(start, line)
+        found_logs += 1
+        if found_logs >= limit:
+            # the next page ends right before the oldest line returned
+            return start if start > begin else None
+    return None
 
 
 def get_file_path(filename=None, is_regex=False):
@@ -159,11 +600,13 @@ def get_response(
     limit=100,
     has_next=False,
     next_link=None,
+    line=None,
 ):
     """Get the response json"""
     return {
         "pagination": {
             "offset": offset,
+            "line": line,
             "limit": limit,
             "has_next": has_next,
             "next": next_link,
@@ -172,10 +615,18 @@ def get_response(
     }
 
 
-def get_next_url(filename, next_offset, limit, filter_text):
-    """Get the next url"""
+def get_next_url(
+    filename, next_offset, limit, filter_text, next_line=None, next_cursor=None
+):
+    """Get the next url, as a line number or composite cursor when one is given"""
+    if next_line is not None:
+        cursor = f"line={next_line}"
+    elif next_cursor is not None:
+        cursor = f"cursor={next_cursor}"
+    else:
+        cursor = f"offset={next_offset}"
     next_url = (
-        f"/logs?filename={filename}&offset={next_offset}&limit={limit}"
+        f"/logs?filename={filename}&{cursor}&limit={limit}"
         if next_offset is not None
         else None
     )